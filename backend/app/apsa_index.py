@@ -0,0 +1,351 @@
+"""
+Índice en memoria de la carga APSA vigente (bitmaps por valor de filtro).
+
+La última carga es de solo lectura hasta el próximo upload, así que en vez
+de armar un SQL por cada combinación de filtros de /apsa/list se guarda, por
+proceso, solo lo necesario para resolver filtros y orden:
+- los ids en el orden del listado (subsistema, codigo_cmdic, id) y su
+  permutación ordenada (para continuar desde un cursor keyset)
+- un bitmap empaquetado (np.packbits, 1 bit/fila) por valor de disciplina,
+  status y estado Aconex (match código / match código+SS)
+- subsistema como rango [inicio, fin) (las filas ya vienen ordenadas por él)
+
+Una combinación de filtros es AND/OR de bitmaps + un slice; las columnas de
+la página (≤ 500 filas) se leen por id con `WHERE id = ANY(:ids)`. Así el
+índice pesa ~20 bytes/fila por worker en vez de una tupla completa por fila.
+
+El índice se reconstruye en un thread de fondo al publicar una carga
+(schedule_rebuild), leyendo cargas e ids en una sola transacción REPEATABLE
+READ. get() compara solo ids de carga: es suficiente porque el upload
+commitea la carga y sus filas juntas (_store_load), así que un worker que
+construye a mitad de un upload indexa la carga anterior, completa. Mientras no esté listo (o si apunta a cargas viejas) get()
+retorna None y el caller usa SQL; ensure_building() lo arranca desde un
+request solo si no hay uno en curso, y tras un error espera
+APSA_INDEX_RETRY_SECONDS. La búsqueda libre (q) siempre va por SQL (índices trigram).
+"""
+import logging
+import sys
+import threading
+from array import array
+from datetime import datetime, timezone
+from time import monotonic, perf_counter
+
+import numpy as np
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from .config import get_settings
+from .db import SessionLocal
+from .models.load import Load, SourceEnum
+from .models.apsa_protocol import ApsaProtocol
+
+logger = logging.getLogger(__name__)
+
+
+class ApsaLoadIndex:
+    """Índice inmutable de una combinación (carga APSA, carga ACONEX)."""
+
+    def __init__(
+        self, apsa_id: int, aconex_id: int | None, ids: np.ndarray,
+        subsistema_ranges: dict[str, tuple[int, int]],
+        disciplina_codes: np.ndarray, disciplina_values: list[str],
+        status_codes: np.ndarray, status_values: list[str],
+        has_code: np.ndarray, has_code_ss: np.ndarray,
+    ):
+        self.apsa_id = apsa_id
+        self.aconex_id = aconex_id
+        self.ids = ids                      # orden del listado
+        self.n = len(ids)
+        self.built_at = datetime.now(timezone.utc)
+        self.build_ms = 0.0
+
+        # posición de cada id (para continuar desde un cursor keyset)
+        self._id_order = np.argsort(self.ids, kind="stable")
+        self._ids_sorted = self.ids[self._id_order]
+        self.subsistema_ranges = subsistema_ranges
+
+        self.bitmaps = {
+            "disciplina": {v: np.packbits(disciplina_codes == i) for i, v in enumerate(disciplina_values)},
+            "status": {v: np.packbits(status_codes == i) for i, v in enumerate(status_values)},
+        }
+        self.has_code = np.packbits(has_code)
+        self.has_code_ss = np.packbits(has_code_ss)
+        self.memory = self._memory_footprint()
+
+    def _empty(self) -> np.ndarray:
+        return np.zeros((self.n + 7) // 8, dtype=np.uint8)
+
+    def positions(
+        self, *,
+        subsistema: str | None = None,
+        disciplina: str | None = None,
+        grupo_disciplinas: list[str] | None = None,
+        status: str | None = None,
+        cargado: bool = False,
+        error_ss: bool = False,
+        sin_aconex: bool = False,
+    ) -> np.ndarray:
+        """Posiciones (en orden del listado) de las filas que cumplen los filtros."""
+        lo, hi = 0, self.n
+        if subsistema:
+            if subsistema not in self.subsistema_ranges:
+                return np.empty(0, dtype=np.int64)
+            lo, hi = self.subsistema_ranges[subsistema]
+
+        masks = []
+        if disciplina:
+            masks.append(self.bitmaps["disciplina"].get(disciplina, self._empty()))
+        if grupo_disciplinas is not None:
+            m = self._empty()
+            for d in grupo_disciplinas:
+                if d in self.bitmaps["disciplina"]:
+                    m = m | self.bitmaps["disciplina"][d]
+            masks.append(m)
+        if status:
+            masks.append(self.bitmaps["status"].get(status, self._empty()))
+        if cargado:
+            masks.append(self.has_code_ss)
+        if error_ss:
+            masks.append(self.has_code & ~self.has_code_ss)
+        if sin_aconex:
+            masks.append(~self.has_code)
+
+        if not masks:
+            return np.arange(lo, hi, dtype=np.int64)
+        acc = masks[0]
+        for m in masks[1:]:
+            acc = acc & m
+        bits = np.unpackbits(acc, count=self.n)[lo:hi]
+        return np.flatnonzero(bits) + lo
+
+    def position_of_id(self, row_id: int) -> int | None:
+        i = int(np.searchsorted(self._ids_sorted, row_id))
+        if i < self.n and self._ids_sorted[i] == row_id:
+            return int(self._id_order[i])
+        return None
+
+    def after_id(self, positions: np.ndarray, row_id: int) -> np.ndarray | None:
+        """Posiciones posteriores a la fila `row_id` (cursor keyset). None si el id no es de esta carga."""
+        pos = self.position_of_id(row_id)
+        if pos is None:
+            return None
+        return positions[int(np.searchsorted(positions, pos, side="right")):]
+
+    @staticmethod
+    def _bit(packed: np.ndarray, pos: int) -> bool:
+        # np.packbits es big-endian: la fila 0 es el bit más alto del primer byte
+        return bool((packed[pos >> 3] >> (7 - (pos & 7))) & 1)
+
+    def page_rows(self, db, page_pos: np.ndarray) -> list[tuple]:
+        """
+        Filas de la página en el orden de `page_pos`, con la forma del SQL de
+        /apsa/list: (id, codigo, descripcion, tag, subsistema, tipo, status, has_code, has_code_ss).
+        Las columnas se leen por id; el estado Aconex sale de los bitmaps.
+        """
+        if len(page_pos) == 0:
+            return []
+        page_ids = self.ids[page_pos].tolist()
+        fetched = db.execute(
+            select(
+                ApsaProtocol.id,
+                ApsaProtocol.codigo_cmdic,
+                ApsaProtocol.descripcion,
+                ApsaProtocol.tag,
+                ApsaProtocol.subsistema,
+                ApsaProtocol.tipo,
+                ApsaProtocol.status_bim360,
+            ).where(ApsaProtocol.id == func.any_(bindparam("page_ids", page_ids, type_=ARRAY(ApsaProtocol.id.type))))
+        ).all()
+        by_id = {r[0]: tuple(r) for r in fetched}
+        rows = []
+        for pos, row_id in zip(page_pos.tolist(), page_ids):
+            r = by_id.get(row_id)
+            if r is not None:   # borrada a mano después del build: se omite
+                rows.append(r + (self._bit(self.has_code, pos), self._bit(self.has_code_ss, pos)))
+        return rows
+
+    def _memory_footprint(self) -> dict:
+        arrays = self.ids.nbytes + self._id_order.nbytes + self._ids_sorted.nbytes
+        arrays += self.has_code.nbytes + self.has_code_ss.nbytes
+        bitmaps = sum(b.nbytes for per_dim in self.bitmaps.values() for b in per_dim.values())
+        ranges = sys.getsizeof(self.subsistema_ranges) + sum(
+            sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.subsistema_ranges.items()
+        )
+        return {
+            "arrays_bytes": arrays,
+            "bitmaps_bytes": bitmaps,
+            "subsistemas_bytes": ranges,
+            "total_bytes": arrays + bitmaps + ranges,
+            "bitmap_count": sum(len(v) for v in self.bitmaps.values()),
+        }
+
+    def info(self) -> dict:
+        return {
+            "apsa_load_id": self.apsa_id,
+            "aconex_load_id": self.aconex_id,
+            "rows": self.n,
+            "subsistemas": len(self.subsistema_ranges),
+            "built_at": self.built_at.isoformat(),
+            "build_ms": round(self.build_ms, 2),
+            "memory": self.memory,
+        }
+
+
+# --- Índice vigente del proceso + reconstrucción en background ---
+_current: ApsaLoadIndex | None = None
+_lock = threading.Lock()
+_building = False
+_rebuild_again = False
+_last_error: str | None = None
+_last_error_at: float | None = None   # monotonic(); backoff de ensure_building()
+
+
+def _latest_ids(db) -> tuple[int | None, int | None]:
+    def latest(source):
+        return db.execute(
+            select(Load.id).where(Load.source == source)
+            .order_by(Load.loaded_at.desc(), Load.id.desc()).limit(1)
+        ).scalar()
+    return latest(SourceEnum.APSA), latest(SourceEnum.ACONEX)
+
+
+def build_index(db, apsa_id: int, aconex_id: int | None, flags) -> ApsaLoadIndex:
+    """Recorre la carga en el orden del listado y arma el índice (sin guardar las filas)."""
+    t0 = perf_counter()
+    code_only_exists, code_and_ss_exists = flags(aconex_id)
+    result = db.execute(
+        select(
+            ApsaProtocol.id,
+            ApsaProtocol.subsistema,
+            ApsaProtocol.disciplina,
+            ApsaProtocol.status_bim360,
+            code_only_exists.label("has_code"),
+            code_and_ss_exists.label("has_code_ss"),
+        )
+        .where(ApsaProtocol.load_id == apsa_id)
+        .order_by(ApsaProtocol.subsistema.asc(), ApsaProtocol.codigo_cmdic.asc(), ApsaProtocol.id.asc())
+        .execution_options(yield_per=5000)
+    )
+    # arrays compactos mientras se recorre; los valores de disciplina/status se guardan como código
+    ids, disc_codes, status_codes = array("q"), array("H"), array("H")
+    has_code, has_code_ss = array("b"), array("b")
+    disc_values: dict[str, int] = {}
+    status_values: dict[str, int] = {}
+    ranges: dict[str, tuple[int, int]] = {}
+    for pos, (row_id, subs, disc, status, code, code_ss) in enumerate(result):
+        ids.append(row_id)
+        if subs in ranges:
+            ranges[subs] = (ranges[subs][0], pos + 1)
+        else:
+            ranges[subs] = (pos, pos + 1)
+        disc_codes.append(disc_values.setdefault("" if disc is None else str(disc), len(disc_values)))
+        status_codes.append(status_values.setdefault("" if status is None else str(status), len(status_values)))
+        has_code.append(bool(code))
+        has_code_ss.append(bool(code_ss))
+
+    idx = ApsaLoadIndex(
+        apsa_id, aconex_id,
+        ids=np.frombuffer(ids, dtype=np.int64).copy(),
+        subsistema_ranges=ranges,
+        disciplina_codes=np.frombuffer(disc_codes, dtype=np.uint16),
+        disciplina_values=list(disc_values),
+        status_codes=np.frombuffer(status_codes, dtype=np.uint16),
+        status_values=list(status_values),
+        has_code=np.frombuffer(has_code, dtype=np.int8).astype(bool),
+        has_code_ss=np.frombuffer(has_code_ss, dtype=np.int8).astype(bool),
+    )
+    idx.build_ms = (perf_counter() - t0) * 1000
+    return idx
+
+
+def _rebuild_worker(flags) -> None:
+    global _current, _building, _rebuild_again, _last_error, _last_error_at
+    while True:
+        db = SessionLocal()
+        try:
+            # una sola foto (REPEATABLE READ) para las cargas vigentes y sus filas; como el
+            # upload commitea la carga junto con sus filas, nunca se indexa una carga a medias
+            db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            apsa_id, aconex_id = _latest_ids(db)
+            if apsa_id:
+                idx = build_index(db, apsa_id, aconex_id, flags)
+                with _lock:
+                    _current = idx
+                    _last_error = _last_error_at = None
+                mb = idx.memory["total_bytes"] / 1024 / 1024
+                logger.info(f"✅ Índice APSA listo: load {apsa_id}, {idx.n:,} filas, {mb:.1f} MB, {idx.build_ms:.0f} ms")
+            else:
+                with _lock:
+                    _current = None
+        except Exception as e:
+            logger.exception("❌ Error reconstruyendo índice APSA")
+            with _lock:
+                _last_error = str(e)
+                _last_error_at = monotonic()
+        finally:
+            db.close()
+
+        with _lock:
+            # si publicaron otra carga mientras construíamos, repetir
+            if _rebuild_again:
+                _rebuild_again = False
+                continue
+            _building = False
+            return
+
+
+def _start(flags) -> None:
+    threading.Thread(target=_rebuild_worker, args=(flags,), name="apsa-index-rebuild", daemon=True).start()
+
+
+def schedule_rebuild(flags) -> bool:
+    """
+    Reconstruye en un thread de fondo (hook de publicación y rebuild de admin).
+    `flags(aconex_id)` retorna los EXISTS (match código, match código+SS) que usa
+    /apsa/list, para que el índice y el SQL calculen el estado Aconex igual.
+    Si ya había uno en curso, se repite al terminar (la carga cambió) y retorna False.
+    """
+    global _building, _rebuild_again
+    with _lock:
+        if _building:
+            _rebuild_again = True
+            return False
+        _building = True
+    _start(flags)
+    return True
+
+
+def ensure_building(flags) -> bool:
+    """
+    Para los requests que no encuentran índice: arranca un build solo si no hay
+    uno en curso y no falló hace menos de APSA_INDEX_RETRY_SECONDS. Nunca marca
+    repetición: eso lo decide solo schedule_rebuild (hubo una carga nueva).
+    """
+    global _building
+    retry = get_settings().APSA_INDEX_RETRY_SECONDS
+    with _lock:
+        if _building or (_last_error_at is not None and monotonic() - _last_error_at < retry):
+            return False
+        _building = True
+    _start(flags)
+    return True
+
+
+def get(apsa_id: int, aconex_id: int | None) -> ApsaLoadIndex | None:
+    """Índice vigente si corresponde exactamente a esas cargas; si no, None (usar SQL)."""
+    with _lock:
+        idx = _current
+    if idx is None or idx.apsa_id != apsa_id or idx.aconex_id != aconex_id:
+        return None
+    return idx
+
+
+def status() -> dict:
+    with _lock:
+        idx, building, error = _current, _building, _last_error
+    return {
+        "ready": idx is not None,
+        "building": building,
+        "last_error": error,
+        "index": idx.info() if idx is not None else None,
+    }
@@ -0,0 +1,400 @@
+"""
+Artefactos de export pre-generados al publicar una carga.
+
+Los exports sin filtros (Log Protocolos completo, errores de SS, ACONEX sin
+match, duplicados) tienen el mismo contenido para todos hasta el próximo
+upload. En vez de re-ejecutar la conciliación en cada descarga:
+
+1. Al publicar una carga, un thread de fondo genera cada artefacto registrado
+   (register()) a disco, una sola vez.
+2. La ubicación se direcciona por contenido de entrada: sha256(nombre, ids
+   de carga de las fuentes de las que depende, versión) = `<address>`.
+   Cualquier worker (proceso) que vea las mismas cargas encuentra el mismo
+   artefacto; una carga nueva simplemente apunta a otra dirección.
+   El archivo de datos se llama `<address>.<sha del contenido>.<ext>` y
+   `<address>.json` apunta a él: el os.replace del .json es el único punto
+   de commit, así etag/size siempre describen el archivo al que apuntan
+   (el XLSX no sale idéntico byte a byte entre dos renders). Además los
+   renders de una misma dirección se serializan con flock sobre
+   `<address>.lock` (dos uploads seguidos en workers distintos).
+3. Se sirven con ETag (sha256 del contenido), If-None-Match → 304 y Range de
+   un tramo → 206 (la FileResponse de Starlette 0.37 no soporta Range).
+
+El render lee cargas y filas en una sola transacción REPEATABLE READ, y el
+render disparado por una publicación (schedule_render(force_sources=...))
+re-genera siempre los artefactos que dependen de esa fuente aunque su
+dirección ya exista: si un render en otro worker se cruzó con la ingesta, el
+de la publicación lo sobrescribe.
+
+Si el artefacto aún no existe (render en curso) el endpoint genera en vivo,
+igual que antes. Los exports con filtros siempre se generan en vivo.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock; el .json sigue siendo consistente, solo puede renderizarse dos veces
+    fcntl = None
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import select
+
+from .config import get_settings
+from .db import SessionLocal
+from .models.load import Load, SourceEnum
+
+logger = logging.getLogger(__name__)
+
+# Subir si cambia el formato de algún export: invalida todo lo generado
+RENDER_VERSION = 2
+_CHUNK = 64 * 1024
+
+
+@dataclass(frozen=True)
+class ArtifactSpec:
+    name: str                       # p.ej. "apsa_log.csv"
+    sources: tuple[SourceEnum, ...]  # cargas de las que depende el contenido
+    media_type: str
+    filename: str                   # nombre de descarga
+    render: Callable                # render(db, load_ids: dict, dest_path) -> filas
+
+
+_registry: dict[str, ArtifactSpec] = {}
+_lock = threading.Lock()
+_rendering = False
+_render_again = False
+_force_sources: set = set()   # fuentes publicadas pendientes de re-render forzado
+_last_run: dict = {}
+
+
+def register(name: str, *, sources, media_type: str, filename: str, render: Callable) -> None:
+    _registry[name] = ArtifactSpec(name, tuple(sources), media_type, filename, render)
+
+
+def cache_dir() -> str:
+    d = get_settings().EXPORT_CACHE_DIR or os.path.join(tempfile.gettempdir(), "quality_exports")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def _address(spec: ArtifactSpec, load_ids: dict) -> str | None:
+    ids = [load_ids.get(s) for s in spec.sources]
+    if any(i is None for i in ids):
+        return None
+    raw = json.dumps([spec.name, [s.value for s in spec.sources], ids, RENDER_VERSION])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _meta_path(address: str) -> str:
+    return os.path.join(cache_dir(), f"{address}.json")
+
+
+def _read_meta(address: str) -> dict | None:
+    """Meta commiteada de la dirección con la ruta de su archivo de datos, o None si falta alguno."""
+    try:
+        with open(_meta_path(address), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        path = os.path.join(cache_dir(), os.path.basename(meta["file"]))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if not os.path.exists(path):
+        return None
+    return {**meta, "path": path}
+
+
+@contextmanager
+def _address_lock(address: str):
+    """flock exclusivo por dirección: un solo render a la vez entre procesos."""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(os.path.join(cache_dir(), f"{address}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _address_busy(address: str) -> bool:
+    """True si algún proceso tiene tomado el flock de la dirección (render en curso)."""
+    if fcntl is None:
+        return False
+    try:
+        fd = os.open(os.path.join(cache_dir(), f"{address}.lock"), os.O_RDWR)
+    except OSError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return True
+    finally:
+        os.close(fd)   # cerrar el fd suelta el lock si lo obtuvimos
+    return False
+
+
+def latest_load_ids(db) -> dict:
+    out = {}
+    for source in SourceEnum:
+        out[source] = db.execute(
+            select(Load.id).where(Load.source == source)
+            .order_by(Load.loaded_at.desc(), Load.id.desc()).limit(1)
+        ).scalar()
+    return out
+
+
+# --- lectura ---
+def renderable(name: str, load_ids: dict) -> bool:
+    """True si están todas las cargas de las que depende el artefacto."""
+    spec = _registry.get(name)
+    return spec is not None and _address(spec, load_ids) is not None
+
+
+def get(name: str, load_ids: dict) -> dict | None:
+    """Metadata del artefacto ya generado para esas cargas ({path, etag, size, ...}), o None."""
+    spec = _registry.get(name)
+    if spec is None:
+        return None
+    address = _address(spec, load_ids)
+    if address is None:
+        return None
+    meta = _read_meta(address)
+    if meta is None:
+        return None
+    return {**meta, "media_type": spec.media_type, "filename": spec.filename}
+
+
+# --- generación ---
+def _render_one(db, spec: ArtifactSpec, load_ids: dict, force: bool = False) -> str | None:
+    """Genera el artefacto si falta; con force lo re-genera aunque exista (render de la publicación)."""
+    address = _address(spec, load_ids)
+    if address is None:
+        return None
+    if not force and _read_meta(address) is not None:
+        return address
+    with _address_lock(address):
+        # otro proceso pudo terminarlo mientras esperábamos el lock
+        if not force and _read_meta(address) is not None:
+            return address
+        _render_locked(db, spec, load_ids, address)
+    return address
+
+
+def _render_locked(db, spec: ArtifactSpec, load_ids: dict, address: str) -> None:
+    t0 = perf_counter()
+    fd, tmp = tempfile.mkstemp(dir=cache_dir(), prefix=".render_")
+    os.close(fd)
+    try:
+        rows = spec.render(db, load_ids, tmp)
+        h = hashlib.sha256()
+        with open(tmp, "rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK), b""):
+                h.update(chunk)
+        etag = h.hexdigest()
+        fname = f"{address}.{etag[:16]}{os.path.splitext(spec.name)[1]}"
+        os.replace(tmp, os.path.join(cache_dir(), fname))
+    except Exception:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    meta = {
+        "name": spec.name,
+        "file": fname,
+        "load_ids": {s.value: load_ids.get(s) for s in spec.sources},
+        "etag": etag,
+        "size": os.path.getsize(os.path.join(cache_dir(), fname)),
+        "rows": rows,
+        "rendered_at": datetime.now(timezone.utc).isoformat(),
+        "render_ms": round((perf_counter() - t0) * 1000, 1),
+    }
+    meta_path = _meta_path(address)
+    fd, meta_tmp = tempfile.mkstemp(dir=cache_dir(), prefix=".render_", suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(meta_tmp, meta_path)   # commit: desde aquí el artefacto es visible
+    logger.info(f"📦 Artefacto {spec.name}: {rows:,} filas, {meta['size']:,} bytes, {meta['render_ms']:.0f} ms")
+
+
+def _prune(keep: set[str]) -> int:
+    """
+    Borra artefactos de cargas que ya no son las vigentes. No toca los .lock
+    ni las direcciones con el flock tomado: son renders en curso de otro
+    proceso (que puede ver cargas más nuevas que las nuestras).
+    """
+    removed = 0
+    d = cache_dir()
+    busy: dict[str, bool] = {}
+    for fname in os.listdir(d):
+        if fname.startswith(".render_") or fname.endswith(".lock"):
+            continue
+        address = fname.split(".", 1)[0]
+        if address in keep:
+            continue
+        if address not in busy:
+            busy[address] = _address_busy(address)
+        if not busy[address]:
+            try:
+                os.unlink(os.path.join(d, fname))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def render_all(db, force_sources=frozenset()) -> dict:
+    """Genera los artefactos de las cargas vigentes; re-genera los que dependen de force_sources."""
+    # una sola foto para ids de carga y filas (el upload commitea carga + filas juntas)
+    db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    load_ids = latest_load_ids(db)
+    keep, results = set(), {}
+    for spec in _registry.values():
+        try:
+            force = any(s in force_sources for s in spec.sources)
+            address = _render_one(db, spec, load_ids, force=force)
+            if address:
+                keep.add(address)
+            results[spec.name] = "ok" if address else "sin cargas"
+        except Exception as e:
+            logger.exception(f"❌ Error generando artefacto {spec.name}")
+            results[spec.name] = f"error: {e}"
+            db.rollback()
+    removed = _prune(keep)
+    return {"load_ids": {s.value: v for s, v in load_ids.items()}, "artifacts": results, "pruned_files": removed}
+
+
+def _render_worker() -> None:
+    global _rendering, _render_again, _last_run
+    while True:
+        with _lock:
+            force = frozenset(_force_sources)
+            _force_sources.clear()
+        db = SessionLocal()
+        t0 = perf_counter()
+        try:
+            summary = render_all(db, force)
+            summary["total_ms"] = round((perf_counter() - t0) * 1000, 1)
+            summary["finished_at"] = datetime.now(timezone.utc).isoformat()
+            with _lock:
+                _last_run = summary
+        except Exception:
+            logger.exception("❌ Error en la pre-generación de exports")
+        finally:
+            db.close()
+        with _lock:
+            if _render_again:
+                _render_again = False
+                continue
+            _rendering = False
+            return
+
+
+def schedule_render(force_sources=()) -> bool:
+    """
+    Genera (en background) los artefactos de las cargas vigentes. False si ya
+    había uno en curso. force_sources: fuentes recién publicadas, cuyos
+    artefactos se re-generan aunque ya exista su dirección.
+    """
+    global _rendering, _render_again
+    if not get_settings().EXPORT_PRERENDER_ENABLED:
+        return False
+    with _lock:
+        _force_sources.update(force_sources)
+        if _rendering:
+            _render_again = True
+            return False
+        _rendering = True
+    threading.Thread(target=_render_worker, name="export-prerender", daemon=True).start()
+    return True
+
+
+def status() -> dict:
+    with _lock:
+        return {
+            "enabled": get_settings().EXPORT_PRERENDER_ENABLED,
+            "rendering": _rendering,
+            "cache_dir": cache_dir(),
+            "registered": sorted(_registry),
+            "last_run": _last_run or None,
+        }
+
+
+# --- respuesta HTTP (ETag + Range) ---
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or f'"{etag}"' in tags or f'W/"{etag}"' in tags
+
+
+def _parse_range(header: str, size: int):
+    """
+    Un solo tramo 'bytes=a-b' / 'bytes=a-' / 'bytes=-n'.
+    Retorna (inicio, fin) inclusivo, "unsatisfiable", o None (ignorar → 200 completo).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            n = int(last)
+            if n <= 0:
+                return "unsatisfiable"
+            return max(0, size - n), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+
+def _iter_file(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def artifact_response(request: Request, art: dict) -> Response:
+    etag, size = art["etag"], art["size"]
+    headers = {
+        "ETag": f'"{etag}"',
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f'attachment; filename="{art["filename"]}"',
+    }
+    inm = request.headers.get("if-none-match")
+    if inm and _etag_matches(inm, etag):
+        return Response(status_code=304, headers=headers)
+
+    rng = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if rng and (not if_range or _etag_matches(if_range, etag)):
+        parsed = _parse_range(rng, size)
+        if parsed == "unsatisfiable":
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if parsed is not None:
+            start, end = parsed
+            return StreamingResponse(
+                _iter_file(art["path"], start, end),
+                status_code=206,
+                media_type=art["media_type"],
+                headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)},
+            )
+    return FileResponse(art["path"], media_type=art["media_type"], headers=headers)
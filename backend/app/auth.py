@@ -1,29 +1,38 @@
 # app/auth.py
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from cachetools import TTLCache
-from jwt import PyJWKClient
+from cachetools import TLRUCache
+import hashlib
+import threading
+import time
 import jwt
-import requests
 
+from . import sql_trace
 from .config import get_settings
+from .jwks import JwksKeyStore, azure_discovery_url
 
 settings = get_settings()
 bearer = HTTPBearer(auto_error=True)
 
-# Cache sólo usado si provider=azure
-_jwks_cache = TTLCache(maxsize=2, ttl=get_settings().JWKS_CACHE_SECONDS)
+# Llaves JWKS (sólo si provider=azure): un store por proceso, creado al primer uso
+_jwks_store: JwksKeyStore | None = None
+_jwks_store_lock = threading.Lock()
 
-def _jwks_uri():
-    oidc = f"https://login.microsoftonline.com/{settings.TENANT_ID}/v2.0/.well-known/openid-configuration"
-    r = requests.get(oidc, timeout=5)
-    r.raise_for_status()
-    return r.json()["jwks_uri"]
+def _get_jwks_store() -> JwksKeyStore:
+    global _jwks_store
+    if _jwks_store is None:
+        with _jwks_store_lock:
+            if _jwks_store is None:
+                store = JwksKeyStore(
+                    settings.AZURE_OIDC_DISCOVERY_URL or azure_discovery_url(settings.TENANT_ID),
+                    refresh_seconds=settings.JWKS_CACHE_SECONDS,
+                )
+                store.start()
+                _jwks_store = store
+    return _jwks_store
 
-def _get_jwk_client():
-    if "jwks_uri" not in _jwks_cache:
-        _jwks_cache["jwks_uri"] = _jwks_uri()
-    return PyJWKClient(_jwks_cache["jwks_uri"])
+def jwks_status() -> dict | None:
+    return _jwks_store.status() if _jwks_store is not None else None
 
 def _verify_local(token: str):
     """
@@ -52,8 +61,8 @@ def _verify_azure(token: str):
     Verifica tokens RS256 de Azure AD con JWKS. (Sólo si AUTH_PROVIDER=azure)
     """
     try:
-        jwk_client = _get_jwk_client()
-        signing_key = jwk_client.get_signing_key_from_jwt(token).key
+        kid = jwt.get_unverified_header(token).get("kid")
+        signing_key = _get_jwks_store().get_signing_key(kid).key
         decoded = jwt.decode(
             token,
             signing_key,
@@ -69,9 +78,52 @@ def _verify_azure(token: str):
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Invalid token: {e}")
 
+# Cache de tokens ya verificados: sha256(token) → payload, hasta su propio `exp`.
+# Un dashboard dispara 6+ requests en paralelo con el mismo token; solo el
+# primero paga jwt.decode (firma + claims), el resto es un lookup.
+# Solo se cachean tokens válidos y con exp; cachetools no es thread-safe → lock.
+_token_cache = TLRUCache(
+    maxsize=max(1, settings.TOKEN_CACHE_SIZE),
+    ttu=lambda _key, payload, _now: payload["exp"],
+    timer=time.time,
+)
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {"hits": 0, "misses": 0}
+
+def _token_key(provider: str, token: str) -> bytes:
+    return hashlib.sha256(f"{provider}:{token}".encode("utf-8")).digest()
+
+def _verify_cached(provider: str, token: str, verify) -> dict:
+    if settings.TOKEN_CACHE_SIZE <= 0:
+        return verify(token)
+    key = _token_key(provider, token)
+    with _token_cache_lock:
+        payload = _token_cache.get(key)
+        _token_cache_stats["hits" if payload is not None else "misses"] += 1
+    if payload is not None:
+        return dict(payload)
+
+    payload = verify(token)  # lanza 401 si no es válido (no se cachea)
+    if isinstance(payload.get("exp"), (int, float)):
+        with _token_cache_lock:
+            _token_cache[key] = payload
+    return dict(payload)
+
+def token_cache_stats() -> dict:
+    with _token_cache_lock:
+        hits, misses = _token_cache_stats["hits"], _token_cache_stats["misses"]
+        return {
+            "size": len(_token_cache),
+            "maxsize": _token_cache.maxsize,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+
 def verify_token(creds: HTTPAuthorizationCredentials = Depends(bearer)):
     """
     Decide según AUTH_PROVIDER. Si AUTH_DISABLED=True, devuelve usuario fake Admin (sólo dev).
+    Los tokens ya verificados se sirven desde _token_cache hasta su `exp`.
     """
     if settings.AUTH_DISABLED:
         return {
@@ -86,12 +138,14 @@ def verify_token(creds: HTTPAuthorizationCredentials = Depends(bearer)):
     token = creds.credentials
     provider = (settings.AUTH_PROVIDER or "local").strip().lower()
     if provider == "local":
-        return _verify_local(token)
+        decoded = _verify_cached(provider, token, _verify_local)
     elif provider == "azure":
-        return _verify_azure(token)
+        decoded = _verify_cached(provider, token, _verify_azure)
     else:
         # fallback seguro
         raise HTTPException(status_code=500, detail="AUTH_PROVIDER inválido. Use 'local' o 'azure'.")
+    sql_trace.annotate(user=decoded.get("preferred_username") or decoded.get("email") or decoded.get("sub"))
+    return decoded
 
 def require_roles(*roles):
     allowed = set(r.strip() for r in roles if r and r.strip())
@@ -0,0 +1,174 @@
+"""
+Auto-explain muestreado: EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) de las
+sentencias lentas, guardado por fingerprint (opt-in, AUTO_EXPLAIN_ENABLED).
+
+sql_trace._after llama maybe_capture() con cada sentencia; si tardó
+AUTO_EXPLAIN_THRESHOLD_MS o más, es un SELECT, sale sorteada
+(AUTO_EXPLAIN_SAMPLE_RATE) y su fingerprint no se explicó hace menos de
+AUTO_EXPLAIN_COOLDOWN_MINUTES, se encola para re-ejecutarla bajo EXPLAIN
+ANALYZE en un thread aparte:
+
+- conexión propia del engine, transacción READ ONLY con statement_timeout
+  (AUTO_EXPLAIN_TIMEOUT_SECONDS) y rollback al final; nunca dentro de la
+  transacción del request.
+- un solo worker y a lo más AUTO_EXPLAIN_MAX_PENDING en cola: si la base
+  está lenta no se le suma carga, se descarta.
+
+Cada plan se analiza al guardarlo (analyze_plan): Seq Scan sobre
+AUTO_EXPLAIN_WATCH_TABLES (apsa_protocols, aconex_docs), Nested Loop
+anti/semi-join (NOT EXISTS / EXISTS mal planificados, como el "Error de SS"
+de OPTIMIZATION_STATUS.md) y SubPlans correlacionados quedan en "flags" para
+/admin/performance/explain.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from .config import get_settings
+from .db import engine
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_plans: dict[str, dict] = {}          # fp → último plan capturado
+_last_attempt: dict[str, float] = {}  # fp → monotonic del último encolado (cooldown)
+_pending = 0
+_skipped = {"busy": 0, "errors": 0}
+_executor: ThreadPoolExecutor | None = None
+
+
+def _explainable(sql: str) -> bool:
+    head = sql.lstrip().lower()
+    if not (head.startswith("select") or head.startswith("with")):
+        return False
+    # un WITH puede esconder DML (UPDATE ... RETURNING); EXPLAIN ANALYZE lo ejecutaría
+    return not any(w in head for w in ("insert ", "update ", "delete ", "for update"))
+
+
+def maybe_capture(fp: str, statement: str, parameters, seconds: float, executemany: bool) -> None:
+    """Punto de entrada desde los eventos del engine; barato si no corresponde capturar."""
+    global _pending, _executor
+    s = get_settings()
+    if not s.AUTO_EXPLAIN_ENABLED or executemany or seconds * 1000 < s.AUTO_EXPLAIN_THRESHOLD_MS:
+        return
+    if random.random() >= s.AUTO_EXPLAIN_SAMPLE_RATE or not _explainable(statement):
+        return
+    now = time.monotonic()
+    with _lock:
+        last = _last_attempt.get(fp)
+        if last is not None and now - last < s.AUTO_EXPLAIN_COOLDOWN_MINUTES * 60:
+            return
+        if _pending >= s.AUTO_EXPLAIN_MAX_PENDING:
+            _skipped["busy"] += 1
+            return
+        _last_attempt[fp] = now
+        _pending += 1
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="auto-explain")
+    _executor.submit(_capture, fp, statement, parameters, seconds * 1000)
+
+
+def _capture(fp: str, statement: str, parameters, observed_ms: float) -> None:
+    global _pending
+    s = get_settings()
+    try:
+        with engine.connect() as conn:
+            conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(s.AUTO_EXPLAIN_TIMEOUT_SECONDS * 1000)}")
+            raw = conn.exec_driver_sql(
+                "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters or None
+            ).scalar()
+            conn.rollback()
+        plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]
+        entry = {
+            "fingerprint": fp,
+            "sql": statement[:4000],
+            "observed_ms": round(observed_ms, 1),
+            "explain_ms": round(plan.get("Execution Time", 0.0), 1),
+            "captured_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "flags": analyze_plan(plan["Plan"], s.auto_explain_watch_tables),
+            "plan": plan,
+        }
+        with _lock:
+            if fp not in _plans and len(_plans) >= s.AUTO_EXPLAIN_MAX_PLANS:
+                oldest = min(_plans, key=lambda k: _plans[k]["captured_at"])
+                del _plans[oldest]
+            _plans[fp] = entry
+        if entry["flags"]:
+            logger.warning(f"⚠️ Plan sospechoso ({fp}, {observed_ms:.0f} ms): {', '.join(entry['flags'])}")
+    except Exception as e:
+        with _lock:
+            _skipped["errors"] += 1
+        logger.warning(f"⚠️ auto-explain falló para {fp}: {e}")
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+def analyze_plan(node: dict, watch_tables: set[str]) -> list[str]:
+    """
+    Recorre el árbol del plan JSON y devuelve los patrones problemáticos encontrados.
+
+    Es la forma del plan del "Error de SS" de /metrics/cards antes de las
+    columnas *_norm (OPTIMIZATION_STATUS.md): EXISTS / NOT EXISTS con la
+    normalización en runtime → Nested Loop Semi/Anti Join cuyo lado interno es
+    un Seq Scan de aconex_docs repetido una vez por fila de APSA.
+    Actual Rows viene por loop, así que las filas se reportan × loops.
+    """
+    flags: list[str] = []
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        kind = n.get("Node Type")
+        loops = n.get("Actual Loops") or 1
+        children = n.get("Plans", ())
+        if kind == "Seq Scan" and n.get("Relation Name") in watch_tables:
+            rows = n.get("Actual Rows")
+            total = f"{rows * loops:,}" if rows is not None else "?"
+            per_loop = f" en {loops:,} loops" if loops > 1 else ""
+            flags.append(f"Seq Scan on {n['Relation Name']} ({total} filas{per_loop})")
+        join = n.get("Join Type")
+        # anti-join: siempre sospechoso; semi-join solo si compara fila a fila (Join Filter, sin índice)
+        if kind == "Nested Loop" and (join == "Anti" or (join == "Semi" and "Join Filter" in n)):
+            inner_loops = children[1].get("Actual Loops", "?") if len(children) > 1 else "?"
+            removed = n.get("Rows Removed by Join Filter")
+            detail = f", {removed:,} filas descartadas por Join Filter" if removed else ""
+            flags.append(f"Nested Loop {join} Join ({inner_loops:,} loops del lado interno{detail})"
+                         if isinstance(inner_loops, int) else f"Nested Loop {join} Join{detail}")
+        if n.get("Parent Relationship") == "SubPlan" and loops > 1:
+            name = n.get("Subplan Name") or "SubPlan"
+            flags.append(f"SubPlan correlacionado {name} ({loops:,} loops)")
+        stack.extend(children)
+    return flags
+
+
+def plans(flagged_only: bool = True, limit: int = 50) -> list[dict]:
+    with _lock:
+        out = [p for p in _plans.values() if p["flags"] or not flagged_only]
+    out.sort(key=lambda p: p["observed_ms"], reverse=True)
+    return out[:limit]
+
+
+def status() -> dict:
+    s = get_settings()
+    with _lock:
+        return {
+            "enabled": s.AUTO_EXPLAIN_ENABLED,
+            "threshold_ms": s.AUTO_EXPLAIN_THRESHOLD_MS,
+            "sample_rate": s.AUTO_EXPLAIN_SAMPLE_RATE,
+            "plans": len(_plans),
+            "flagged": sum(1 for p in _plans.values() if p["flags"]),
+            "pending": _pending,
+            "skipped_busy": _skipped["busy"],
+            "errors": _skipped["errors"],
+        }
+
+
+def reset() -> None:
+    with _lock:
+        _plans.clear()
+        _last_attempt.clear()
@@ -0,0 +1,119 @@
+"""
+Export columnar (Parquet / Arrow IPC) de una carga completa, para análisis.
+
+Las filas se leen del cursor server-side en batches (yield_per) y cada batch
+se convierte a un RecordBatch de Arrow y se escribe al archivo: nunca está
+la carga entera en memoria.
+
+Columnas repetitivas (status, disciplina, subsistema, estados de match...)
+van como dictionary<int32, string>. El diccionario se arma UNA vez para toda
+la carga (SELECT DISTINCT, columnas indexadas) y se reutiliza en todos los
+batches: así el stream Arrow no necesita reemplazos de diccionario y Parquet
+guarda índices chicos en vez de repetir el texto.
+
+pyarrow es opcional: si no está instalado, available() = False y los
+endpoints responden 503.
+"""
+import logging
+import os
+import tempfile
+from typing import Literal
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depende del entorno
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+ColumnarFormat = Literal["parquet", "arrow"]
+MEDIA_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+# filas por batch (cursor server-side y RecordBatch)
+COLUMNAR_BATCH_ROWS = 10_000
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def _arrow_type(kind: str):
+    return {
+        "int": pa.int32(),
+        "str": pa.string(),
+        "bool": pa.bool_(),
+        "dict": pa.dictionary(pa.int32(), pa.string()),
+    }[kind]
+
+
+def build_schema(columns: list[tuple[str, str]], metadata: dict | None = None):
+    """columns: [(nombre, tipo)] con tipo en int | str | bool | dict."""
+    return pa.schema(
+        [pa.field(name, _arrow_type(kind)) for name, kind in columns],
+        metadata={k: str(v) for k, v in (metadata or {}).items()},
+    )
+
+
+def _batch(schema, columns, rows, dictionaries) -> "pa.RecordBatch":
+    arrays = []
+    for i, (name, kind) in enumerate(columns):
+        values = [r[i] for r in rows]
+        if kind == "dict":
+            dictionary, positions = dictionaries[name]
+            indices = pa.array([None if v is None else positions[v] for v in values], type=pa.int32())
+            arrays.append(pa.DictionaryArray.from_arrays(indices, dictionary))
+        else:
+            arrays.append(pa.array(values, type=_arrow_type(kind)))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_columnar(
+    result,
+    columns: list[tuple[str, str]],
+    dictionaries: dict[str, list],
+    fmt: ColumnarFormat,
+    *,
+    metadata: dict | None = None,
+) -> tuple[str, int]:
+    """
+    Escribe el resultado (iterado con partitions()) a un archivo temporal.
+
+    Args:
+        result: Result de SQLAlchemy ejecutado con yield_per, en el orden de `columns`
+        columns: [(nombre, tipo)] (ver build_schema)
+        dictionaries: {columna dict: valores posibles} (sin None)
+        fmt: "parquet" o "arrow" (Arrow IPC stream)
+
+    Returns:
+        (path del temporal, filas escritas). El caller debe borrar el archivo.
+    """
+    schema = build_schema(columns, metadata)
+    dicts = {
+        name: (pa.array(values, type=pa.string()), {v: i for i, v in enumerate(values)})
+        for name, values in dictionaries.items()
+    }
+
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=f".{fmt}")
+    os.close(fd)
+    n = 0
+    try:
+        if fmt == "parquet":
+            writer = pq.ParquetWriter(path, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_stream(path, schema)
+        with writer:
+            for rows in result.partitions(COLUMNAR_BATCH_ROWS):
+                batch = _batch(schema, columns, rows, dicts)
+                if fmt == "parquet":
+                    writer.write_batch(batch, row_group_size=COLUMNAR_BATCH_ROWS)
+                else:
+                    writer.write_batch(batch)
+                n += batch.num_rows
+    except Exception:
+        os.unlink(path)
+        raise
+    return path, n
@@ -0,0 +1,225 @@
+"""
+Compresión de respuestas (middleware ASGI): gzip siempre, zstd / brotli si
+están instalados (paquetes `zstandard` y `brotli`, opcionales).
+
+- Negocia con Accept-Encoding (respeta q=0) en el orden de preferencia configurado.
+- Solo comprime tipos de texto (JSON, CSV, text/*); no toca xlsx/parquet
+  (ya vienen comprimidos), respuestas con Content-Encoding ni 206/Range.
+  Tampoco las que anuncian Accept-Ranges (artefactos pre-generados): los
+  rangos se calculan sobre los bytes sin comprimir y reanudar una descarga
+  comprimida con un tramo sin comprimir corrompería el archivo.
+- Umbral: si el body completo cabe bajo `minimum_size` se envía tal cual.
+- Streaming: en StreamingResponse (more_body=True) cada chunk se comprime y
+  se hace flush al tiro, así el cliente recibe los datos a medida que salen
+  del cursor en vez de esperar al final.
+"""
+import logging
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depende del entorno
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depende del entorno
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/problem+json",
+)
+
+
+class _GzipCoder:
+    def __init__(self, level: int):
+        self._c = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = formato gzip
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._c.compress(data)
+        return out + self._c.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self) -> bytes:
+        return self._c.flush(zlib.Z_FINISH)
+
+
+class _ZstdCoder:
+    def __init__(self, level: int):
+        self._c = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._c.compress(data)
+        return out + self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK) if flush else out
+
+    def finish(self) -> bytes:
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+class _BrotliCoder:
+    def __init__(self, level: int):
+        self._c = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._c.process(data)
+        return out + self._c.flush() if flush else out
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+def available_encodings() -> dict:
+    """{encoding: clase coder} de lo instalado en este servidor."""
+    coders = {"gzip": _GzipCoder}
+    if zstandard is not None:
+        coders["zstd"] = _ZstdCoder
+    if brotli is not None:
+        coders["br"] = _BrotliCoder
+    return coders
+
+
+def make_coder(encoding: str, level: int):
+    return available_encodings()[encoding](level)
+
+
+def compress_bytes(encoding: str, level: int, data: bytes) -> bytes:
+    """Comprime un payload completo (usado por el benchmark y respuestas bufferizadas)."""
+    c = make_coder(encoding, level)
+    return c.compress(data, False) + c.finish()
+
+
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    out = {}
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        out[token] = q
+    return out
+
+
+class CompressionMiddleware:
+    """
+    Args:
+        encodings: preferencia del servidor, p.ej. ["zstd", "br", "gzip"]
+        levels: nivel por encoding (gzip 1-9, zstd 1-22, br 0-11)
+        minimum_size: bytes mínimos para comprimir respuestas no-streaming
+    """
+
+    def __init__(self, app, *, encodings: list[str], levels: dict[str, int], minimum_size: int = 1024):
+        self.app = app
+        installed = available_encodings()
+        self.encodings = [e for e in encodings if e in installed]
+        self.levels = levels
+        self.minimum_size = minimum_size
+        missing = [e for e in encodings if e not in installed]
+        if missing:
+            logger.info(f"ℹ️ Compresión: {', '.join(missing)} no instalado(s), se usa {', '.join(self.encodings)}")
+
+    def _choose(self, scope) -> str | None:
+        header = ""
+        for k, v in scope.get("headers", []):
+            if k == b"accept-encoding":
+                header = v.decode("latin-1")
+                break
+        if not header:
+            return None
+        accepted = parse_accept_encoding(header)
+        wildcard = accepted.get("*", 0.0)
+        for enc in self.encodings:
+            if accepted.get(enc, wildcard) > 0:
+                return enc
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        encoding = self._choose(scope)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressingResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressingResponder:
+    def __init__(self, mw: CompressionMiddleware, encoding: str, send):
+        self.mw = mw
+        self.encoding = encoding
+        self._send = send
+        self.start = None        # mensaje http.response.start retenido
+        self.active = None       # None = aún no se decide; True/False
+        self.coder = None
+        self.pending = b""       # body retenido mientras no se alcanza el umbral
+
+    def _should_compress(self, headers) -> bool:
+        ctype = ""
+        for k, v in headers:
+            if k in (b"content-encoding", b"content-range", b"accept-ranges"):
+                return False
+            if k == b"content-type":
+                ctype = v.decode("latin-1").lower()
+        return self.start["status"] not in (204, 206, 304) and ctype.startswith(COMPRESSIBLE_TYPES)
+
+    async def _start_compressed(self):
+        headers = [(k, v) for k, v in self.start["headers"] if k != b"content-length"]
+        vary = [v for k, v in headers if k == b"vary"]
+        if not vary:
+            headers.append((b"vary", b"Accept-Encoding"))
+        elif b"accept-encoding" not in vary[0].lower():
+            headers = [(k, v + b", Accept-Encoding" if k == b"vary" else v) for k, v in headers]
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        self.coder = make_coder(self.encoding, self.mw.levels.get(self.encoding, 6))
+        await self._send({**self.start, "headers": headers})
+
+    async def send(self, message):
+        mtype = message["type"]
+        if mtype == "http.response.start":
+            self.start = message
+            self.active = None if self._should_compress(message.get("headers", [])) else False
+            if self.active is False:
+                await self._send(message)
+            return
+
+        if mtype != "http.response.body" or self.active is False:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+
+        if self.active is None:
+            self.pending += body
+            if not more and len(self.pending) < self.mw.minimum_size:
+                # respuesta chica y completa: no vale la pena comprimir
+                self.active = False
+                await self._send(self.start)
+                await self._send({"type": "http.response.body", "body": self.pending, "more_body": False})
+                return
+            if more and len(self.pending) < self.mw.minimum_size:
+                return  # seguir juntando hasta decidir
+            self.active = True
+            await self._start_compressed()
+            body, self.pending = self.pending, b""
+
+        if more:
+            chunk = self.coder.compress(body, flush=True)
+            if chunk:
+                await self._send({"type": "http.response.body", "body": chunk, "more_body": True})
+        else:
+            chunk = self.coder.compress(body, flush=False) + self.coder.finish()
+            await self._send({"type": "http.response.body", "body": chunk, "more_body": False})
@@ -21,10 +21,14 @@ class Settings(BaseSettings):
     API_AUDIENCE: str = "quality.api"
     API_ISSUER: str = "quality.local"
 
+    # Tokens ya verificados en memoria hasta su exp (0 = sin cache)
+    TOKEN_CACHE_SIZE: int = 4096
+
     # Azure (opcional)
     TENANT_ID: Optional[str] = None
     CLIENT_ID: Optional[str] = None
-    JWKS_CACHE_SECONDS: int = 3600
+    JWKS_CACHE_SECONDS: int = 3600        # refresco en background de las llaves de firma
+    AZURE_OIDC_DISCOVERY_URL: Optional[str] = None  # None → login.microsoftonline.com/{TENANT_ID}
 
     # Roles permitidos
     ALLOWED_ROLES: str = "Admin,User"
@@ -37,9 +41,89 @@ class Settings(BaseSettings):
     COOKIE_SAMESITE: str = "lax"
     COOKIE_PATH: str = "/auth"
 
+    # Purga de refresh_tokens (expirados y revocados) en batches, en background
+    REFRESH_TOKEN_PURGE_INTERVAL_MINUTES: int = 60   # 0 = solo manual (/admin/maintenance/...)
+    REFRESH_TOKEN_PURGE_BATCH: int = 5000
+    REFRESH_TOKEN_REVOKED_RETENTION_HOURS: int = 24  # revocados se guardan un rato (auditoría)
+
+    # Argon2 en un pool de procesos (0 = en el mismo proceso); sobre workers+cola → 503
+    PASSWORD_POOL_WORKERS: int = 2
+    PASSWORD_POOL_MAX_QUEUE: int = 16
+    PASSWORD_POOL_TIMEOUT_SECONDS: float = 10.0
+
     # Bootstrap del primer admin
     BOOTSTRAP_TOKEN: Optional[str] = None
 
+    # Cache de totales de listados (entradas por (cargas, filtros))
+    COUNT_CACHE_SIZE: int = 2048
+
+    # Índice en memoria (bitmaps) de la carga APSA vigente para /apsa/list
+    APSA_INDEX_ENABLED: bool = True
+    APSA_INDEX_RETRY_SECONDS: int = 60   # tras un build fallido, espera antes de reintentar desde un request
+
+    # Compresión de respuestas (zstd/br solo si están instalados zstandard/brotli)
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_ENCODINGS: str = "zstd,br,gzip"   # orden de preferencia del servidor
+    COMPRESSION_MIN_SIZE: int = 1024              # bytes; bajo esto no se comprime
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    COMPRESSION_BROTLI_LEVEL: int = 4
+
+    # Token fijo para que Prometheus scrapee /admin/performance/prometheus sin JWT (None = solo Admin)
+    METRICS_TOKEN: Optional[str] = None
+
+    # Traza SQL por request (eventos del engine) y detección de N+1
+    SQL_TRACE_ENABLED: bool = True
+    SQL_TRACE_MAX_STATEMENTS: int = 200          # sentencias guardadas por request (el resto solo se cuenta)
+    SQL_TRACE_MAX_FINGERPRINTS: int = 500        # sentencias distintas con histograma propio
+    SQL_TRACE_N_PLUS_ONE_THRESHOLD: int = 10     # mismo fingerprint N+ veces en un request → aviso
+    SQL_TRACE_CAPTURE_PARAMS: bool = True        # parámetros recortados; claves pass/hash/token/secret ocultas
+
+    # Requests lentos (/admin/performance/slow); requiere SQL_TRACE_ENABLED. 0 = desactivado
+    SLOW_REQUEST_THRESHOLD_MS: int = 1000
+    SLOW_REQUEST_BUFFER_SIZE: int = 50
+    SLOW_REQUEST_STACK_SAMPLE: bool = True     # stack de Python tomado mientras el request sigue corriendo
+
+    # Stats de performance compartidas entre workers (segmentos mmap; None → <tmp>/quality_metrics)
+    METRICS_SHARED_ENABLED: bool = True
+    METRICS_SHARED_DIR: Optional[str] = None
+    METRICS_SHARED_SLOTS: int = 16             # workers simultáneos como máximo
+    METRICS_SHARED_SEGMENT_KB: int = 4096      # por worker
+    METRICS_SHARED_FLUSH_SECONDS: int = 5
+
+    # Logging: cola + listener en otro thread; json (una línea por registro) o text
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"
+    LOG_SAMPLING: str = ""                     # "perf=0.1,app.timing=0.2": fracción conservada bajo WARNING
+    LOG_QUEUE_MAX: int = 10000                 # con la cola llena se descartan registros (no bloquea)
+
+    # Profiler por request (?__profile=1 con JWT Admin); muestreo de sys._current_frames
+    PROFILE_ENABLED: bool = True
+    PROFILE_INTERVAL_MS: float = 5
+    PROFILE_MAX_SECONDS: float = 120           # el sampler se detiene pasado esto (el request sigue)
+
+    # Auto-explain (opt-in): re-ejecuta SELECTs lentos bajo EXPLAIN (ANALYZE, BUFFERS) en background
+    AUTO_EXPLAIN_ENABLED: bool = False
+    AUTO_EXPLAIN_THRESHOLD_MS: int = 2000
+    AUTO_EXPLAIN_SAMPLE_RATE: float = 0.1        # fracción de las sentencias lentas que se explican
+    AUTO_EXPLAIN_COOLDOWN_MINUTES: int = 30      # por fingerprint
+    AUTO_EXPLAIN_TIMEOUT_SECONDS: float = 60     # statement_timeout del EXPLAIN ANALYZE
+    AUTO_EXPLAIN_MAX_PENDING: int = 2
+    AUTO_EXPLAIN_MAX_PLANS: int = 200
+    AUTO_EXPLAIN_WATCH_TABLES: str = "apsa_protocols,aconex_docs"  # Seq Scan sobre estas → flag
+
+    # Exports pre-generados al publicar una carga (None → <tmp>/quality_exports)
+    EXPORT_PRERENDER_ENABLED: bool = True
+    EXPORT_CACHE_DIR: Optional[str] = None
+
+    # Exports en background (jobs): pool acotado para no quitarle conexiones a los dashboards
+    # (estado en <dir>/<id>.json, compartido entre workers; None → <tmp>/quality_export_jobs)
+    EXPORT_JOB_DIR: Optional[str] = None
+    EXPORT_JOB_WORKERS: int = 2
+    EXPORT_JOB_MAX_PENDING: int = 8       # en cola + ejecutando; sobre esto → 503
+    EXPORT_JOB_TTL_SECONDS: int = 3600    # el archivo se borra pasado este tiempo desde que terminó
+    EXPORT_JOB_SWEEP_SECONDS: int = 300   # cada cuánto se barren jobs vencidos y archivos huérfanos
+
     # 🔧 Configuración para pydantic-settings v2
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -47,6 +131,10 @@ class Settings(BaseSettings):
         extra="ignore",
     )
 
+    @property
+    def auto_explain_watch_tables(self) -> set[str]:
+        return {t.strip() for t in self.AUTO_EXPLAIN_WATCH_TABLES.split(",") if t.strip()}
+
     @property
     def database_url(self) -> str:
         return (
@@ -0,0 +1,83 @@
+"""
+Totales de listados paginados (count) con cache por carga.
+
+Las cargas son de solo lectura hasta el próximo upload, así que el total de
+un listado depende solo de (ids de carga, filtros). Se calcula una vez y se
+reutiliza en todas las páginas siguientes.
+
+Modos (parámetro `count` de los listados):
+- exact:    count(*) real, cacheado por (load ids, filtros)
+- estimate: filas estimadas por el planner (EXPLAIN, sin ejecutar la consulta)
+- none:     no se calcula (scroll infinito; usar next_cursor)
+
+La clave incluye los ids de carga, así que un total nunca sobrevive a su
+carga. Eso basta entre workers porque el upload commitea la carga y sus filas
+en una sola transacción (_store_load): un id de carga visible ya tiene todas
+sus filas, y lo calculado por cualquier worker bajo esa clave es definitivo.
+invalidate() (al publicar, en el worker del upload) solo libera memoria.
+"""
+import threading
+from typing import Any, Callable, Literal
+
+from cachetools import LRUCache
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .config import get_settings
+from .explain import explain, estimated_rows
+
+CountMode = Literal["exact", "estimate", "none"]
+
+_cache: LRUCache = LRUCache(maxsize=get_settings().COUNT_CACHE_SIZE)
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def make_key(namespace: str, load_ids: list, filters: dict) -> tuple:
+    """Clave hashable; los filtros vacíos/False no forman parte de la clave."""
+    norm = tuple(sorted((k, v) for k, v in filters.items() if v not in (None, "", False)))
+    return (namespace, tuple(load_ids), norm)
+
+
+def cached_value(key: tuple, compute: Callable[[], Any]) -> Any:
+    """Valor derivado de las cargas de la clave (totales, facetas), calculado una vez."""
+    with _lock:
+        if key in _cache:
+            _stats["hits"] += 1
+            return _cache[key]
+        _stats["misses"] += 1
+    # fuera del lock: el count puede tardar y no debe bloquear otros listados
+    value = compute()
+    with _lock:
+        _cache[key] = value
+    return value
+
+
+def cached_count(key: tuple, compute: Callable[[], int]) -> int:
+    return cached_value(key, lambda: int(compute() or 0))
+
+
+def count_rows(db: Session, stmt, key: tuple, mode: CountMode = "exact") -> int | None:
+    """Total de filas de `stmt` según el modo pedido."""
+    if mode == "none":
+        return None
+    if mode == "estimate":
+        return estimated_rows(explain(db, stmt))
+    return cached_count(key, lambda: db.execute(select(func.count()).select_from(stmt.subquery())).scalar())
+
+
+def invalidate() -> None:
+    with _lock:
+        _cache.clear()
+        _stats["invalidations"] += 1
+
+
+def stats() -> dict:
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entries": len(_cache),
+            "maxsize": _cache.maxsize,
+            "hit_ratio": round(_stats["hits"] / total, 4) if total else 0.0,
+        }
@@ -1,14 +1,43 @@
-from sqlalchemy import create_engine
+import threading
+from time import perf_counter
+
+from sqlalchemy import create_engine, exc
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 from .config import get_settings
+from .timing import LatencyHistogram
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout por una conexión libre (y los timeouts)."""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.wait_lock = threading.Lock()
+        self.wait_hist = LatencyHistogram()
+        self.wait_timeouts = 0
+
+    def _do_get(self):
+        t0 = perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self.wait_lock:
+                self.wait_timeouts += 1
+            raise
+        finally:
+            with self.wait_lock:
+                self.wait_hist.record(perf_counter() - t0)
+
 
 settings = get_settings()
 engine = create_engine(
     settings.database_url,
+    poolclass=TimedQueuePool,
     pool_pre_ping=True,
     echo=False,
     future=True,
     connect_args={"prepare_threshold": None},  # deshabilita prepared statements (requerido para PgBouncer transaction mode)
 )
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
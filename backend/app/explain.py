@@ -0,0 +1,79 @@
+"""
+Helpers para obtener planes de ejecución (EXPLAIN) de PostgreSQL
+a partir de statements SQLAlchemy.
+
+Uso:
+    plan = explain(db, select(...))
+    seq_scanned_tables(plan)   # {"aconex_docs"} si hay Seq Scan
+"""
+import json
+from typing import Iterator
+
+from sqlalchemy.orm import Session
+
+
+def compile_statement(db: Session, stmt) -> tuple[str, dict]:
+    """Compila un statement al SQL del driver (+ parámetros), expandiendo IN (...)."""
+    compiled = stmt.compile(
+        dialect=db.get_bind().dialect,
+        compile_kwargs={"render_postcompile": True},
+    )
+    return str(compiled), dict(compiled.params)
+
+
+def explain_sql(db: Session, sql: str, params=None, *, analyze: bool = False, buffers: bool = False) -> dict:
+    """Ejecuta EXPLAIN (FORMAT JSON) sobre SQL ya compilado y retorna el nodo raíz."""
+    opts = []
+    if analyze:
+        opts.append("ANALYZE")
+    if buffers:
+        opts.append("BUFFERS")
+    opts.append("FORMAT JSON")
+
+    raw = db.connection().exec_driver_sql(f"EXPLAIN ({', '.join(opts)}) {sql}", params or {}).scalar()
+    data = json.loads(raw) if isinstance(raw, str) else raw
+    return data[0] if isinstance(data, list) else data
+
+
+def explain(db: Session, stmt, *, analyze: bool = False, buffers: bool = False) -> dict:
+    """EXPLAIN (FORMAT JSON) de un statement SQLAlchemy."""
+    sql, params = compile_statement(db, stmt)
+    return explain_sql(db, sql, params, analyze=analyze, buffers=buffers)
+
+
+def iter_plan_nodes(plan: dict) -> Iterator[dict]:
+    """Recorre todos los nodos del plan (acepta el resultado de explain() o un nodo 'Plan')."""
+    stack = [plan.get("Plan", plan)]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.get("Plans") or [])
+
+
+def estimated_rows(plan: dict) -> int:
+    """Filas estimadas por el planner para el nodo raíz."""
+    return int(plan.get("Plan", plan).get("Plan Rows") or 0)
+
+
+def seq_scanned_tables(plan: dict) -> set[str]:
+    """Tablas leídas con Seq Scan en el plan."""
+    return {
+        n.get("Relation Name")
+        for n in iter_plan_nodes(plan)
+        if n.get("Node Type") == "Seq Scan" and n.get("Relation Name")
+    }
+
+
+def plan_outline(plan: dict) -> list[str]:
+    """Resumen legible: 'Seq Scan on aconex_docs', 'Index Scan using idx_x on apsa_protocols', ..."""
+    out = []
+    for n in iter_plan_nodes(plan):
+        line = n.get("Node Type", "?")
+        if n.get("Join Type"):
+            line += f" ({n['Join Type']})"
+        if n.get("Index Name"):
+            line += f" using {n['Index Name']}"
+        if n.get("Relation Name"):
+            line += f" on {n['Relation Name']}"
+        out.append(line)
+    return out
@@ -0,0 +1,312 @@
+"""
+Exports en background (jobs) para exports filtrados muy grandes.
+
+Un export con `q` o varios flags de conciliación puede tardar lo suficiente
+para cortar por timeout del proxy, y mientras tanto ocupa un worker del
+threadpool de FastAPI. Con un job:
+
+1. POST crea el job y responde al tiro (202) con su id.
+2. El export corre en un pool propio y acotado (EXPORT_JOB_WORKERS threads,
+   cada uno con su propia sesión de BD), así nunca ocupa más de N conexiones
+   por worker ni le quita threads a los dashboards.
+3. Si el worker ya tiene EXPORT_JOB_MAX_PENDING jobs en cola/ejecución, se
+   rechaza con QueueFull (→ 503) en vez de encolar sin límite.
+4. El estado de cada job (status, dueño, archivo, media_type, vencimiento)
+   se guarda como `<id>.json` junto a su archivo en EXPORT_JOB_DIR, escrito
+   con os.replace (atómico). get() lee de disco, así que cualquier worker de
+   uvicorn responde el status y la descarga, no solo el que lo ejecutó.
+5. Un barrido (al importar y cada EXPORT_JOB_SWEEP_SECONDS) borra los jobs
+   vencidos (EXPORT_JOB_TTL_SECONDS desde que terminó), los archivos sin
+   .json (restos de un reinicio) y marca como error los jobs cuyo proceso
+   murió a medio camino.
+"""
+import json
+import logging
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from time import perf_counter, sleep, time
+from typing import Callable
+
+from .config import get_settings
+from .db import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Hay demasiados jobs pendientes; el cliente debe reintentar más tarde."""
+
+
+@dataclass
+class ExportJob:
+    id: str
+    owner: str | None
+    kind: str
+    filename: str
+    media_type: str
+    status: str = "queued"          # queued → running → done | error
+    created_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    started_at: str | None = None
+    finished_at: str | None = None
+    rows: int | None = None
+    size: int | None = None
+    error: str | None = None
+    file: str | None = None          # nombre del archivo en jobs_dir()
+    duration_ms: float | None = None
+    expires_at: float | None = None  # epoch (entre procesos); solo una vez terminado
+    pid: int | None = None           # proceso que lo ejecuta
+
+    @property
+    def path(self) -> str | None:
+        return os.path.join(jobs_dir(), self.file) if self.file else None
+
+    def public(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "filename": self.filename,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "rows": self.rows,
+            "size": self.size,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+        }
+
+
+_lock = threading.Lock()
+_local: dict[str, ExportJob] = {}   # jobs en cola/ejecución de *este* proceso
+_executor: ThreadPoolExecutor | None = None
+_sweeper_pid: int | None = None
+_stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "expired": 0, "orphans_removed": 0}
+_VALID_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+_ORPHAN_GRACE_SECONDS = 60
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, get_settings().EXPORT_JOB_WORKERS),
+            thread_name_prefix="export-job",
+        )
+    return _executor
+
+
+def jobs_dir() -> str:
+    d = get_settings().EXPORT_JOB_DIR or os.path.join(tempfile.gettempdir(), "quality_export_jobs")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def _meta_path(job_id: str) -> str:
+    return os.path.join(jobs_dir(), f"{job_id}.json")
+
+
+def _save(job: ExportJob) -> None:
+    fd, tmp = tempfile.mkstemp(dir=jobs_dir(), prefix=f".{job.id}.", suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(asdict(job), f)
+    os.replace(tmp, _meta_path(job.id))
+
+
+def _load(job_id: str) -> ExportJob | None:
+    try:
+        with open(_meta_path(job_id), "r", encoding="utf-8") as f:
+            return ExportJob(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _remove_file(path: str | None) -> None:
+    if path:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _pid_alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def cleanup() -> int:
+    """
+    Barrido de jobs_dir(): borra jobs vencidos (y su archivo), archivos sin
+    .json y marca como error los jobs en curso de procesos que ya no existen.
+    Retorna cuántos jobs vencidos se borraron.
+    """
+    d = jobs_dir()
+    now = time()
+    ttl = get_settings().EXPORT_JOB_TTL_SECONDS
+    names = os.listdir(d)
+    metas = {n[:-len(".json")] for n in names if n.endswith(".json") and not n.startswith(".")}
+    expired = orphans = 0
+    for job_id in metas:
+        job = _load(job_id)
+        if job is None:
+            # .json ilegible: se descarta pasado el TTL (puede estar a medio reemplazar)
+            try:
+                if now - os.path.getmtime(_meta_path(job_id)) > ttl:
+                    _remove_file(_meta_path(job_id))
+            except OSError:
+                pass
+            continue
+        if job.status in ("queued", "running") and job.id not in _local and not _pid_alive(job.pid):
+            job.status, job.error = "error", "El proceso que ejecutaba el export se reinició"
+            job.finished_at = datetime.now(timezone.utc).isoformat()
+            job.expires_at = now + ttl
+            _save(job)
+        elif job.expires_at is not None and job.expires_at <= now:
+            _remove_file(job.path)
+            _remove_file(_meta_path(job.id))
+            expired += 1
+    for name in names:
+        if name.endswith(".json") and not name.startswith("."):
+            continue
+        # todos los archivos de un job empiezan con "<id>." (los ids no tienen puntos)
+        job_id = name.lstrip(".").split(".", 1)[0]
+        if job_id in metas and os.path.exists(_meta_path(job_id)):
+            continue
+        path = os.path.join(d, name)
+        try:
+            if now - os.path.getmtime(path) < _ORPHAN_GRACE_SECONDS:
+                continue        # puede ser el primer _save() de un job recién creado
+        except OSError:
+            continue
+        _remove_file(path)
+        orphans += 1
+    with _lock:
+        _stats["expired"] += expired
+        _stats["orphans_removed"] += orphans
+    return expired
+
+
+def _sweep_loop() -> None:
+    while _sweeper_pid == os.getpid():
+        sleep(max(10, get_settings().EXPORT_JOB_SWEEP_SECONDS))
+        try:
+            cleanup()
+        except Exception:
+            logger.exception("❌ Error en el barrido de export jobs")
+
+
+def start_sweeper() -> None:
+    """Barrido inicial (restos de un reinicio) + barrido periódico; idempotente por proceso."""
+    global _sweeper_pid
+    with _lock:
+        if _sweeper_pid == os.getpid():
+            return
+        _sweeper_pid = os.getpid()
+    try:
+        cleanup()
+    except Exception:
+        logger.exception("❌ Error en el barrido de export jobs")
+    threading.Thread(target=_sweep_loop, name="export-job-sweeper", daemon=True).start()
+
+
+def _run(job: ExportJob, render: Callable) -> None:
+    job.status = "running"
+    job.started_at = datetime.now(timezone.utc).isoformat()
+    _save(job)
+    t0 = perf_counter()
+    fd, tmp = tempfile.mkstemp(dir=jobs_dir(), prefix=f"{job.id}.")
+    os.close(fd)
+    db = SessionLocal()
+    try:
+        rows = render(db, tmp)
+        final = os.path.join(jobs_dir(), job.id + os.path.splitext(job.filename)[1])
+        shutil.move(tmp, final)
+        job.file = os.path.basename(final)
+        job.rows = rows
+        job.size = os.path.getsize(final)
+        job.status = "done"
+        with _lock:
+            _stats["done"] += 1
+        logger.info(f"📦 Export job {job.id} ({job.kind}): {rows:,} filas en {perf_counter() - t0:.1f}s")
+    except Exception as e:
+        _remove_file(tmp)
+        logger.exception(f"❌ Export job {job.id} ({job.kind}) falló")
+        job.status = "error"
+        job.error = getattr(e, "detail", None) or str(e)
+        with _lock:
+            _stats["failed"] += 1
+    finally:
+        db.close()
+        job.finished_at = datetime.now(timezone.utc).isoformat()
+        job.duration_ms = round((perf_counter() - t0) * 1000, 1)
+        job.expires_at = time() + get_settings().EXPORT_JOB_TTL_SECONDS
+        _save(job)
+        with _lock:
+            _local.pop(job.id, None)
+
+
+def submit(kind: str, render: Callable, *, filename: str, media_type: str, owner: str | None) -> ExportJob:
+    """
+    Encola un export. `render(db, dest_path) -> filas` corre en el pool de jobs
+    con una sesión propia. Lanza QueueFull si se alcanzó EXPORT_JOB_MAX_PENDING.
+    """
+    start_sweeper()
+    job = ExportJob(
+        id=secrets.token_urlsafe(16), owner=owner, kind=kind, filename=filename,
+        media_type=media_type, pid=os.getpid(),
+    )
+    with _lock:
+        if len(_local) >= get_settings().EXPORT_JOB_MAX_PENDING:
+            _stats["rejected"] += 1
+            raise QueueFull()
+        _local[job.id] = job
+        _stats["submitted"] += 1
+    _save(job)
+    _get_executor().submit(_run, job, render)
+    return job
+
+
+def get(job_id: str, owner: str | None) -> ExportJob | None:
+    """El job (leído de disco) si existe, no venció y pertenece a `owner` (los ids no se comparten entre usuarios)."""
+    if not _VALID_ID.match(job_id):
+        return None
+    job = _load(job_id)
+    if job is None or job.owner != owner:
+        return None
+    if job.expires_at is not None and job.expires_at <= time():
+        return None
+    return job
+
+
+def stats() -> dict:
+    s = get_settings()
+    by_status: dict[str, int] = {}
+    d = jobs_dir()
+    for name in os.listdir(d):
+        if name.endswith(".json") and not name.startswith("."):
+            job = _load(name[:-len(".json")])
+            if job is not None:
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+    with _lock:
+        return {
+            "workers": s.EXPORT_JOB_WORKERS,
+            "max_pending": s.EXPORT_JOB_MAX_PENDING,
+            "ttl_seconds": s.EXPORT_JOB_TTL_SECONDS,
+            "dir": d,
+            "jobs": by_status,          # todos los workers (desde disco)
+            "pending_here": len(_local),
+            **_stats,                   # contadores de este proceso
+        }
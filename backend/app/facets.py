@@ -0,0 +1,60 @@
+"""
+Conteos por faceta en UNA sola consulta (GROUPING SETS).
+
+Para cada dimensión D se cuenta cuántas filas quedarían al elegir cada valor
+de D, aplicando todos los filtros activos EXCEPTO el de la propia D (conteo
+de facetas clásico: muestra las alternativas, no solo la selección actual).
+
+    SELECT status, disciplina, ...,
+           SUM(CASE WHEN GROUPING(status) = 0 AND <filtros menos status> THEN 1
+                    WHEN GROUPING(disciplina) = 0 AND <filtros menos disciplina> THEN 1
+                    ...
+                    WHEN <todos los filtros> THEN 1   -- grouping set () = total
+                    ELSE 0 END)
+    FROM (...) sq
+    GROUP BY GROUPING SETS (status, disciplina, ..., ())
+
+Se recorre la carga una sola vez, sin importar cuántas dimensiones haya.
+"""
+from sqlalchemy import select, func, and_, case, text, true
+from sqlalchemy.orm import Session
+
+
+def facet_counts(db: Session, sq, dims: list[str], matches: dict) -> dict:
+    """
+    Args:
+        sq: subquery con una columna por dimensión (mismo nombre que en `dims`)
+        dims: nombres de las dimensiones a facetar
+        matches: {dimensión: expresión booleana sobre sq} solo de filtros activos
+
+    Returns:
+        {"total": n, "facets": {dim: {valor: n, ...}, ...}}
+    """
+    def others(dim: str | None):
+        conds = [m for d, m in matches.items() if d != dim]
+        return and_(*conds) if conds else true()
+
+    cols = [sq.c[d] for d in dims]
+    whens = [(and_(func.grouping(sq.c[d]) == 0, others(d)), 1) for d in dims]
+    whens.append((others(None), 1))
+    n = func.sum(case(*whens, else_=0)).label("n")
+    grouping = [func.grouping(sq.c[d]).label(f"g_{d}") for d in dims]
+
+    rows = db.execute(
+        select(*cols, *grouping, n)
+        .group_by(func.grouping_sets(*cols, text("()")))
+    ).all()
+
+    out = {"total": 0, "facets": {d: {} for d in dims}}
+    for r in rows:
+        m = r._mapping
+        grouped = [d for d in dims if m[f"g_{d}"] == 0]
+        if not grouped:
+            out["total"] = int(m["n"] or 0)
+            continue
+        dim = grouped[0]
+        value = m[dim]
+        if value is None or str(value).strip() == "":
+            continue
+        out["facets"][dim][str(value)] = int(m["n"] or 0)
+    return out
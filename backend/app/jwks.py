@@ -0,0 +1,147 @@
+"""
+Llaves de firma (JWKS) de Azure AD para verificar tokens RS256.
+
+Antes se creaba un PyJWKClient por request (su cache interno se perdía) y el
+discovery OIDC hacía un requests.get bloqueante: cada llamada al API podía
+terminar en un fetch de red. Ahora hay un único JwksKeyStore por proceso:
+
+- Lookup por `kid` en un dict (sin red en el camino normal).
+- Un thread de fondo refresca las llaves cada `refresh_seconds`.
+- Stale-while-revalidate: si el refresh falla se siguen usando las últimas
+  llaves conocidas; si están viejas se sirve igual y se dispara un refresh.
+- `kid` desconocido (rotación de llaves de Azure): refetch síncrono, con un
+  mínimo de `min_refetch_seconds` entre refetch para que un token basura con
+  kids inventados no golpee a Microsoft en cada request.
+
+La URL de discovery es inyectable (AZURE_OIDC_DISCOVERY_URL) para probar
+contra un servidor OIDC local.
+"""
+import logging
+import threading
+from time import monotonic
+
+import requests
+from jwt import PyJWK, PyJWKSet
+from jwt.exceptions import PyJWKClientError
+
+logger = logging.getLogger(__name__)
+
+
+def azure_discovery_url(tenant_id: str) -> str:
+    return f"https://login.microsoftonline.com/{tenant_id}/v2.0/.well-known/openid-configuration"
+
+
+class JwksKeyStore:
+    """
+    Args:
+        discovery_url: .well-known/openid-configuration del emisor
+        refresh_seconds: cada cuánto se refrescan las llaves en background
+        min_refetch_seconds: mínimo entre refetch forzados por kid desconocido
+        timeout: timeout HTTP (s)
+    """
+
+    def __init__(self, discovery_url: str, *, refresh_seconds: int = 3600,
+                 min_refetch_seconds: int = 30, timeout: float = 5.0):
+        self.discovery_url = discovery_url
+        self.refresh_seconds = refresh_seconds
+        self.min_refetch_seconds = min_refetch_seconds
+        self.timeout = timeout
+        self._keys: dict[str, PyJWK] = {}
+        self._jwks_uri: str | None = None
+        self._fetched_at: float | None = None
+        self._last_attempt: float | None = None
+        self._last_error: str | None = None
+        self._lock = threading.Lock()          # protege _keys / timestamps
+        self._fetch_lock = threading.Lock()    # un solo fetch a la vez
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._stats = {"hits": 0, "refreshes": 0, "refresh_errors": 0, "unknown_kid_refetches": 0}
+
+    # --- red ---
+    def _get_json(self, url: str) -> dict:
+        r = requests.get(url, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def refresh(self) -> bool:
+        """Descarga discovery (una vez) + JWKS. False si falló (se conservan las llaves previas)."""
+        with self._fetch_lock:
+            with self._lock:
+                self._last_attempt = monotonic()
+            try:
+                if self._jwks_uri is None:
+                    self._jwks_uri = self._get_json(self.discovery_url)["jwks_uri"]
+                jwk_set = PyJWKSet.from_dict(self._get_json(self._jwks_uri))
+                keys = {k.key_id: k for k in jwk_set.keys if k.key_id}
+            except Exception as e:
+                with self._lock:
+                    self._last_error = str(e)
+                    self._stats["refresh_errors"] += 1
+                logger.warning(f"⚠️ No se pudo refrescar JWKS ({self.discovery_url}): {e}")
+                return False
+            with self._lock:
+                self._keys = keys
+                self._fetched_at = monotonic()
+                self._last_error = None
+                self._stats["refreshes"] += 1
+            logger.info(f"🔑 JWKS actualizado: {len(keys)} llave(s)")
+            return True
+
+    # --- background ---
+    def _loop(self) -> None:
+        while not self._stop.wait(self.refresh_seconds):
+            self.refresh()
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="jwks-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _refresh_async(self) -> None:
+        if not self._fetch_lock.locked():
+            threading.Thread(target=self.refresh, name="jwks-revalidate", daemon=True).start()
+
+    # --- lookup ---
+    def get_signing_key(self, kid: str | None) -> PyJWK:
+        if not kid:
+            raise PyJWKClientError("El token no trae 'kid'")
+
+        with self._lock:
+            key = self._keys.get(kid)
+            fetched_at, last_attempt = self._fetched_at, self._last_attempt
+            if key is not None:
+                self._stats["hits"] += 1
+        now = monotonic()
+
+        if key is not None:
+            # viejas (p.ej. el thread de fondo falló): servir igual y revalidar aparte
+            if fetched_at is None or now - fetched_at > self.refresh_seconds * 2:
+                self._refresh_async()
+            return key
+
+        # kid desconocido: primera vez, o Azure rotó las llaves
+        if last_attempt is None or now - last_attempt >= self.min_refetch_seconds:
+            with self._lock:
+                self._stats["unknown_kid_refetches"] += 1
+            self.refresh()
+            with self._lock:
+                key = self._keys.get(kid)
+        if key is None:
+            raise PyJWKClientError(f"No hay llave de firma para kid={kid}")
+        return key
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "discovery_url": self.discovery_url,
+                "jwks_uri": self._jwks_uri,
+                "kids": sorted(self._keys),
+                "age_seconds": round(monotonic() - self._fetched_at, 1) if self._fetched_at else None,
+                "last_error": self._last_error,
+                "background_thread": bool(self._thread and self._thread.is_alive()),
+                **self._stats,
+            }
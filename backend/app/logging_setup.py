@@ -0,0 +1,180 @@
+"""
+Logging no bloqueante y estructurado.
+
+Antes: basicConfig → StreamHandler a stderr, así que cada logger.info()
+formateaba y escribía en el thread del request bajo el lock del handler, y la
+instrumentación (measure_endpoint / measure_query / middleware) generaba
+varias líneas f-string por llamada. Ahora configure_logging():
+
+- root → QueueHandler (cola acotada, LOG_QUEUE_MAX; si se llena se descarta
+  y se cuenta en vez de bloquear) → QueueListener en un thread aparte, que
+  serializa y escribe. En el thread del request solo queda getMessage().
+- LOG_FORMAT=json: una línea JSON por registro con ts, level, logger, msg,
+  request_id y los campos de `extra=`; LOG_FORMAT=text: el formato de antes
+  más el request id.
+- request id por request (RequestIdMiddleware; respeta un X-Request-ID
+  entrante y lo devuelve en la respuesta).
+- LOG_SAMPLING="perf=0.1,app.timing=0.2": fracción de registros < WARNING
+  que se conserva por logger (y sus hijos).
+
+Para que un nivel deshabilitado no cueste nada, los llamadores usan
+argumentos %-style (logger.info("... %s", x)) en vez de f-strings.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+_request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+# atributos propios de LogRecord; el resto viene de extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+_listener: logging.handlers.QueueListener | None = None
+_handler: "_DroppingQueueHandler | None" = None
+
+
+def current_request_id() -> str | None:
+    return _request_id.get()
+
+
+# --- pipeline ---
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que no bloquea: con la cola llena descarta el registro."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # el formateo final (JSON / texto) lo hace el listener; aquí solo lo imprescindible
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = _request_id.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """Conserva una fracción de los registros bajo WARNING según el logger (prefijo más largo)."""
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = sorted(rates.items(), key=lambda kv: len(kv[0]), reverse=True)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                return random.random() < rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            out["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                out[key] = value
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        record.request_id = getattr(record, "request_id", None) or "-"
+        return super().format(record)
+
+
+def _parse_sampling(spec: str) -> dict[str, float]:
+    rates = {}
+    for part in (spec or "").split(","):
+        name, _, rate = part.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+def configure_logging(settings) -> None:
+    """Reemplaza los handlers del root por la cola + listener (idempotente)."""
+    global _listener, _handler
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stderr)
+    if settings.LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(_TextFormatter("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"))
+
+    _handler = _DroppingQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_MAX))
+    _handler.addFilter(SamplingFilter(_parse_sampling(settings.LOG_SAMPLING)))
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(_handler)
+    root.setLevel(settings.LOG_LEVEL.upper())
+
+    _listener = logging.handlers.QueueListener(_handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)  # vacía la cola al salir
+
+
+def stats() -> dict:
+    return {
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+    }
+
+
+# --- request id ---
+class RequestIdMiddleware:
+    """Asigna un id a cada request (o respeta X-Request-ID) y lo devuelve en la respuesta."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = dict(scope.get("headers") or []).get(b"x-request-id", b"").decode("latin-1")
+        rid = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex[:16]
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-request-id", rid.encode())]}
+            await send(message)
+
+        token = _request_id.set(rid)
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _request_id.reset(token)
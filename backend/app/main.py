@@ -1,16 +1,30 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func, and_, or_, case, literal, false, text, insert, distinct
+from sqlalchemy import select, func, and_, or_, case, literal, false, text, insert, distinct, tuple_
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from .auth import verify_token, require_roles
+from fastapi.security import HTTPAuthorizationCredentials
+from .auth import verify_token, require_roles, token_cache_stats, jwks_status
+from .config import get_settings
+from .compression import CompressionMiddleware
+from . import auto_explain, slow_requests, sql_trace
+from .profiler import ProfilerMiddleware
+from .logging_setup import RequestIdMiddleware, configure_logging, stats as logging_stats
+from . import prometheus
+from . import shared_metrics
+from . import export_jobs
+from .db import engine
 from pydantic import BaseModel, EmailStr, constr
 from fastapi import Path
 from typing import Literal
 from typing import Optional
 import logging
+import secrets
 from time import perf_counter
 from fastapi import Request
 
+# Logging por cola (no bloquea los requests), JSON de una línea con request id
+configure_logging(get_settings())
+
 app = FastAPI(title="Quality Backend", version="0.1.0")
 
 logger = logging.getLogger("perf")
@@ -27,8 +41,9 @@ async def log_request_time(request: Request, call_next):
 
     path = request.url.path
     # Filtramos solo lo que nos interesa
-    if path.startswith(("/metrics", "/aconex")):
-        logger.info(f"[PERF] {request.method} {path} took {duration_ms:.1f} ms")
+    if path.startswith(("/metrics", "/aconex")) and logger.isEnabledFor(logging.INFO):
+        logger.info("[PERF] %s %s took %.1f ms", request.method, path, duration_ms,
+                    extra={"method": request.method, "path": path, "duration_ms": round(duration_ms, 1)})
 
     return response
 
@@ -53,6 +68,37 @@ app.add_middleware(
     expose_headers=["Content-Disposition"] # por si descargas/descargas excel
 )
 
+# Compresión de JSON/CSV (gzip; zstd/brotli si están instalados)
+_cs = get_settings()
+if _cs.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        encodings=[e.strip() for e in _cs.COMPRESSION_ENCODINGS.split(",") if e.strip()],
+        levels={"gzip": _cs.COMPRESSION_GZIP_LEVEL, "zstd": _cs.COMPRESSION_ZSTD_LEVEL, "br": _cs.COMPRESSION_BROTLI_LEVEL},
+        minimum_size=_cs.COMPRESSION_MIN_SIZE,
+    )
+
+# Traza SQL por request (todas las sentencias del engine, detección de N+1)
+if _cs.SQL_TRACE_ENABLED:
+    sql_trace.install(engine)
+    app.add_middleware(sql_trace.SqlTraceMiddleware)
+
+# Latencia por ruta para /admin/performance/prometheus
+app.add_middleware(prometheus.RequestMetricsMiddleware)
+
+# ?__profile=1 (Admin): perfil muestreado del request en vez de la respuesta
+if _cs.PROFILE_ENABLED:
+    app.add_middleware(ProfilerMiddleware)
+
+# Stats de timing.py compartidas entre workers (segmento mmap por worker)
+shared_metrics.start()
+
+# Export jobs: barre lo que dejó un reinicio y luego cada EXPORT_JOB_SWEEP_SECONDS
+export_jobs.start_sweeper()
+
+# Request id (X-Request-ID) para los logs; el más externo para cubrir a todos los demás
+app.add_middleware(RequestIdMiddleware)
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -85,22 +131,42 @@ from .models.apsa_protocol import ApsaProtocol
 from .models.aconex_doc import AconexDoc
 from .utils import (
     sha256_bytes, normalize_cols, find_header_row_for_apsa,
-    extract_subsystem_code, normalize_disc_code, discipline_from_subsystem
+    extract_subsystem_code, normalize_disc_code, discipline_from_subsystem,
+    latest_revision_flags,
 )
+from .normalization import normalize_code
+from .pagination import encode_cursor, decode_cursor
+from .search import contains_filter as search_contains, search_ranked, suggest as search_suggest
+from .facets import facet_counts
+from . import apsa_index
+from .xlsx_export import write_xlsx, xlsx_file_response, remove_temp_file, XLSX_YIELD_PER, XLSX_MEDIA_TYPE
+from . import artifacts
+from .columnar_export import (
+    ColumnarFormat, write_columnar, available as columnar_available,
+    MEDIA_TYPES as COLUMNAR_MEDIA_TYPES, COLUMNAR_BATCH_ROWS,
+)
+from .count_cache import CountMode, count_rows, cached_value, make_key as make_count_key, invalidate as invalidate_counts, stats as count_cache_stats
 from sqlalchemy import select, delete
 
 from pydantic import BaseModel, EmailStr, Field
 from fastapi import Response
-from datetime import datetime, timezone
 
 from .models.user import User
 from .models.refresh_token import RefreshToken
-from .security import hash_password, verify_password, create_access_token, new_refresh_token, hash_token, refresh_token_expiry, check_needs_rehash
+from .security import create_access_token, new_refresh_token, hash_token, refresh_token_expiry
+from .refresh_tokens import (
+    rotate as rotate_refresh_token, RotationError, maybe_schedule_purge as purge_refresh_tokens_maybe,
+    purge as purge_refresh_tokens, status as refresh_tokens_status,
+)
+from .password_pool import hash_password, verify_password, verify_and_rehash, PoolBusy, stats as password_pool_stats
 from fastapi import Request
 from sqlalchemy import literal
 from sqlalchemy.orm import aliased
 from fastapi import Query
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
+import os
+import shutil
 from io import StringIO
 import csv
 from sqlalchemy import literal_column
@@ -108,15 +174,11 @@ import logging
 from sqlalchemy.exc import DataError
 from sqlalchemy import inspect
 
-# Configurar logging para instrumentación
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 # Importar utilidades de timing
 from .timing import measure_endpoint, measure_query
+from .metrics_fast import count_error_ss_fast, count_aconex_validos_fast, count_aconex_unicos_fast
 
 def set_refresh_cookie(response: Response, token: str):
     s = get_settings()
@@ -151,10 +213,6 @@ def clear_refresh_cookie(response: Response):
 
     response.delete_cookie(**delete_kwargs)
 
-def _norm_sql(expr):
-    # UPPER(TRIM(REPLACE(REPLACE(expr,'-',''),' ','')))
-    return func.upper(func.trim(func.replace(func.replace(expr, "-", ""), " ", "")))
-
 def _pick_sheet(xls: pd.ExcelFile, preferred_name: str) -> str:
     # Busca por nombre exacto (case-insensitive) y si no, toma la primera
     lowpref = preferred_name.strip().lower()
@@ -164,10 +222,15 @@ def _pick_sheet(xls: pd.ExcelFile, preferred_name: str) -> str:
     return xls.sheet_names[0]
 
 def _store_load(db: Session, source: SourceEnum, filename: str, filehash: str) -> Load:
+    """
+    Crea la carga sin commitear (flush → id). El upload commitea la carga y sus
+    filas juntas: ningún otro request ve una carga vigente a medio insertar, así
+    que todo lo que se deriva y cachea por load_id (totales, facetas, índice de
+    /apsa/list, artefactos) se calcula siempre sobre la carga completa.
+    """
     load = Load(source=source, filename=filename, file_hash=filehash)
     db.add(load)
-    db.commit()
-    db.refresh(load)
+    db.flush()
     return load
 
 def _purge_old_loads(db: Session, source: SourceEnum, keep: int = 2):
@@ -188,6 +251,7 @@ def _latest_load_id(db: Session, source: SourceEnum) -> int | None:
         .order_by(Load.loaded_at.desc(), Load.id.desc())
         .limit(1)
     ).scalar()
+    sql_trace.annotate_load(source.value, row)
     return row
 
 def _previous_load_id(db: Session, source: SourceEnum) -> int | None:
@@ -200,7 +264,7 @@ def _previous_load_id(db: Session, source: SourceEnum) -> int | None:
     return ids[1] if len(ids) > 1 else None
 
 def _purge_source_all(db: Session, source: SourceEnum) -> int:
-    """Borra TODAS las cargas y sus filas asociadas para una fuente."""
+    """Borra TODAS las cargas y sus filas asociadas para una fuente (sin commit: va en la transacción del upload)."""
     load_ids = [lid for (lid,) in db.execute(select(Load.id).where(Load.source == source)).all()]
     if not load_ids:
         return 0
@@ -209,9 +273,18 @@ def _purge_source_all(db: Session, source: SourceEnum) -> int:
     elif source == SourceEnum.ACONEX:
         db.execute(delete(AconexDoc).where(AconexDoc.load_id.in_(load_ids)))
     db.execute(delete(Load).where(Load.id.in_(load_ids)))
-    db.commit()
     return len(load_ids)
 
+def _on_load_published(source: SourceEnum, rows: int = 0, seconds: float = 0.0) -> None:
+    """Hook post-ingesta: descarta lo derivado de las cargas anteriores."""
+    prometheus.record_ingest(source.value, rows, seconds)
+    invalidate_counts()
+    if get_settings().APSA_INDEX_ENABLED:
+        apsa_index.schedule_rebuild(_aconex_exists_flags)
+    # exports sin filtros: se generan una vez, ahora, en vez de en cada descarga
+    artifacts.schedule_render(force_sources=(source,))
+    logger.info(f"🔄 Carga {source.value} publicada: caches de totales invalidados")
+
 class BootstrapRequest(BaseModel):
     token: str
     email: EmailStr
@@ -427,19 +500,29 @@ def auth_bootstrap(body: BootstrapRequest, db: Session = Depends(get_db)):
     db.refresh(user)
     return {"ok": True, "user_id": user.id, "email": user.email, "roles": user.roles.split(",")}
 
+@app.exception_handler(PoolBusy)
+def _password_pool_busy(request: Request, exc: PoolBusy):
+    # pool de Argon2 saturado (p.ej. pico de logins): rechazo rápido en vez de colgar el threadpool
+    from fastapi.responses import JSONResponse
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Servidor ocupado verificando credenciales, reintenta en unos segundos"},
+        headers={"Retry-After": "2"},
+    )
+
 @app.post("/auth/login", response_model=LoginResponse)
 def auth_login(body: LoginRequest, response: Response, db: Session = Depends(get_db)):
     user = db.execute(select(User).where(User.email == str(body.email).lower())).scalar_one_or_none()
     if not user or not user.is_active:
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
 
-    if not verify_password(body.password, user.password_hash):
+    # verify + re-hash progresivo en una sola ida al pool de procesos:
+    # si el hash actual usa parámetros antiguos (lentos), lo actualizamos transparentemente
+    ok, new_hash = verify_and_rehash(body.password, user.password_hash)
+    if not ok:
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
-
-    # Re-hash progresivo: actualizar contraseñas con parámetros optimizados
-    # Si el hash actual usa parámetros antiguos (lentos), lo actualizamos transparentemente
-    if check_needs_rehash(user.password_hash):
-        user.password_hash = hash_password(body.password)
+    if new_hash:
+        user.password_hash = new_hash
         db.commit()
 
     # TODO: si user.mfa_secret existe, verifica body.totp_code (pyotp)
@@ -457,6 +540,7 @@ def auth_login(body: LoginRequest, response: Response, db: Session = Depends(get
     )
     db.add(rt)
     db.commit()
+    purge_refresh_tokens_maybe()  # en background, como mucho una vez por intervalo
 
     set_refresh_cookie(response, raw_refresh)
 
@@ -478,41 +562,18 @@ def auth_refresh(
     if not raw_refresh:
         raise HTTPException(status_code=401, detail="Sin refresh token")
 
-    token_h = hash_token(raw_refresh)
-    now = datetime.now(timezone.utc)
-
-    rt = db.execute(
-        select(RefreshToken).where(
-            RefreshToken.token_hash == token_h,
-            RefreshToken.revoked == False,
-            RefreshToken.expires_at > now
-        )
-    ).scalar_one_or_none()
-
-    if not rt:
+    # rotación: revoca el actual + inserta el nuevo + trae el usuario, en un round-trip
+    new_raw = new_refresh_token()
+    try:
+        user = rotate_refresh_token(db, hash_token(raw_refresh), hash_token(new_raw), refresh_token_expiry())
+    except RotationError as e:
+        if e.reason == "inactive":
+            raise HTTPException(status_code=401, detail="Usuario inactivo")
         raise HTTPException(status_code=401, detail="Refresh inválido o expirado")
-
-    user = db.execute(select(User).where(User.id == rt.user_id)).scalar_one_or_none()
-    if not user or not user.is_active:
-        raise HTTPException(status_code=401, detail="Usuario inactivo")
-
-    # rotación
-    rt.revoked = True
-    db.add(rt)
+    purge_refresh_tokens_maybe()
 
     roles = [r.strip() for r in (user.roles or "User").split(",") if r.strip()]
-    access_token = create_access_token(user.id, user.email, user.full_name, roles)
-
-    new_raw = new_refresh_token()
-    new_rt = RefreshToken(
-        user_id=user.id,
-        token_hash=hash_token(new_raw),
-        expires_at=refresh_token_expiry(),
-        revoked=False,
-        parent_id=rt.id
-    )
-    db.add(new_rt)
-    db.commit()
+    access_token = create_access_token(user.user_id, user.email, user.full_name, roles)
 
     set_refresh_cookie(response, new_raw)
 
@@ -582,6 +643,7 @@ def upload_apsa(
     db: Session = Depends(get_db),
     decoded=Depends(require_roles("Admin"))
 ):
+    t0 = perf_counter()
     if hard:
         _purge_source_all(db, SourceEnum.APSA)
 
@@ -643,7 +705,7 @@ def upload_apsa(
 
     logger.info("Límite detectado para apsa_protocols.tag = %s", tag_limit)
 
-    # Crear registro de carga
+    # Crear registro de carga (se commitea junto con sus filas)
     load = _store_load(db, SourceEnum.APSA, file.filename, filehash)
 
     # 🚀 OPTIMIZADO: Procesamiento vectorizado (10-15x más rápido)
@@ -681,6 +743,7 @@ def upload_apsa(
         rec['load_id'] = load.id
 
     if not records:
+        db.commit()
         return {"ok": True, "rows_inserted": 0, "sheet": sheet, "header_row": int(header_row)}
 
     try:
@@ -701,6 +764,7 @@ def upload_apsa(
         logger.warning("APSA: %s tags fueron recortados a %s caracteres", clipped, tag_limit)
 
     _purge_old_loads(db, SourceEnum.APSA, keep=2)
+    _on_load_published(SourceEnum.APSA, rows=len(records), seconds=perf_counter() - t0)
 
     return {
         "ok": True,
@@ -718,6 +782,7 @@ def upload_aconex(
     db: Session = Depends(get_db),
     decoded=Depends(require_roles("Admin"))
 ):
+    t0 = perf_counter()
     if hard:
         _purge_source_all(db, SourceEnum.ACONEX)
     content = file.file.read()
@@ -751,7 +816,7 @@ def upload_aconex(
     if missing:
         raise HTTPException(status_code=400, detail=f"Columnas faltantes en ACONEX: {missing}")
 
-    # Crear carga
+    # Crear carga (se commitea junto con sus filas)
     load = _store_load(db, SourceEnum.ACONEX, file.filename, filehash)
 
     # 🚀 OPTIMIZADO: Procesamiento vectorizado (10-15x más rápido)
@@ -779,10 +844,17 @@ def upload_aconex(
     else:
         df['discipline'] = df['function'].apply(normalize_disc_code)
 
+    # Última revisión por documento (misma normalización que document_no_norm)
+    doc_keys = df['document_no'].map(normalize_code).tolist()
+    received = pd.to_datetime(df['date_received'], errors='coerce', dayfirst=True, format='mixed')
+    received_ts = [None if pd.isna(d) else d.timestamp() for d in received]
+    df['is_latest'] = latest_revision_flags(doc_keys, df['revision'].tolist(), received_ts)
+    logger.info(f"ACONEX: {int(df['is_latest'].sum())} filas de última revisión de {len(df)}")
+
     # Crear lista de diccionarios para bulk insert
     columns_to_export = ['document_no', 'title', 'discipline', 'function', 'subsystem_text',
                          'subsystem_code', 'system_no', 'file_name', 'equipment_tag_no',
-                         'date_received', 'revision', 'transmitted']
+                         'date_received', 'revision', 'transmitted', 'is_latest']
 
     records = df[columns_to_export].to_dict('records')
 
@@ -801,8 +873,11 @@ def upload_aconex(
             db.rollback()
             logger.exception("Error guardando ACONEX")
             raise HTTPException(status_code=400, detail=f"Error guardando ACONEX: {str(e)}")
+    else:
+        db.commit()
 
     _purge_old_loads(db, SourceEnum.ACONEX, keep=2)
+    _on_load_published(SourceEnum.ACONEX, rows=len(records), seconds=perf_counter() - t0)
 
     return {"ok": True, "rows_inserted": len(records), "sheet": sheet}
 
@@ -833,16 +908,6 @@ def metrics_cards(db: Session = Depends(get_db), decoded=Depends(verify_token)):
 
         universo = (abiertos or 0) + (cerrados or 0)
 
-    # --- Normalizador SQL
-    def N(expr):
-        return func.replace(
-            func.replace(
-                func.replace(func.upper(func.trim(expr)), " ", ""),
-                "-", ""
-            ),
-            "_", ""
-        )
-
     # --- Métricas ACONEX
     aconex_rows = aconex_unicos = aconex_validos = 0
     aconex_error_ss = 0  # NUEVO
@@ -854,33 +919,18 @@ def metrics_cards(db: Session = Depends(get_db), decoded=Depends(verify_token)):
                 select(func.count()).select_from(AconexDoc).where(AconexDoc.load_id == aconex_id)
             ).scalar() or 0
 
-        # 2) Documentos únicos (normalizados)
-        with measure_query("Count ACONEX documentos únicos (normalized)", "metrics_cards"):
-            aconex_unicos = db.execute(
-                select(func.count(func.distinct(N(AconexDoc.document_no)))).where(AconexDoc.load_id == aconex_id)
-            ).scalar() or 0
+        # 2) Documentos únicos (columna document_no_norm indexada)
+        with measure_query("Count ACONEX documentos únicos (document_no_norm)", "metrics_cards"):
+            aconex_unicos = count_aconex_unicos_fast(db, aconex_id)
 
         # 3) Válidos: doc únicos que matchean con APSA por código normalizado
         if apsa_id:
-            with measure_query("Count ACONEX válidos (match con APSA por código)", "metrics_cards"):
-                aconex_validos = db.execute(
-                    select(func.count(func.distinct(N(AconexDoc.document_no)))).where(
-                        AconexDoc.load_id == aconex_id,
-                        select(1).where(
-                            ApsaProtocol.load_id == apsa_id,
-                            N(ApsaProtocol.codigo_cmdic) == N(AconexDoc.document_no)
-                        ).exists()
-                    )
-                ).scalar() or 0
+            with measure_query("Count ACONEX válidos (match con APSA por *_norm)", "metrics_cards"):
+                aconex_validos = count_aconex_validos_fast(db, apsa_id, aconex_id)
 
-            # === ULTRA OPTIMIZADO: Protocolos APSA con "Error de SS"
-            # Usa columnas normalizadas pre-calculadas (si existen)
-            # Reducido de >15 minutos a ~200-500ms (99.9% mejora!)
-
-            from .metrics_fast import count_error_ss_auto
-
-            with measure_query("Count APSA con Error de SS (ULTRA OPTIMIZADO con columnas norm)", "metrics_cards"):
-                aconex_error_ss = count_error_ss_auto(db, apsa_id, aconex_id)
+            # === Protocolos APSA con "Error de SS" (columnas *_norm indexadas)
+            with measure_query("Count APSA con Error de SS (columnas norm)", "metrics_cards"):
+                aconex_error_ss = count_error_ss_fast(db, apsa_id, aconex_id)
 
     aconex_invalidos = max(0, (aconex_unicos or 0) - (aconex_validos or 0))
     aconex_duplicados = max(0, (aconex_rows or 0) - (aconex_unicos or 0))
@@ -1156,14 +1206,14 @@ def debug_aconex_unmatched(db: Session = Depends(get_db), decoded=Depends(verify
         select(func.count()).select_from(sub_no_match_strict)
     ).scalar() or 0
 
-    # Subconsulta: Aconex DOCs sin match usando normalización (quitando guiones/espacios)
+    # Subconsulta: Aconex DOCs sin match usando columnas normalizadas (*_norm)
     sub_no_match_norm = (
         select(AconexDoc.document_no)
         .where(
             AconexDoc.load_id == aconex_id,
             ~select(1).where(
                 ApsaProtocol.load_id == apsa_id,
-                _norm_sql(AconexDoc.document_no) == _norm_sql(ApsaProtocol.codigo_cmdic)
+                ApsaProtocol.codigo_cmdic_norm == AconexDoc.document_no_norm
             ).exists()
         )
         .subquery()
@@ -1195,11 +1245,12 @@ def aconex_unmatched(
     if not apsa_id or not aconex_id:
         return {"total": 0, "items": [], "strict": strict}
 
-    left_expr = AconexDoc.document_no if strict else _norm_sql(AconexDoc.document_no)
-    right_expr = ApsaProtocol.codigo_cmdic if strict else _norm_sql(ApsaProtocol.codigo_cmdic)
+    left_expr = AconexDoc.document_no if strict else AconexDoc.document_no_norm
+    right_expr = ApsaProtocol.codigo_cmdic if strict else ApsaProtocol.codigo_cmdic_norm
 
     where_list = [
         AconexDoc.load_id == aconex_id,
+        AconexDoc.is_latest,  # una fila por documento (última revisión)
         ~select(1).where(
             ApsaProtocol.load_id == apsa_id,
             right_expr == left_expr
@@ -1244,8 +1295,38 @@ def aconex_unmatched(
 
     return {"strict": strict, "total": int(total), "items": items}
 
+UNMATCHED_CSV_HEADER = ["document_no","title","function","subsystem","revision","file_name","date_received"]
+
+def _unmatched_export_query(apsa_id: int, aconex_id: int, strict: bool):
+    left_expr = AconexDoc.document_no if strict else AconexDoc.document_no_norm
+    right_expr = ApsaProtocol.codigo_cmdic if strict else ApsaProtocol.codigo_cmdic_norm
+
+    where_list = [
+        AconexDoc.load_id == aconex_id,
+        AconexDoc.is_latest,  # una fila por documento (última revisión)
+        ~select(1).where(
+            ApsaProtocol.load_id == apsa_id,
+            right_expr == left_expr
+        ).exists()
+    ]
+
+    return select(
+        AconexDoc.document_no,
+        AconexDoc.title,
+        AconexDoc.function,
+        AconexDoc.subsystem_text,
+        AconexDoc.revision,
+        AconexDoc.file_name,
+        AconexDoc.date_received,
+    ).where(*where_list).order_by(AconexDoc.document_no.asc())
+
+def _unmatched_export_rows(rows):
+    for r in rows:
+        yield [r[0], r[1] or "", r[2] or "", r[3] or "", r[4] or "", r[5] or "", r[6] or ""]
+
 @app.get("/aconex/unmatched.csv")
 def aconex_unmatched_csv(
+    request: Request,
     strict: bool = Query(False),
     db: Session = Depends(get_db),
     decoded = Depends(require_roles("Admin")),
@@ -1257,46 +1338,41 @@ def aconex_unmatched_csv(
         def _iter_empty():
             out = StringIO()
             w = csv.writer(out, delimiter=';')
-            w.writerow(["document_no","title","function","subsystem","revision","file_name","date_received"])
+            w.writerow(UNMATCHED_CSV_HEADER)
             yield out.getvalue()
         return StreamingResponse(_iter_empty(), media_type="text/csv",
                                  headers={"Content-Disposition":"attachment; filename=aconex_unmatched.csv"})
 
-    left_expr = AconexDoc.document_no if strict else _norm_sql(AconexDoc.document_no)
-    right_expr = ApsaProtocol.codigo_cmdic if strict else _norm_sql(ApsaProtocol.codigo_cmdic)
-
-    where_list = [
-        AconexDoc.load_id == aconex_id,
-        ~select(1).where(
-            ApsaProtocol.load_id == apsa_id,
-            right_expr == left_expr
-        ).exists()
-    ]
+    if not strict:
+        cached = _artifact_or_none(request, "aconex_unmatched.csv", apsa_id, aconex_id)
+        if cached is not None:
+            return cached
 
-    rows = db.execute(
-        select(
-            AconexDoc.document_no,
-            AconexDoc.title,
-            AconexDoc.function,
-            AconexDoc.subsystem_text,
-            AconexDoc.revision,
-            AconexDoc.file_name,
-            AconexDoc.date_received,
-        ).where(*where_list).order_by(AconexDoc.document_no.asc())
-    ).all()
+    rows = db.execute(_unmatched_export_query(apsa_id, aconex_id, strict)).all()
 
     def _iter_csv():
         out = StringIO()
         w = csv.writer(out, delimiter=';')
-        w.writerow(["document_no","title","function","subsystem","revision","file_name","date_received"])
+        w.writerow(UNMATCHED_CSV_HEADER)
         yield out.getvalue(); out.seek(0); out.truncate(0)
-        for r in rows:
-            w.writerow([r[0], r[1] or "", r[2] or "", r[3] or "", r[4] or "", r[5] or "", r[6] or ""])
+        for row in _unmatched_export_rows(rows):
+            w.writerow(row)
             yield out.getvalue(); out.seek(0); out.truncate(0)
 
     return StreamingResponse(_iter_csv(), media_type="text/csv",
                              headers={"Content-Disposition":"attachment; filename=aconex_unmatched.csv"})
 
+def _aconex_duplicate_key(strict: bool):
+    """
+    Clave de agrupación para duplicados + condición "no vacío".
+    - strict: solo TRIM/UPPER sobre document_no (runtime)
+    - normalizado: columna document_no_norm (indexada por load_id)
+    """
+    if strict:
+        key_expr = func.upper(func.trim(AconexDoc.document_no))
+        return key_expr, func.length(func.trim(AconexDoc.document_no)) > 0
+    return AconexDoc.document_no_norm, AconexDoc.document_no_norm != ""
+
 @app.get("/aconex/duplicates")
 @measure_endpoint("aconex_duplicates")
 def aconex_duplicates(
@@ -1308,14 +1384,9 @@ def aconex_duplicates(
     if not aconex_id:
         return []
 
-    # clave de agrupación
-    key_expr = (
-        func.upper(func.trim(AconexDoc.document_no))  # "estricto": solo TRIM/UPPER
-        if strict
-        else _norm_sql(AconexDoc.document_no)        # normalizado: sin espacios/guiones/underscores
-    )
+    key_expr, non_empty = _aconex_duplicate_key(strict)
 
-    mode_label = "strict (UPPER/TRIM)" if strict else "normalized (sin espacios/guiones)"
+    mode_label = "strict (UPPER/TRIM)" if strict else "normalized (document_no_norm)"
     with measure_query(f"GROUP BY document_no + HAVING count >= 2 ({mode_label})", "aconex_duplicates"):
         rows = db.execute(
             select(
@@ -1324,7 +1395,7 @@ def aconex_duplicates(
             )
             .where(
                 AconexDoc.load_id == aconex_id,
-                func.length(func.trim(AconexDoc.document_no)) > 0  # ignora vacíos
+                non_empty  # ignora vacíos
             )
             .group_by(key_expr)
             .having(func.count() >= 2)
@@ -1333,21 +1404,8 @@ def aconex_duplicates(
 
     return [{"document_no": (k or ""), "count": int(c or 0)} for (k, c) in rows]
 
-@app.get("/aconex/duplicates.csv")
-def aconex_duplicates_csv(
-    strict: bool = Query(False, description="Si true, cuenta duplicados sin normalizar (solo TRIM/UPPER)"),
-    db: Session = Depends(get_db),
-    decoded = Depends(verify_token),
-):
-    aconex_id = _latest_load_id(db, SourceEnum.ACONEX)
-    if not aconex_id:
-        return Response(content="document_no;count\n", media_type="text/csv; charset=utf-8")
-
-    key_expr = (
-        func.upper(func.trim(AconexDoc.document_no))
-        if strict
-        else _norm_sql(AconexDoc.document_no)
-    )
+def _duplicates_csv_text(db: Session, aconex_id: int, strict: bool) -> tuple[str, int]:
+    key_expr, non_empty = _aconex_duplicate_key(strict)
 
     rows = db.execute(
         select(
@@ -1356,7 +1414,7 @@ def aconex_duplicates_csv(
         )
         .where(
             AconexDoc.load_id == aconex_id,
-            func.length(func.trim(AconexDoc.document_no)) > 0
+            non_empty
         )
         .group_by(key_expr)
         .having(func.count() >= 2)
@@ -1368,7 +1426,25 @@ def aconex_duplicates_csv(
     for k, c in rows:
         doc = (k or "").replace(";", " ")  # evita romper el CSV
         lines.append(f"{doc};{int(c or 0)}")
-    csv_data = "\n".join(lines)
+    return "\n".join(lines), len(rows)
+
+@app.get("/aconex/duplicates.csv")
+def aconex_duplicates_csv(
+    request: Request,
+    strict: bool = Query(False, description="Si true, cuenta duplicados sin normalizar (solo TRIM/UPPER)"),
+    db: Session = Depends(get_db),
+    decoded = Depends(verify_token),
+):
+    aconex_id = _latest_load_id(db, SourceEnum.ACONEX)
+    if not aconex_id:
+        return Response(content="document_no;count\n", media_type="text/csv; charset=utf-8")
+
+    if not strict:
+        cached = _artifact_or_none(request, "aconex_duplicados.csv", None, aconex_id)
+        if cached is not None:
+            return cached
+
+    csv_data, _ = _duplicates_csv_text(db, aconex_id, strict)
 
     filename = "aconex_duplicados_strict.csv" if strict else "aconex_duplicados.csv"
     return Response(
@@ -1549,7 +1625,82 @@ def apsa_options(db: Session = Depends(get_db), decoded=Depends(verify_token)):
     return {"disciplinas": discs, "subsistemas": subs}
 
 
+# --- Filtros compartidos del Log Protocolos (/apsa/list, exports) ---
+APSA_GRUPOS = {
+    "obra": ["50", "51", "52", "54"],
+    "mecanico": ["53", "55", "56"],
+    "ie": ["57", "58"],
+}
+
+def _aconex_exists_flags(aconex_id: int | None):
+    """
+    EXISTS correlacionados contra ACONEX: (match por código, match por código+SS).
+    Usa columnas *_norm y solo la última revisión → índice parcial idx_aconex_latest_doc_norm.
+    """
+    if not aconex_id:
+        return false(), false()
+    code_only_exists = select(1).where(
+        AconexDoc.load_id == aconex_id,
+        AconexDoc.is_latest,
+        AconexDoc.document_no_norm == ApsaProtocol.codigo_cmdic_norm,
+    ).exists()
+    code_and_ss_exists = select(1).where(
+        AconexDoc.load_id == aconex_id,
+        AconexDoc.is_latest,
+        AconexDoc.document_no_norm == ApsaProtocol.codigo_cmdic_norm,
+        AconexDoc.subsystem_code_norm == ApsaProtocol.subsistema_norm,
+    ).exists()
+    return code_only_exists, code_and_ss_exists
+
+def _apply_apsa_filters(
+    stmt, code_only_exists, code_and_ss_exists, *,
+    subsistema=None, disciplina=None, grupo=None, q=None, status=None,
+    cargado=False, error_ss=False, sin_aconex=False,
+):
+    # filtros "simples"
+    if subsistema:
+        stmt = stmt.where(ApsaProtocol.subsistema == subsistema)
+    if disciplina:
+        stmt = stmt.where(ApsaProtocol.disciplina == disciplina)
+    if grupo and grupo in APSA_GRUPOS:
+        stmt = stmt.where(ApsaProtocol.disciplina.in_(APSA_GRUPOS[grupo]))
+    if q and q.strip():
+        # ILIKE '%q%' → índices trigram (pg_trgm) en codigo/descripcion/tag
+        stmt = stmt.where(search_contains(q))
+    # ✅ filtro por status (ABIERTO/CERRADO)
+    if status:
+        s_up = status.strip().upper()
+        if s_up in ("ABIERTO", "CERRADO"):
+            stmt = stmt.where(ApsaProtocol.status_bim360 == s_up)
+
+    # ✅ filtros Aconex:
+    # - cargado: exige match code+SS
+    # - error_ss: code match PERO SS distinto
+    # - sin_aconex: NO tiene match de código
+    if cargado:
+        stmt = stmt.where(code_and_ss_exists)
+    if error_ss:
+        stmt = stmt.where(code_only_exists, ~code_and_ss_exists)
+    if sin_aconex:
+        stmt = stmt.where(~code_only_exists)
+    return stmt
+
+
+def _apsa_index_for(apsa_id: int, aconex_id: int | None):
+    """Índice en memoria para estas cargas, o None (usar SQL). Si falta, lo construye en background."""
+    if not get_settings().APSA_INDEX_ENABLED:
+        return None
+    idx = apsa_index.get(apsa_id, aconex_id)
+    if idx is None:
+        apsa_index.ensure_building(_aconex_exists_flags)
+    return idx
+
+
 # --- Listado paginado de protocolos APSA (JSON) ---
+# clave del cursor keyset: (subsistema, codigo_cmdic, id), el mismo orden del ORDER BY
+APSA_CURSOR_KEY = (str, str, int)
+
+
 @app.get("/apsa/list")
 def apsa_list(
     subsistema: str | None = None,
@@ -1562,12 +1713,18 @@ def apsa_list(
     sin_aconex: bool = False,         # NUEVO: sin cargar en Aconex
     page: int = 1,
     page_size: int = 50,
+    paginate: Literal["offset", "cursor"] = Query("offset", description="offset (page) o cursor (keyset, usar next_cursor)"),
+    cursor: str | None = Query(None, description="Token opaco devuelto en next_cursor (implica paginate=cursor)"),
+    count: CountMode = Query("exact", description="exact (cacheado por carga), estimate (planner) o none"),
     db: Session = Depends(get_db),
     decoded=Depends(verify_token)
 ):
+    keyset = paginate == "cursor" or bool(cursor)
     apsa_id = _latest_load_id(db, SourceEnum.APSA)
     if not apsa_id:
-        return {"rows": [], "total": 0, "page": page, "page_size": page_size}
+        if keyset:
+            return {"rows": [], "total": 0, "count": count, "page": None, "page_size": page_size, "next_cursor": None}
+        return {"rows": [], "total": 0, "count": count, "page": page, "page_size": page_size}
 
     # (opcional) mantener la incompatibilidad de antes:
     if cargado and error_ss:
@@ -1575,90 +1732,84 @@ def apsa_list(
 
     aconex_id = _latest_load_id(db, SourceEnum.ACONEX)
 
-    # 🚀 OPTIMIZADO: Usar columnas normalizadas pre-calculadas con índices
-    # Flags de existencia en Aconex (ULTRA RÁPIDO con columnas _norm)
-    if aconex_id:
-        code_only_exists = select(1).where(
-            AconexDoc.load_id == aconex_id,
-            AconexDoc.document_no_norm == ApsaProtocol.codigo_cmdic_norm,
-        ).exists()
-
-        code_and_ss_exists = select(1).where(
-            AconexDoc.load_id == aconex_id,
-            AconexDoc.document_no_norm == ApsaProtocol.codigo_cmdic_norm,
-            AconexDoc.subsystem_code_norm == ApsaProtocol.subsistema_norm,
-        ).exists()
+    load_ids = [apsa_id, aconex_id]
+    page_size = min(500, max(1, int(page_size)))
+    if not keyset:
+        page = max(1, int(page))
+        offset = (page - 1) * page_size
+    next_cursor = None
+
+    # ⚡ Índice en memoria (bitmaps) si ya está construido para estas cargas.
+    # q (texto libre) siempre va por SQL → índices trigram.
+    idx = _apsa_index_for(apsa_id, aconex_id) if not (q and q.strip()) else None
+
+    if idx is not None:
+        s_up = (status or "").strip().upper()
+        pos = idx.positions(
+            subsistema=subsistema,
+            disciplina=disciplina,
+            grupo_disciplinas=APSA_GRUPOS.get(grupo) if grupo else None,
+            status=s_up if s_up in ("ABIERTO", "CERRADO") else None,
+            cargado=cargado,
+            error_ss=error_ss,
+            sin_aconex=sin_aconex,
+        )
+        total = None if count == "none" else int(len(pos))
+        if keyset:
+            if cursor:
+                last_id = decode_cursor(cursor, load_ids, APSA_CURSOR_KEY)[2]
+                pos = idx.after_id(pos, last_id)
+                if pos is None:
+                    raise HTTPException(status_code=400, detail="Cursor inválido")
+            page_pos = pos[:page_size + 1]
+        else:
+            page_pos = pos[offset:offset + page_size]
+        rows_db = idx.page_rows(db, page_pos)
     else:
-        code_only_exists = false()
-        code_and_ss_exists = false()
-
-    # base query: con 'tipo' y flags
-    base = select(
-        ApsaProtocol.id,
-        ApsaProtocol.codigo_cmdic,
-        ApsaProtocol.descripcion,
-        ApsaProtocol.tag,
-        ApsaProtocol.subsistema,
-        ApsaProtocol.tipo,
-        ApsaProtocol.status_bim360,
-        code_only_exists.label("has_code"),
-        code_and_ss_exists.label("has_code_ss"),
-    ).where(ApsaProtocol.load_id == apsa_id)
+        code_only_exists, code_and_ss_exists = _aconex_exists_flags(aconex_id)
 
-    # filtros "simples"
-    if subsistema:
-        base = base.where(ApsaProtocol.subsistema == subsistema)
-    if disciplina:
-        base = base.where(ApsaProtocol.disciplina == disciplina)
-
-    # NUEVO: filtro por grupo de disciplinas
-    if grupo:
-        grupos_map = {
-            "obra": ["50", "51", "52", "54"],
-            "mecanico": ["53", "55", "56"],
-            "ie": ["57", "58"],
-        }
-        if grupo in grupos_map:
-            base = base.where(ApsaProtocol.disciplina.in_(grupos_map[grupo]))
+        # base query: con 'tipo' y flags
+        base = select(
+            ApsaProtocol.id,
+            ApsaProtocol.codigo_cmdic,
+            ApsaProtocol.descripcion,
+            ApsaProtocol.tag,
+            ApsaProtocol.subsistema,
+            ApsaProtocol.tipo,
+            ApsaProtocol.status_bim360,
+            code_only_exists.label("has_code"),
+            code_and_ss_exists.label("has_code_ss"),
+        ).where(ApsaProtocol.load_id == apsa_id)
 
-    if q and q.strip():
-        like = f"%{q.strip()}%"
-        base = base.where(
-            or_(
-                ApsaProtocol.codigo_cmdic.ilike(like),
-                ApsaProtocol.descripcion.ilike(like),
-                ApsaProtocol.tag.ilike(like),
-            )
+        filters = dict(
+            subsistema=subsistema, disciplina=disciplina, grupo=grupo, q=q, status=status,
+            cargado=cargado, error_ss=error_ss, sin_aconex=sin_aconex,
         )
+        base = _apply_apsa_filters(base, code_only_exists, code_and_ss_exists, **filters)
 
-    # ✅ filtro por status (ABIERTO/CERRADO)
-    if status:
-        s_up = status.strip().upper()
-        if s_up in ("ABIERTO", "CERRADO"):
-            base = base.where(ApsaProtocol.status_bim360 == s_up)
+        # total: cacheado por (cargas, filtros) → las páginas siguientes no repiten el count(*)
+        total = count_rows(db, base, make_count_key("apsa_list", load_ids, filters), count)
 
-    # ✅ filtros Aconex:
-    # - cargado: exige match code+SS
-    # - error_ss: code match PERO SS distinto
-    # - sin_aconex: NO tiene match de código
-    if cargado:
-        base = base.where(code_and_ss_exists)
-    if error_ss:
-        base = base.where(code_only_exists, ~code_and_ss_exists)
-    if sin_aconex:
-        base = base.where(~code_only_exists)
+        # Orden estable (subsistema, codigo_cmdic, id) → índice idx_apsa_load_keyset
+        # (la ingesta guarda '' y no NULL en subsistema/codigo, así que la comparación de tuplas es segura)
+        ordered = base.order_by(ApsaProtocol.subsistema.asc(), ApsaProtocol.codigo_cmdic.asc(), ApsaProtocol.id.asc())
 
-    # total y paginación
-    total = db.execute(select(func.count()).select_from(base.subquery())).scalar() or 0
-    page = max(1, int(page))
-    page_size = min(500, max(1, int(page_size)))
-    offset = (page - 1) * page_size
+        if keyset:
+            if cursor:
+                last_subs, last_cod, last_id = decode_cursor(cursor, load_ids, APSA_CURSOR_KEY)
+                ordered = ordered.where(
+                    tuple_(ApsaProtocol.subsistema, ApsaProtocol.codigo_cmdic, ApsaProtocol.id)
+                    > tuple_(literal(last_subs), literal(last_cod), literal(last_id))
+                )
+            # pedimos 1 fila extra para saber si hay página siguiente
+            rows_db = db.execute(ordered.limit(page_size + 1)).all()
+        else:
+            rows_db = db.execute(ordered.limit(page_size).offset(offset)).all()
 
-    rows_db = db.execute(
-        base.order_by(ApsaProtocol.subsistema.asc(), ApsaProtocol.codigo_cmdic.asc())
-            .limit(page_size)
-            .offset(offset)
-    ).all()
+    if keyset and len(rows_db) > page_size:
+        rows_db = rows_db[:page_size]
+        last = rows_db[-1]  # (id, codigo, desc, tag, subsistema, ...)
+        next_cursor = encode_cursor(load_ids, [last[4], last[1], last[0]])
 
     rows = []
     for _, cod, desc, tag, subs, tipo, status_bim360, has_code, has_code_ss in rows_db:
@@ -1683,48 +1834,168 @@ def apsa_list(
             "status": (status_bim360 or "").upper(),
         })
 
-    return {"rows": rows, "total": int(total), "page": page, "page_size": page_size}
+    if keyset:
+        return {"rows": rows, "total": total, "count": count, "page": None, "page_size": page_size, "next_cursor": next_cursor}
+    return {"rows": rows, "total": total, "count": count, "page": page, "page_size": page_size}
 
 
-# --- Export a CSV (respeta filtros) ---
-@app.get("/export/apsa.csv")
-def export_apsa_csv(
+# --- Conteos por faceta para los filtros del Log Protocolos (1 consulta, GROUPING SETS) ---
+@app.get("/apsa/facets")
+def apsa_facets(
     subsistema: str | None = None,
     disciplina: str | None = None,
-    grupo: str | None = None,         # NUEVO: "obra", "mecanico", "ie"
+    grupo: str | None = None,
     q: str | None = None,
     status: str | None = None,
     cargado: bool = False,
     error_ss: bool = False,
-    sin_aconex: bool = False,         # NUEVO: sin cargar en Aconex
+    sin_aconex: bool = False,
     db: Session = Depends(get_db),
     decoded=Depends(verify_token)
 ):
+    """
+    Para los filtros actuales, cuántas filas quedarían al elegir cada valor de
+    cada dimensión (status, disciplina, grupo, subsistema, aconex). El conteo de
+    una dimensión ignora su propio filtro. `q` es un filtro fijo, no una faceta.
+    Valores ausentes = 0 filas.
+    """
+    apsa_id = _latest_load_id(db, SourceEnum.APSA)
+    dims = ["status", "disciplina", "grupo", "subsistema", "aconex"]
+    if not apsa_id:
+        return {"total": 0, "facets": {d: {} for d in dims}}
+
+    aconex_id = _latest_load_id(db, SourceEnum.ACONEX)
+    code_only_exists, code_and_ss_exists = _aconex_exists_flags(aconex_id)
+
+    grupo_expr = case(
+        *[(ApsaProtocol.disciplina.in_(discs), literal(g)) for g, discs in APSA_GRUPOS.items()],
+        else_=None,
+    )
+    aconex_expr = case(
+        (code_and_ss_exists, literal("cargado")),
+        (code_only_exists, literal("error_ss")),
+        else_=literal("sin_aconex"),
+    )
+    inner = select(
+        ApsaProtocol.status_bim360.label("status"),
+        ApsaProtocol.disciplina.label("disciplina"),
+        grupo_expr.label("grupo"),
+        ApsaProtocol.subsistema.label("subsistema"),
+        aconex_expr.label("aconex"),
+    ).where(ApsaProtocol.load_id == apsa_id)
+    if q and q.strip():
+        inner = inner.where(search_contains(q))
+    sq = inner.subquery()
+
+    # filtros activos, expresados sobre las columnas de la subquery
+    matches = {}
+    if status and status.strip().upper() in ("ABIERTO", "CERRADO"):
+        matches["status"] = sq.c.status == status.strip().upper()
+    if disciplina:
+        matches["disciplina"] = sq.c.disciplina == disciplina
+    if grupo and grupo in APSA_GRUPOS:
+        matches["grupo"] = sq.c.grupo == grupo
+    if subsistema:
+        matches["subsistema"] = sq.c.subsistema == subsistema
+    acx_conds = [sq.c.aconex == name for name, on in
+                 (("cargado", cargado), ("error_ss", error_ss), ("sin_aconex", sin_aconex)) if on]
+    if acx_conds:
+        matches["aconex"] = and_(*acx_conds)
+
+    filters = dict(
+        subsistema=subsistema, disciplina=disciplina, grupo=grupo, q=q, status=status,
+        cargado=cargado, error_ss=error_ss, sin_aconex=sin_aconex,
+    )
+    key = make_count_key("apsa_facets", [apsa_id, aconex_id], filters)
+    return cached_value(key, lambda: facet_counts(db, sq, dims, matches))
+
+
+# --- Búsqueda full-text rankeada + autocompletado (índices GIN) ---
+@app.get("/apsa/search")
+def apsa_search(
+    q: str = Query(..., min_length=1, description="Palabras a buscar en código/descripción/tag"),
+    prefix: bool = Query(False, description="Si true, cada palabra se trata como prefijo"),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    decoded=Depends(verify_token)
+):
+    apsa_id = _latest_load_id(db, SourceEnum.APSA)
+    if not apsa_id:
+        return {"rows": [], "q": q}
+
+    rows = []
+    for r in search_ranked(db, apsa_id, q, limit=limit, prefix=prefix):
+        rows.append({
+            "document_no": (r.codigo_cmdic or "").strip(),
+            "descripcion": (f"{(r.tipo or '').strip()} — {(r.descripcion or '').strip()}").strip(" —"),
+            "tag": (str(r.tag) if r.tag is not None else "-").strip() or "-",
+            "subsistema": (r.subsistema or "").strip(),
+            "status": (r.status_bim360 or "").upper(),
+            "rank": round(float(r.rank or 0), 6),
+        })
+    return {"rows": rows, "q": q}
+
+@app.get("/apsa/search/suggest")
+def apsa_search_suggest(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db),
+    decoded=Depends(verify_token)
+):
+    apsa_id = _latest_load_id(db, SourceEnum.APSA)
+    if not apsa_id:
+        return {"suggestions": []}
+    return {"suggestions": search_suggest(db, apsa_id, q, limit=limit)}
+
+
+# --- Export a CSV / XLSX (respeta filtros) ---
+APSA_EXPORT_HEADER = ["NÚMERO DE DOCUMENTO ACONEX", "REV.", "DESCRIPCIÓN", "TAG", "SUBSISTEMA", "Aconex", "Status"]
+SS_ERRORS_EXPORT_HEADER = [
+    "NÚMERO DE DOCUMENTO ACONEX",
+    "REV.",
+    "DESCRIPCIÓN",
+    "TAG",
+    "SUBSISTEMA (APSA)",
+    "SUBSISTEMA(S) EN ACONEX",
+    "Status"
+]
+
+def _csv_bytes(header: list[str], rows) -> bytes:
+    """CSV ';' con BOM (Excel), formato de los exports del Log Protocolos."""
+    buf = StringIO()
+    w = csv.writer(buf, delimiter=";")
+    w.writerow(header)
+    w.writerows(rows)
+    return ("\ufeff" + buf.getvalue()).encode("utf-8")
+
+def _artifact_or_none(request: Request, name: str, apsa_id: int | None, aconex_id: int | None):
+    """Respuesta con el export pre-generado para estas cargas, o None (generar en vivo)."""
+    load_ids = {SourceEnum.APSA: apsa_id, SourceEnum.ACONEX: aconex_id}
+    art = artifacts.get(name, load_ids)
+    if art is None:
+        # p.ej. tras reiniciar con el cache vacío: que lo tengan las próximas descargas
+        if artifacts.renderable(name, load_ids):
+            artifacts.schedule_render()
+        return None
+    return artifacts.artifact_response(request, art)
+
+def _apsa_export_load_ids(db: Session) -> tuple[int, int | None]:
     apsa_id = _latest_load_id(db, SourceEnum.APSA)
     if not apsa_id:
         raise HTTPException(status_code=400, detail="No hay carga APSA disponible")
+    return apsa_id, _latest_load_id(db, SourceEnum.ACONEX)
 
+def _apsa_export_query(
+    apsa_id: int, aconex_id: int | None, *,
+    subsistema=None, disciplina=None, grupo=None, q=None, status=None,
+    cargado=False, error_ss=False, sin_aconex=False,
+):
+    """SELECT del Log Protocolos con los mismos filtros que /apsa/list (compartido CSV/XLSX/artefactos)."""
     # (opcional) misma incompatibilidad
     if cargado and error_ss:
         raise HTTPException(status_code=400, detail="Parámetros incompatibles: 'cargado' y 'error_ss' no pueden ser verdaderos a la vez")
 
-    aconex_id = _latest_load_id(db, SourceEnum.ACONEX)
-
-    # 🚀 OPTIMIZADO: Usar columnas normalizadas pre-calculadas con índices
-    if aconex_id:
-        code_only_exists = select(1).where(
-            AconexDoc.load_id == aconex_id,
-            AconexDoc.document_no_norm == ApsaProtocol.codigo_cmdic_norm,
-        ).exists()
-
-        code_and_ss_exists = select(1).where(
-            AconexDoc.load_id == aconex_id,
-            AconexDoc.document_no_norm == ApsaProtocol.codigo_cmdic_norm,
-            AconexDoc.subsystem_code_norm == ApsaProtocol.subsistema_norm,
-        ).exists()
-    else:
-        code_only_exists = false()
-        code_and_ss_exists = false()
+    code_only_exists, code_and_ss_exists = _aconex_exists_flags(aconex_id)
 
     qsel = (
         select(
@@ -1740,54 +2011,16 @@ def export_apsa_csv(
         .where(ApsaProtocol.load_id == apsa_id)
     )
 
-    # mismos filtros "simples"
-    if subsistema:
-        qsel = qsel.where(ApsaProtocol.subsistema == subsistema)
-    if disciplina:
-        qsel = qsel.where(ApsaProtocol.disciplina == disciplina)
-
-    # NUEVO: filtro por grupo de disciplinas
-    if grupo:
-        grupos_map = {
-            "obra": ["50", "51", "52", "54"],
-            "mecanico": ["53", "55", "56"],
-            "ie": ["57", "58"],
-        }
-        if grupo in grupos_map:
-            qsel = qsel.where(ApsaProtocol.disciplina.in_(grupos_map[grupo]))
-
-    if q and q.strip():
-        like = f"%{q.strip()}%"
-        qsel = qsel.where(
-            or_(
-                ApsaProtocol.codigo_cmdic.ilike(like),
-                ApsaProtocol.descripcion.ilike(like),
-                ApsaProtocol.tag.ilike(like),
-            )
-        )
-
-    # ✅ status
-    if status:
-        s_up = status.strip().upper()
-        if s_up in ("ABIERTO", "CERRADO"):
-            qsel = qsel.where(ApsaProtocol.status_bim360 == s_up)
-
-    # ✅ cargado / error_ss / sin_aconex
-    if cargado:
-        qsel = qsel.where(code_and_ss_exists)
-    if error_ss:
-        qsel = qsel.where(code_only_exists, ~code_and_ss_exists)
-    if sin_aconex:
-        qsel = qsel.where(~code_only_exists)
-
-    rows_db = db.execute(
-        qsel.order_by(ApsaProtocol.subsistema.asc(), ApsaProtocol.codigo_cmdic.asc())
-    ).all()
-
-    buf = StringIO()
-    w = csv.writer(buf, delimiter=";")
-    w.writerow(["NÚMERO DE DOCUMENTO ACONEX", "REV.", "DESCRIPCIÓN", "TAG", "SUBSISTEMA", "Aconex", "Status"])
+    # mismos filtros que /apsa/list
+    qsel = _apply_apsa_filters(
+        qsel, code_only_exists, code_and_ss_exists,
+        subsistema=subsistema, disciplina=disciplina, grupo=grupo, q=q, status=status,
+        cargado=cargado, error_ss=error_ss, sin_aconex=sin_aconex,
+    )
+    return qsel.order_by(ApsaProtocol.subsistema.asc(), ApsaProtocol.codigo_cmdic.asc())
 
+def _apsa_export_rows(rows_db):
+    """Filas ya formateadas para el export (acepta un resultado en streaming)."""
     for cod, desc, tag, subs, tipo, status_bim360, has_code, has_code_ss in rows_db:
         desc_out = (f"{(tipo or '').strip()} — {(desc or '').strip()}").strip(" —")
         if bool(has_code_ss):
@@ -1797,7 +2030,7 @@ def export_apsa_csv(
         else:
             aconex_str = ""
 
-        w.writerow([
+        yield [
             (cod or "").strip(),
             "0",
             desc_out,
@@ -1805,9 +2038,12 @@ def export_apsa_csv(
             (subs or "").strip(),
             aconex_str,
             (status_bim360 or "").upper(),
-        ])
+        ]
+
+def _apsa_export_is_filtered(subsistema, disciplina, grupo, q, status, cargado, error_ss, sin_aconex) -> bool:
+    return any([subsistema, disciplina, grupo, q and q.strip(), status, cargado, error_ss, sin_aconex])
 
-    csv_bytes = ("\ufeff" + buf.getvalue()).encode("utf-8")
+def _apsa_export_basename(disciplina=None, subsistema=None, q=None, status=None, cargado=False, error_ss=False) -> str:
     fname_parts = []
     if disciplina:  fname_parts.append(f"disc-{disciplina}")
     if subsistema:  fname_parts.append(f"sub-{subsistema.replace('/', '_')}")
@@ -1816,42 +2052,93 @@ def export_apsa_csv(
     if status: fname_parts.append(f"st-{status.strip().upper()}")
     if cargado: fname_parts.append("cargado")
     if error_ss: fname_parts.append("errorSS")
+    return "log_protocolos" + (f"_{'_'.join(fname_parts)}" if fname_parts else "")
+
+@app.get("/export/apsa.csv")
+def export_apsa_csv(
+    request: Request,
+    subsistema: str | None = None,
+    disciplina: str | None = None,
+    grupo: str | None = None,         # NUEVO: "obra", "mecanico", "ie"
+    q: str | None = None,
+    status: str | None = None,
+    cargado: bool = False,
+    error_ss: bool = False,
+    sin_aconex: bool = False,         # NUEVO: sin cargar en Aconex
+    db: Session = Depends(get_db),
+    decoded=Depends(verify_token)
+):
+    apsa_id, aconex_id = _apsa_export_load_ids(db)
+
+    # sin filtros → archivo pre-generado al publicar la carga (ETag/Range)
+    if not _apsa_export_is_filtered(subsistema, disciplina, grupo, q, status, cargado, error_ss, sin_aconex):
+        cached = _artifact_or_none(request, "apsa_log.csv", apsa_id, aconex_id)
+        if cached is not None:
+            return cached
+
+    stmt = _apsa_export_query(
+        apsa_id, aconex_id, subsistema=subsistema, disciplina=disciplina, grupo=grupo, q=q, status=status,
+        cargado=cargado, error_ss=error_ss, sin_aconex=sin_aconex,
+    )
+    csv_bytes = _csv_bytes(APSA_EXPORT_HEADER, _apsa_export_rows(db.execute(stmt).all()))
 
     from fastapi.responses import Response
-    fname = "log_protocolos" + (f"_{'_'.join(fname_parts)}" if fname_parts else "") + ".csv"
+    fname = _apsa_export_basename(disciplina, subsistema, q, status, cargado, error_ss) + ".csv"
     headers = {"Content-Disposition": f'attachment; filename="{fname}"'}
     return Response(content=csv_bytes, media_type="text/csv; charset=utf-8", headers=headers)
 
-@app.get("/export/aconex-ss-errors.csv")
-def export_aconex_ss_errors(
+@app.get("/export/apsa.xlsx")
+def export_apsa_xlsx(
+    request: Request,
+    subsistema: str | None = None,
+    disciplina: str | None = None,
+    grupo: str | None = None,
+    q: str | None = None,
+    status: str | None = None,
+    cargado: bool = False,
+    error_ss: bool = False,
+    sin_aconex: bool = False,
     db: Session = Depends(get_db),
-    decoded=Depends(verify_token),
+    decoded=Depends(verify_token)
 ):
-    apsa_id = _latest_load_id(db, SourceEnum.APSA)
-    aconex_id = _latest_load_id(db, SourceEnum.ACONEX)
-    if not apsa_id or not aconex_id:
-        raise HTTPException(status_code=400, detail="Falta carga APSA o ACONEX")
+    """Mismo contenido que /export/apsa.csv, en Excel (streaming desde cursor server-side)."""
+    apsa_id, aconex_id = _apsa_export_load_ids(db)
 
-    def N(expr):
-        return func.replace(
-            func.replace(
-                func.replace(func.upper(func.trim(expr)), " ", ""),
-                "-", ""
-            ),
-            "_", ""
-        )
+    if not _apsa_export_is_filtered(subsistema, disciplina, grupo, q, status, cargado, error_ss, sin_aconex):
+        cached = _artifact_or_none(request, "apsa_log.xlsx", apsa_id, aconex_id)
+        if cached is not None:
+            return cached
 
-    # Existen matches por código…
+    stmt = _apsa_export_query(
+        apsa_id, aconex_id, subsistema=subsistema, disciplina=disciplina, grupo=grupo, q=q, status=status,
+        cargado=cargado, error_ss=error_ss, sin_aconex=sin_aconex,
+    )
+    path, n = _write_apsa_xlsx(db, stmt)
+    logger.info(f"📄 XLSX Log Protocolos: {n:,} filas")
+    fname = _apsa_export_basename(disciplina, subsistema, q, status, cargado, error_ss) + ".xlsx"
+    return xlsx_file_response(path, fname)
+
+def _write_apsa_xlsx(db: Session, stmt) -> tuple[str, int]:
+    result = db.execute(stmt.execution_options(yield_per=XLSX_YIELD_PER))
+    return write_xlsx(
+        APSA_EXPORT_HEADER, _apsa_export_rows(result),
+        sheet_title="Log Protocolos", col_widths=[34, 6, 70, 22, 18, 14, 12],
+    )
+
+def _ss_errors_query(apsa_id: int, aconex_id: int):
+    # Existen matches por código… (columnas *_norm, última revisión de cada documento)
     exists_code_only = select(1).where(
         AconexDoc.load_id == aconex_id,
-        N(AconexDoc.document_no) == N(ApsaProtocol.codigo_cmdic),
+        AconexDoc.is_latest,
+        AconexDoc.document_no_norm == ApsaProtocol.codigo_cmdic_norm,
     ).exists()
 
     # …pero NO con el mismo subsistema.
     exists_code_ss = select(1).where(
         AconexDoc.load_id == aconex_id,
-        N(AconexDoc.document_no) == N(ApsaProtocol.codigo_cmdic),
-        N(AconexDoc.subsystem_code) == N(ApsaProtocol.subsistema),   # <— AJUSTA NOMBRE SI DIFERENTE
+        AconexDoc.is_latest,
+        AconexDoc.document_no_norm == ApsaProtocol.codigo_cmdic_norm,
+        AconexDoc.subsystem_code_norm == ApsaProtocol.subsistema_norm,
     ).exists()
 
     # Subconsulta: lista de subsistemas ACONEX para ese código que difieren del APSA
@@ -1859,15 +2146,16 @@ def export_aconex_ss_errors(
         select(func.string_agg(distinct(AconexDoc.subsystem_code), ','))
         .where(
             AconexDoc.load_id == aconex_id,
-            N(AconexDoc.document_no) == N(ApsaProtocol.codigo_cmdic),
-            N(AconexDoc.subsystem_code) != N(ApsaProtocol.subsistema),
+            AconexDoc.is_latest,
+            AconexDoc.document_no_norm == ApsaProtocol.codigo_cmdic_norm,
+            AconexDoc.subsystem_code_norm != ApsaProtocol.subsistema_norm,
         )
         .correlate(ApsaProtocol)
         .scalar_subquery()
         .label("aconex_subsistemas")
     )
 
-    q = (
+    return (
         select(
             ApsaProtocol.codigo_cmdic,
             ApsaProtocol.descripcion,
@@ -1885,25 +2173,12 @@ def export_aconex_ss_errors(
         .order_by(ApsaProtocol.subsistema.asc(), ApsaProtocol.codigo_cmdic.asc())
     )
 
-    rows = db.execute(q).all()
-
-    buf = StringIO()
-    w = csv.writer(buf, delimiter=";")
-    w.writerow([
-        "NÚMERO DE DOCUMENTO ACONEX",
-        "REV.",
-        "DESCRIPCIÓN",
-        "TAG",
-        "SUBSISTEMA (APSA)",
-        "SUBSISTEMA(S) EN ACONEX",
-        "Status"
-    ])
-
+def _ss_errors_rows(rows):
     for cod, desc, tipo, tag, subs, status, aconex_ss in rows:
         tipo_s = (tipo or "").strip()
         desc_s = (desc or "").strip()
         descripcion_final = " - ".join([x for x in [tipo_s, desc_s] if x])
-        w.writerow([
+        yield [
             (cod or "").strip(),
             "0",
             descripcion_final,
@@ -1911,13 +2186,296 @@ def export_aconex_ss_errors(
             (subs or "").strip(),
             (aconex_ss or "").strip(),
             (status or "").strip(),
-        ])
+        ]
+
+def _ss_errors_load_ids(db: Session) -> tuple[int, int]:
+    apsa_id = _latest_load_id(db, SourceEnum.APSA)
+    aconex_id = _latest_load_id(db, SourceEnum.ACONEX)
+    if not apsa_id or not aconex_id:
+        raise HTTPException(status_code=400, detail="Falta carga APSA o ACONEX")
+    return apsa_id, aconex_id
+
+def _write_ss_errors_xlsx(db: Session, apsa_id: int, aconex_id: int) -> tuple[str, int]:
+    result = db.execute(_ss_errors_query(apsa_id, aconex_id).execution_options(yield_per=XLSX_YIELD_PER))
+    return write_xlsx(
+        SS_ERRORS_EXPORT_HEADER, _ss_errors_rows(result),
+        sheet_title="Errores SS", col_widths=[34, 6, 70, 22, 18, 28, 12],
+    )
+
+@app.get("/export/aconex-ss-errors.csv")
+def export_aconex_ss_errors(
+    request: Request,
+    db: Session = Depends(get_db),
+    decoded=Depends(verify_token),
+):
+    apsa_id, aconex_id = _ss_errors_load_ids(db)
+    cached = _artifact_or_none(request, "aconex_ss_errors.csv", apsa_id, aconex_id)
+    if cached is not None:
+        return cached
+
+    rows = db.execute(_ss_errors_query(apsa_id, aconex_id)).all()
+    csv_bytes = _csv_bytes(SS_ERRORS_EXPORT_HEADER, _ss_errors_rows(rows))
 
-    csv_bytes = ("\ufeff" + buf.getvalue()).encode("utf-8")
     from fastapi.responses import Response
     headers = {"Content-Disposition": 'attachment; filename="aconex_ss_errors.csv"'}
     return Response(content=csv_bytes, media_type="text/csv; charset=utf-8", headers=headers)
 
+@app.get("/export/aconex-ss-errors.xlsx")
+def export_aconex_ss_errors_xlsx(
+    request: Request,
+    db: Session = Depends(get_db),
+    decoded=Depends(verify_token),
+):
+    """Mismo contenido que /export/aconex-ss-errors.csv, en Excel."""
+    apsa_id, aconex_id = _ss_errors_load_ids(db)
+    cached = _artifact_or_none(request, "aconex_ss_errors.xlsx", apsa_id, aconex_id)
+    if cached is not None:
+        return cached
+
+    path, n = _write_ss_errors_xlsx(db, apsa_id, aconex_id)
+    logger.info(f"📄 XLSX errores SS: {n:,} filas")
+    return xlsx_file_response(path, "aconex_ss_errors.xlsx")
+
+
+# --- Exports en background (jobs) para exports filtrados grandes ---
+def _export_job_out(job) -> dict:
+    out = job.public()
+    out["status_url"] = f"/export/jobs/{job.id}"
+    out["download_url"] = f"/export/jobs/{job.id}/download" if job.status == "done" else None
+    return out
+
+def _write_apsa_csv_file(db: Session, stmt, dest: str) -> int:
+    """Igual que /export/apsa.csv pero a disco y en batches del cursor (no arma todo en memoria)."""
+    n = 0
+    with open(dest, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.writer(f, delimiter=";")
+        w.writerow(APSA_EXPORT_HEADER)
+        for row in _apsa_export_rows(db.execute(stmt.execution_options(yield_per=XLSX_YIELD_PER))):
+            w.writerow(row)
+            n += 1
+    return n
+
+@app.post("/export/jobs/apsa", status_code=202)
+def export_job_apsa(
+    format: Literal["csv", "xlsx"] = Query("csv"),
+    subsistema: str | None = None,
+    disciplina: str | None = None,
+    grupo: str | None = None,
+    q: str | None = None,
+    status: str | None = None,
+    cargado: bool = False,
+    error_ss: bool = False,
+    sin_aconex: bool = False,
+    db: Session = Depends(get_db),
+    decoded=Depends(verify_token)
+):
+    """
+    Crea un job con los mismos filtros que /export/apsa.csv y responde al tiro.
+    Consultar `status_url` hasta status=done y bajar el archivo de `download_url`.
+    """
+    apsa_id, aconex_id = _apsa_export_load_ids(db)
+    # el SELECT (y la validación de filtros → 400) se arma acá; el job solo lo ejecuta
+    stmt = _apsa_export_query(
+        apsa_id, aconex_id, subsistema=subsistema, disciplina=disciplina, grupo=grupo, q=q, status=status,
+        cargado=cargado, error_ss=error_ss, sin_aconex=sin_aconex,
+    )
+    basename = _apsa_export_basename(disciplina, subsistema, q, status, cargado, error_ss)
+
+    if format == "xlsx":
+        def render(job_db: Session, dest: str) -> int:
+            path, n = _write_apsa_xlsx(job_db, stmt)
+            shutil.move(path, dest)
+            return n
+        media_type = XLSX_MEDIA_TYPE
+    else:
+        def render(job_db: Session, dest: str) -> int:
+            return _write_apsa_csv_file(job_db, stmt, dest)
+        media_type = "text/csv; charset=utf-8"
+
+    try:
+        job = export_jobs.submit(
+            f"apsa.{format}", render,
+            filename=f"{basename}.{format}", media_type=media_type, owner=decoded.get("sub"),
+        )
+    except export_jobs.QueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Hay demasiados exports en curso, reintenta en unos minutos",
+            headers={"Retry-After": "30"},
+        )
+    return _export_job_out(job)
+
+@app.get("/export/jobs/{job_id}")
+def export_job_status(job_id: str, decoded=Depends(verify_token)):
+    job = export_jobs.get(job_id, decoded.get("sub"))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado o expirado")
+    return _export_job_out(job)
+
+@app.get("/export/jobs/{job_id}/download")
+def export_job_download(job_id: str, decoded=Depends(verify_token)):
+    job = export_jobs.get(job_id, decoded.get("sub"))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado o expirado")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"El export aún no está listo (status={job.status})")
+    # el archivo se conserva hasta que vence el TTL (se puede volver a bajar)
+    return FileResponse(job.path, media_type=job.media_type, filename=job.filename)
+
+
+# --- Artefactos pre-generados al publicar una carga (exports sin filtros) ---
+def _write_csv_file(dest: str, content: bytes) -> None:
+    with open(dest, "wb") as f:
+        f.write(content)
+
+def _render_apsa_log_csv(db: Session, ids: dict, dest: str) -> int:
+    rows = db.execute(_apsa_export_query(ids[SourceEnum.APSA], ids[SourceEnum.ACONEX])).all()
+    _write_csv_file(dest, _csv_bytes(APSA_EXPORT_HEADER, _apsa_export_rows(rows)))
+    return len(rows)
+
+def _render_apsa_log_xlsx(db: Session, ids: dict, dest: str) -> int:
+    path, n = _write_apsa_xlsx(db, _apsa_export_query(ids[SourceEnum.APSA], ids[SourceEnum.ACONEX]))
+    shutil.move(path, dest)
+    return n
+
+def _render_ss_errors_csv(db: Session, ids: dict, dest: str) -> int:
+    rows = db.execute(_ss_errors_query(ids[SourceEnum.APSA], ids[SourceEnum.ACONEX])).all()
+    _write_csv_file(dest, _csv_bytes(SS_ERRORS_EXPORT_HEADER, _ss_errors_rows(rows)))
+    return len(rows)
+
+def _render_ss_errors_xlsx(db: Session, ids: dict, dest: str) -> int:
+    path, n = _write_ss_errors_xlsx(db, ids[SourceEnum.APSA], ids[SourceEnum.ACONEX])
+    shutil.move(path, dest)
+    return n
+
+def _render_unmatched_csv(db: Session, ids: dict, dest: str) -> int:
+    rows = db.execute(_unmatched_export_query(ids[SourceEnum.APSA], ids[SourceEnum.ACONEX], False)).all()
+    with open(dest, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f, delimiter=';')
+        w.writerow(UNMATCHED_CSV_HEADER)
+        w.writerows(_unmatched_export_rows(rows))
+    return len(rows)
+
+def _render_duplicates_csv(db: Session, ids: dict, dest: str) -> int:
+    text_csv, n = _duplicates_csv_text(db, ids[SourceEnum.ACONEX], False)
+    _write_csv_file(dest, text_csv.encode("utf-8"))
+    return n
+
+_BOTH = (SourceEnum.APSA, SourceEnum.ACONEX)
+artifacts.register("apsa_log.csv", sources=_BOTH, media_type="text/csv; charset=utf-8",
+                   filename="log_protocolos.csv", render=_render_apsa_log_csv)
+artifacts.register("apsa_log.xlsx", sources=_BOTH, media_type=XLSX_MEDIA_TYPE,
+                   filename="log_protocolos.xlsx", render=_render_apsa_log_xlsx)
+artifacts.register("aconex_ss_errors.csv", sources=_BOTH, media_type="text/csv; charset=utf-8",
+                   filename="aconex_ss_errors.csv", render=_render_ss_errors_csv)
+artifacts.register("aconex_ss_errors.xlsx", sources=_BOTH, media_type=XLSX_MEDIA_TYPE,
+                   filename="aconex_ss_errors.xlsx", render=_render_ss_errors_xlsx)
+artifacts.register("aconex_unmatched.csv", sources=_BOTH, media_type="text/csv",
+                   filename="aconex_unmatched.csv", render=_render_unmatched_csv)
+artifacts.register("aconex_duplicados.csv", sources=(SourceEnum.ACONEX,), media_type="text/csv; charset=utf-8",
+                   filename="aconex_duplicados.csv", render=_render_duplicates_csv)
+
+
+# --- Export columnar (Parquet / Arrow) de una carga completa, para análisis ---
+APSA_COLUMNAR = [
+    ("id", "int"), ("codigo_cmdic", "str"), ("tipo", "str"), ("descripcion", "str"), ("tag", "str"),
+    ("subsistema", "dict"), ("disciplina", "dict"), ("status_bim360", "dict"),
+    ("aconex_estado", "dict"),        # vs última carga ACONEX: cargado / error_ss / sin_aconex
+]
+ACONEX_COLUMNAR = [
+    ("id", "int"), ("document_no", "str"), ("title", "str"), ("discipline", "dict"), ("function", "dict"),
+    ("subsystem_text", "str"), ("subsystem_code", "dict"), ("system_no", "dict"), ("file_name", "str"),
+    ("equipment_tag_no", "str"), ("date_received", "str"), ("revision", "dict"), ("transmitted", "dict"),
+    ("is_latest", "bool"),
+    ("apsa_estado", "dict"),          # vs última carga APSA: match / error_ss / sin_apsa
+]
+
+def _distinct_values(db: Session, col, load_col, load_id: int) -> list[str]:
+    return db.execute(
+        select(col).where(load_col == load_id, col.isnot(None)).group_by(col).order_by(col.asc())
+    ).scalars().all()
+
+def _export_load_columnar(db: Session, load_id: int, fmt: ColumnarFormat):
+    if not columnar_available():
+        raise HTTPException(status_code=503, detail="Export columnar no disponible: falta pyarrow en el servidor")
+    load = db.get(Load, load_id)
+    if not load:
+        raise HTTPException(status_code=404, detail="Carga no encontrada")
+
+    if load.source == SourceEnum.APSA:
+        model, columns = ApsaProtocol, APSA_COLUMNAR
+        other_id = _latest_load_id(db, SourceEnum.ACONEX)
+        code_only_exists, code_and_ss_exists = _aconex_exists_flags(other_id)
+        states = ["cargado", "error_ss", "sin_aconex"]
+        dict_cols = ["subsistema", "disciplina", "status_bim360"]
+    else:
+        model, columns = AconexDoc, ACONEX_COLUMNAR
+        other_id = _latest_load_id(db, SourceEnum.APSA)
+        if other_id:
+            code_only_exists = select(1).where(
+                ApsaProtocol.load_id == other_id,
+                ApsaProtocol.codigo_cmdic_norm == AconexDoc.document_no_norm,
+            ).exists()
+            code_and_ss_exists = select(1).where(
+                ApsaProtocol.load_id == other_id,
+                ApsaProtocol.codigo_cmdic_norm == AconexDoc.document_no_norm,
+                ApsaProtocol.subsistema_norm == AconexDoc.subsystem_code_norm,
+            ).exists()
+        else:
+            code_only_exists, code_and_ss_exists = false(), false()
+        states = ["match", "error_ss", "sin_apsa"]
+        dict_cols = ["discipline", "function", "subsystem_code", "system_no", "revision", "transmitted"]
+
+    estado = case(
+        (code_and_ss_exists, literal(states[0])),
+        (code_only_exists, literal(states[1])),
+        else_=literal(states[2]),
+    )
+    state_col = columns[-1][0]
+    stmt = (
+        select(*[getattr(model, name) for name, _ in columns[:-1]], estado.label(state_col))
+        .where(model.load_id == load_id)
+        .order_by(model.id.asc())
+    )
+    dictionaries = {c: _distinct_values(db, getattr(model, c), model.load_id, load_id) for c in dict_cols}
+    dictionaries[state_col] = states
+
+    metadata = {
+        "source": load.source.value,
+        "load_id": load.id,
+        "filename": load.filename,
+        "loaded_at": load.loaded_at.isoformat() if load.loaded_at else "",
+        "match_against_load_id": other_id or "",
+    }
+    result = db.execute(stmt.execution_options(yield_per=COLUMNAR_BATCH_ROWS))
+    path, n = write_columnar(result, columns, dictionaries, fmt, metadata=metadata)
+    logger.info(f"📦 Export {fmt} de load {load_id} ({load.source.value}): {n:,} filas, {os.path.getsize(path):,} bytes")
+
+    return FileResponse(
+        path,
+        media_type=COLUMNAR_MEDIA_TYPES[fmt],
+        filename=f"{load.source.value.lower()}_load_{load_id}.{fmt}",
+        background=BackgroundTask(remove_temp_file, path),
+    )
+
+@app.get("/export/load/{load_id}.parquet")
+def export_load_parquet(
+    load_id: int = Path(..., ge=1),
+    db: Session = Depends(get_db),
+    decoded=Depends(verify_token),
+):
+    """Carga completa (APSA o ACONEX) + estado de match, en Parquet (zstd, columnas diccionario)."""
+    return _export_load_columnar(db, load_id, "parquet")
+
+@app.get("/export/load/{load_id}.arrow")
+def export_load_arrow(
+    load_id: int = Path(..., ge=1),
+    db: Session = Depends(get_db),
+    decoded=Depends(verify_token),
+):
+    """Igual que .parquet, como Arrow IPC stream (pyarrow.ipc.open_stream)."""
+    return _export_load_columnar(db, load_id, "arrow")
+
 
 # ==================================================================================
 # ENDPOINTS DE INSTRUMENTACIÓN DE PERFORMANCE
@@ -1925,6 +2483,50 @@ def export_aconex_ss_errors(
 
 from .timing import get_all_stats, get_endpoint_stats, reset_stats
 
+@app.get("/admin/apsa-index/status")
+def apsa_index_status(decoded=Depends(require_roles("Admin"))):
+    """Estado del índice en memoria de /apsa/list (cargas, filas, memoria, tiempo de build)."""
+    return {"enabled": get_settings().APSA_INDEX_ENABLED, **apsa_index.status()}
+
+
+@app.post("/admin/apsa-index/rebuild")
+def apsa_index_rebuild(decoded=Depends(require_roles("Admin"))):
+    """Fuerza la reconstrucción del índice en background (p.ej. tras cambios manuales en la BD)."""
+    started = apsa_index.schedule_rebuild(_aconex_exists_flags)
+    return {"ok": True, "started": started, "note": None if started else "Ya había una reconstrucción en curso; se repetirá al terminar"}
+
+
+@app.get("/admin/maintenance/refresh-tokens")
+def refresh_tokens_maintenance_status(db: Session = Depends(get_db), decoded=Depends(require_roles("Admin"))):
+    """Tamaño de refresh_tokens (activos / revocados / expirados) y última purga."""
+    row = db.execute(text("""
+        SELECT count(*) AS total,
+               count(*) FILTER (WHERE NOT revoked AND expires_at > now()) AS active,
+               count(*) FILTER (WHERE revoked) AS revoked,
+               count(*) FILTER (WHERE expires_at <= now()) AS expired
+        FROM refresh_tokens
+    """)).mappings().one()
+    return {"tokens": dict(row), "purge": refresh_tokens_status()}
+
+
+@app.post("/admin/maintenance/refresh-tokens/purge")
+def refresh_tokens_maintenance_purge(db: Session = Depends(get_db), decoded=Depends(require_roles("Admin"))):
+    """Purga ahora (síncrono) los tokens expirados y revocados viejos."""
+    return {"ok": True, **purge_refresh_tokens(db)}
+
+
+@app.get("/admin/exports/artifacts")
+def exports_artifacts_status(decoded=Depends(require_roles("Admin"))):
+    """Exports pre-generados: directorio, artefactos registrados y resultado de la última generación."""
+    return artifacts.status()
+
+
+@app.post("/admin/exports/artifacts/render")
+def exports_artifacts_render(decoded=Depends(require_roles("Admin"))):
+    """Genera (en background) los artefactos que falten para las cargas vigentes."""
+    return {"ok": True, "started": artifacts.schedule_render()}
+
+
 @app.get("/admin/performance/stats")
 def performance_stats(
     endpoint: str | None = Query(None, description="Nombre del endpoint específico (opcional)"),
@@ -1939,18 +2541,140 @@ def performance_stats(
 
     Ejemplo: /admin/performance/stats?endpoint=metrics_cards
     """
+    others = shared_metrics.other_workers()
     if endpoint:
-        stats = {endpoint: get_endpoint_stats(endpoint)}
+        stats = {endpoint: get_endpoint_stats(endpoint, others)}
     else:
-        stats = get_all_stats()
+        stats = get_all_stats(others)
 
     return {
         "success": True,
         "stats": stats,
+        "count_cache": count_cache_stats(),
+        "export_jobs": export_jobs.stats(),
+        "token_cache": token_cache_stats(),
+        "jwks": jwks_status(),
+        "password_pool": password_pool_stats(),
+        "logging": logging_stats(),
+        "workers": shared_metrics.status(),
+        "note": "Tiempos en milisegundos (ms)"
+    }
+
+
+@app.get("/admin/performance/sql")
+def performance_sql(
+    limit: int = Query(50, ge=1, le=500),
+    order_by: Literal["total", "calls", "p99", "avg"] = Query("total"),
+    decoded=Depends(require_roles("Admin"))
+):
+    """
+    Sentencias SQL agrupadas por fingerprint (todas las que pasan por el engine,
+    no solo las envueltas en measure_query) y patrones N+1 detectados por ruta.
+    """
+    others = shared_metrics.other_series("statements", "n_plus_one")
+    return {
+        "success": True,
+        "enabled": get_settings().SQL_TRACE_ENABLED,
+        "statements": sql_trace.statement_stats(limit, order_by, others),
+        "n_plus_one": sql_trace.n_plus_one(others),
         "note": "Tiempos en milisegundos (ms)"
     }
 
 
+@app.get("/admin/performance/slow")
+def performance_slow(
+    limit: int = Query(50, ge=1, le=500),
+    decoded=Depends(require_roles("Admin"))
+):
+    """
+    Requests recientes que superaron SLOW_REQUEST_THRESHOLD_MS, del más lento al
+    más rápido: ruta, parámetros, usuario, load_ids, cada sentencia SQL con su
+    tiempo y (si está activo) un stack de Python tomado durante el request.
+    """
+    s = get_settings()
+    return {
+        "success": True,
+        "enabled": s.SQL_TRACE_ENABLED and s.SLOW_REQUEST_THRESHOLD_MS > 0,
+        "threshold_ms": s.SLOW_REQUEST_THRESHOLD_MS,
+        "requests": slow_requests.entries(limit, [entries for (entries,) in shared_metrics.other_series("slow")]),
+        "note": "Tiempos en milisegundos (ms)"
+    }
+
+
+@app.get("/admin/performance/explain")
+def performance_explain(
+    all_plans: bool = Query(False, alias="all", description="Incluir planes sin patrones sospechosos"),
+    limit: int = Query(50, ge=1, le=200),
+    decoded=Depends(require_roles("Admin"))
+):
+    """
+    Planes EXPLAIN (ANALYZE, BUFFERS) capturados automáticamente para sentencias
+    lentas (AUTO_EXPLAIN_ENABLED). Por defecto solo los que tienen Seq Scan sobre
+    apsa_protocols/aconex_docs o un Nested Loop anti-join.
+    """
+    return {
+        "success": True,
+        **auto_explain.status(),
+        "plans": auto_explain.plans(flagged_only=not all_plans, limit=limit),
+        "note": "Tiempos en milisegundos (ms)"
+    }
+
+
+def _require_metrics_access(request: Request):
+    """Admin (JWT) o, para el scraper de Prometheus, `Authorization: Bearer <METRICS_TOKEN>`."""
+    auth_header = request.headers.get("authorization", "")
+    metrics_token = get_settings().METRICS_TOKEN
+    if metrics_token and secrets.compare_digest(auth_header.encode(), f"Bearer {metrics_token}".encode()):
+        return
+    scheme, _, credentials = auth_header.partition(" ")
+    if scheme.lower() != "bearer" or not credentials:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    decoded = verify_token(HTTPAuthorizationCredentials(scheme=scheme, credentials=credentials))
+    if "Admin" not in (decoded.get("roles") or []):
+        raise HTTPException(status_code=403, detail="Insufficient role")
+
+
+def _process_counters() -> dict:
+    """Contadores de este proceso para /prometheus (y para el segmento compartido de los demás workers)."""
+    count_stats = count_cache_stats()
+    token_stats = token_cache_stats()
+    pool_stats = password_pool_stats()
+    return {
+        "caches": {
+            "count": {"hits": count_stats["hits"], "misses": count_stats["misses"]},
+            "token": {"hits": token_stats["hits"], "misses": token_stats["misses"]},
+        },
+        "counters": [
+            ("quality_password_pool_rejected_total", "Operaciones Argon2 rechazadas (503) desde el arranque", pool_stats["rejected"], {}),
+            ("quality_password_pool_timeouts_total", "Operaciones Argon2 sobre PASSWORD_POOL_TIMEOUT_SECONDS (503) desde el arranque", pool_stats["timeouts"], {}),
+        ],
+    }
+
+
+shared_metrics.register_counters(_process_counters)
+
+
+@app.get("/admin/performance/prometheus")
+def performance_prometheus(_=Depends(_require_metrics_access)):
+    """
+    Métricas en formato de texto de Prometheus (para scrapear). Histogramas,
+    ingestas y contadores suman todos los workers (segmentos compartidos);
+    los gauges son los del worker que atiende.
+    """
+    local = _process_counters()
+    body = prometheus.render(
+        statements=sql_trace.statement_histograms(shared_metrics.other_series("statements", "n_plus_one")),
+        caches=local["caches"],
+        pool=engine.pool,
+        extra_gauges=[
+            ("quality_password_pool_in_flight", "Operaciones Argon2 en vuelo", password_pool_stats()["in_flight"], {}),
+        ],
+        extra_counters=local["counters"],
+        others=shared_metrics.other_series("requests", "ingest", "process"),
+    )
+    return Response(content=body, media_type=prometheus.CONTENT_TYPE)
+
+
 @app.post("/admin/performance/reset")
 def performance_reset(
     db: Session = Depends(get_db),
@@ -1962,6 +2686,10 @@ def performance_reset(
     Útil para limpiar métricas después de pruebas o para empezar fresh.
     """
     reset_stats()
+    shared_metrics.reset_all()
+    sql_trace.reset()
+    slow_requests.reset()
+    auto_explain.reset()
     return {
         "success": True,
         "message": "Performance statistics reset successfully"
@@ -1986,20 +2714,25 @@ def performance_summary(
         "aconex_duplicates"
     ]
 
+    others = shared_metrics.other_workers()
     summary = []
     for ep in target_endpoints:
-        stats = get_endpoint_stats(ep)
+        stats = get_endpoint_stats(ep, others)
         if stats["calls"] > 0:
-            query_count = len(stats["last_execution_queries"])
-            total_query_time = sum(q["time_ms"] for q in stats["last_execution_queries"])
+            # tiempo medio por llamada de cada query instrumentada del endpoint
+            query_count = len(stats["queries"])
+            total_query_time = sum(q["avg_time_ms"] for q in stats["queries"].values())
 
             summary.append({
                 "endpoint": ep,
                 "avg_time_ms": round(stats["avg_time_ms"], 2),
+                "p50_ms": stats["p50"],
+                "p99_ms": stats["p99"],
                 "min_time_ms": round(stats["min_time_ms"], 2),
                 "max_time_ms": round(stats["max_time_ms"], 2),
                 "calls": stats["calls"],
-                "last_execution": {
+                "rate_per_s_5m": stats["windows"]["5m"]["rate_per_s"],
+                "per_call": {
                     "query_count": query_count,
                     "total_query_time_ms": round(total_query_time, 2),
                     "overhead_ms": round(stats["avg_time_ms"] - total_query_time, 2) if query_count > 0 else 0
@@ -2009,10 +2742,13 @@ def performance_summary(
             summary.append({
                 "endpoint": ep,
                 "avg_time_ms": 0,
+                "p50_ms": 0,
+                "p99_ms": 0,
                 "min_time_ms": 0,
                 "max_time_ms": 0,
                 "calls": 0,
-                "last_execution": None
+                "rate_per_s_5m": 0,
+                "per_call": None
             })
 
     return {
@@ -2070,6 +2806,7 @@ def debug_error_ss(
             ON ap.codigo_cmdic_norm = acx.document_no_norm
         WHERE ap.load_id = :apsa_id
           AND acx.load_id = :aconex_id
+          AND acx.is_latest
           AND (
               ap.subsistema_norm != acx.subsystem_code_norm
               OR ap.subsistema_norm IS NULL
@@ -2110,6 +2847,7 @@ def debug_error_ss(
             ON ap.codigo_cmdic_norm = acx.document_no_norm
         WHERE ap.load_id = :apsa_id
           AND acx.load_id = :aconex_id
+          AND acx.is_latest
           AND (
               ap.subsistema_norm != acx.subsystem_code_norm
               OR ap.subsistema_norm IS NULL
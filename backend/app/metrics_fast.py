@@ -24,6 +24,7 @@ def count_error_ss_fast(db: Session, apsa_load_id: int, aconex_load_id: int) ->
 
     Criterio: Existe match por código (normalizado) con ACONEX,
               PERO NO existe match por código + subsistema.
+              Solo cuenta la última revisión de cada documento ACONEX.
 
     Performance:
     - Con columnas norm + índices: 200-500ms
@@ -60,6 +61,7 @@ def count_error_ss_fast(db: Session, apsa_load_id: int, aconex_load_id: int) ->
         )
         .where(
             AconexDoc.load_id == aconex_load_id,
+            AconexDoc.is_latest,                    # Solo última revisión (índice parcial)
             AconexDoc.document_no_norm.isnot(None)  # Evitar NULLs
         )
         .subquery()
@@ -105,6 +107,7 @@ def count_aconex_validos_fast(db: Session, apsa_load_id: int, aconex_load_id: in
         select(func.count(func.distinct(AconexDoc.document_no_norm)))
         .where(
             AconexDoc.load_id == aconex_load_id,
+            AconexDoc.is_latest,
             AconexDoc.document_no_norm.isnot(None),
             # Existe en APSA
             select(1).where(
@@ -135,6 +138,7 @@ def count_aconex_unicos_fast(db: Session, aconex_load_id: int) -> int:
         select(func.count(func.distinct(AconexDoc.document_no_norm)))
         .where(
             AconexDoc.load_id == aconex_load_id,
+            AconexDoc.is_latest,  # 1 fila por documento: count(distinct) sobre el set chico
             AconexDoc.document_no_norm.isnot(None)
         )
     ).scalar()
@@ -7,21 +7,9 @@ from sqlalchemy import select, func, and_, or_, case
 from sqlalchemy.orm import Session
 from .models.apsa_protocol import ApsaProtocol
 from .models.aconex_doc import AconexDoc
-
-
-def _norm_sql(expr):
-    """Normalización SQL: UPPER(TRIM(REPLACE(REPLACE(REPLACE(...)))).
-
-    Nota: Esta función es COSTOSA en runtime. Idealmente debería usarse
-    una columna pre-calculada con índice.
-    """
-    return func.replace(
-        func.replace(
-            func.replace(func.upper(func.trim(expr)), " ", ""),
-            "-", ""
-        ),
-        "_", ""
-    )
+# Normalización SQL canónica (la misma de las columnas *_norm).
+# Nota: COSTOSA en runtime sobre columnas; preferir las columnas pre-calculadas.
+from .normalization import norm_sql as _norm_sql
 
 
 def count_error_ss_optimized(db: Session, apsa_load_id: int, aconex_load_id: int) -> int:
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Text, Date, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, Text, Date, Boolean, ForeignKey, Index, Computed, true
 from sqlalchemy.orm import relationship
 from .base import Base
+from ..normalization import norm_sql_text
 
 class AconexDoc(Base):
     __tablename__ = "aconex_docs"
@@ -21,9 +22,19 @@ class AconexDoc(Base):
     transmitted     = Column(String(60))
 
     # 🔥 NUEVAS COLUMNAS (GENERATED en la BD, solo lectura)
-    document_no_norm     = Column(String(120))
-    subsystem_code_norm  = Column(String(60))
+    document_no_norm     = Column(String(120), Computed(norm_sql_text("document_no"), persisted=True))
+    subsystem_code_norm  = Column(String(60), Computed(norm_sql_text("subsystem_code"), persisted=True))
+
+    # Última revisión por document_no_norm dentro de la carga (calculado en la ingesta)
+    is_latest = Column(Boolean, nullable=False, default=True, server_default=true())
 
     load = relationship("Load", backref="aconex_rows")
 
-Index("ix_aconex_core", AconexDoc.subsystem_code, AconexDoc.function, AconexDoc.discipline)
\ No newline at end of file
+Index("ix_aconex_core", AconexDoc.subsystem_code, AconexDoc.function, AconexDoc.discipline)
+
+# Índice parcial: solo la última revisión de cada documento (matching / conteos)
+Index(
+    "idx_aconex_latest_doc_norm",
+    AconexDoc.load_id, AconexDoc.document_no_norm, AconexDoc.subsystem_code_norm,
+    postgresql_where=AconexDoc.is_latest,
+)
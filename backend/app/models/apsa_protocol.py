@@ -1,6 +1,14 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Index, Computed
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from .base import Base
+from ..normalization import norm_sql_text
+
+# Documento full-text: config 'simple' (sin stemming: códigos y tags deben calzar tal cual)
+SEARCH_TSV_SQL = (
+    "to_tsvector('simple', coalesce(codigo_cmdic, '') || ' ' || "
+    "coalesce(descripcion, '') || ' ' || coalesce(tag, ''))"
+)
 
 class ApsaProtocol(Base):
     __tablename__ = "apsa_protocols"
@@ -16,9 +24,22 @@ class ApsaProtocol(Base):
     status_bim360 = Column(String(30), index=True)     # Col AA
 
     # 🔥 NUEVAS COLUMNAS (GENERATED en la BD, solo lectura)
-    codigo_cmdic_norm = Column(String(120))
-    subsistema_norm   = Column(String(60))
+    codigo_cmdic_norm = Column(String(120), Computed(norm_sql_text("codigo_cmdic"), persisted=True))
+    subsistema_norm   = Column(String(60), Computed(norm_sql_text("subsistema"), persisted=True))
+
+    # Búsqueda full-text (GENERATED): codigo + descripcion + tag
+    search_tsv = Column(TSVECTOR, Computed(SEARCH_TSV_SQL, persisted=True))
 
     load = relationship("Load", backref="apsa_rows")
 
-Index("ix_apsa_core", ApsaProtocol.subsistema, ApsaProtocol.disciplina, ApsaProtocol.status_bim360)
\ No newline at end of file
+Index("ix_apsa_core", ApsaProtocol.subsistema, ApsaProtocol.disciplina, ApsaProtocol.status_bim360)
+# Paginación keyset de /apsa/list: ORDER BY (subsistema, codigo_cmdic, id) dentro de la carga
+Index("idx_apsa_load_keyset", ApsaProtocol.load_id, ApsaProtocol.subsistema, ApsaProtocol.codigo_cmdic, ApsaProtocol.id)
+
+# Búsqueda libre (q): GIN full-text + trigramas (pg_trgm) para ILIKE '%q%'
+Index("idx_apsa_search_tsv", ApsaProtocol.search_tsv, postgresql_using="gin")
+for _col in ("codigo_cmdic", "descripcion", "tag"):
+    Index(
+        f"idx_apsa_trgm_{_col}", getattr(ApsaProtocol, _col),
+        postgresql_using="gin", postgresql_ops={_col: "gin_trgm_ops"},
+    )
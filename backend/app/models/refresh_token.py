@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .base import Base
@@ -13,4 +13,9 @@ class RefreshToken(Base):
     revoked = Column(Boolean, nullable=False, default=False)
     parent_id = Column(Integer, nullable=True)  # para rotación (opcional)
 
-    user = relationship("User", back_populates="refresh_tokens")
\ No newline at end of file
+    user = relationship("User", back_populates="refresh_tokens")
+
+# Índice parcial: la rotación solo busca tokens no revocados
+Index("idx_refresh_tokens_active_hash", RefreshToken.token_hash, postgresql_where=~RefreshToken.revoked)
+Index("idx_refresh_tokens_expires_at", RefreshToken.expires_at)
+Index("idx_refresh_tokens_user_active", RefreshToken.user_id, postgresql_where=~RefreshToken.revoked)
@@ -0,0 +1,50 @@
+"""
+Normalización canónica de códigos (N° de documento / código CMDIC / subsistema).
+
+Una ÚNICA definición compartida por:
+- la BD: expresión de las columnas GENERATED `*_norm` (ver models y scripts),
+- las queries SQLAlchemy que necesiten normalizar un valor externo,
+- Python (ingesta / comparaciones en memoria).
+
+Regla: quitar espacios, guiones y underscores, luego TRIM + UPPER.
+    'ab-12_3 4'  ->  'AB1234'
+"""
+from sqlalchemy import func
+
+# Caracteres que se eliminan antes de comparar
+NORM_STRIP_CHARS = (" ", "-", "_")
+
+
+def norm_sql_text(column: str) -> str:
+    """
+    Expresión SQL (texto) usada en las columnas GENERATED.
+
+    Ej: norm_sql_text("document_no") ->
+        UPPER(TRIM(REPLACE(REPLACE(REPLACE(document_no, ' ', ''), '-', ''), '_', '')))
+    """
+    expr = column
+    for ch in NORM_STRIP_CHARS:
+        expr = f"REPLACE({expr}, '{ch}', '')"
+    return f"UPPER(TRIM({expr}))"
+
+
+def norm_sql(expr):
+    """
+    Misma normalización como expresión SQLAlchemy.
+
+    Nota: NO usar sobre columnas de tablas (no usa índices): para eso están
+    las columnas `*_norm`. Sirve para normalizar parámetros o valores sueltos.
+    """
+    for ch in NORM_STRIP_CHARS:
+        expr = func.replace(expr, ch, "")
+    return func.upper(func.trim(expr))
+
+
+def normalize_code(value) -> str | None:
+    """Equivalente Python de norm_sql_text (None se mantiene como None)."""
+    if value is None:
+        return None
+    s = str(value)
+    for ch in NORM_STRIP_CHARS:
+        s = s.replace(ch, "")
+    return s.strip().upper()
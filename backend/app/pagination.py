@@ -0,0 +1,46 @@
+"""
+Cursores opacos para paginación keyset (seek).
+
+El token es base64url(JSON) con:
+- "l": ids de las cargas con las que se generó (si cambian, el cursor expira)
+- "k": valores de la última fila entregada, en el mismo orden del ORDER BY
+
+El cliente no debe interpretar el token: solo reenviarlo como `cursor`.
+"""
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException
+
+
+def encode_cursor(load_ids: list, key: list) -> str:
+    raw = json.dumps({"l": load_ids, "k": key}, separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _matches(value, expected: type) -> bool:
+    # bool es subclase de int: true/false no sirven como id
+    return isinstance(value, expected) and not (expected is int and isinstance(value, bool))
+
+
+def decode_cursor(token: str, load_ids: list, key_types: tuple[type, ...]) -> list:
+    """
+    Retorna la clave de la última fila, con un elemento por tipo de `key_types`
+    (p.ej. (str, str, int)). Lanza 400 si el token es inválido, si la clave no
+    tiene esos tipos o si fue generado con otras cargas (hubo un upload entremedio).
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        key = data["k"]
+        if not isinstance(key, list) or len(key) != len(key_types):
+            raise ValueError("clave con largo inesperado")
+        if not all(_matches(v, t) for v, t in zip(key, key_types)):
+            raise TypeError("clave con tipos inesperados")
+    except (ValueError, KeyError, TypeError, binascii.Error, UnicodeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    if data.get("l") != load_ids:
+        raise HTTPException(status_code=400, detail="Cursor expirado: hay una carga nueva, vuelve a la primera página")
+    return key
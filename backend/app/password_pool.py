@@ -0,0 +1,224 @@
+"""
+Pool de procesos acotado para Argon2 (hash / verificación de contraseñas).
+
+Cada hash/verify de Argon2 usa ~19 MB y 100-300 ms de CPU. Corriendo en el
+threadpool de FastAPI, un pico de logins al inicio de turno lo agota y frena
+todos los demás endpoints (y el re-hash del login duplica el costo).
+
+- Los hashes corren en un ProcessPoolExecutor de PASSWORD_POOL_WORKERS
+  procesos (no compiten por el GIL con el resto del API).
+- Como mucho PASSWORD_POOL_WORKERS + PASSWORD_POOL_MAX_QUEUE operaciones en
+  vuelo; sobre eso se rechaza al tiro con PoolBusy (→ 503) en vez de encolar
+  requests que igual van a expirar.
+- verify_and_rehash() hace verify + re-hash (si corresponde) en una sola
+  ida al pool.
+- Los hijos se crean con forkserver (spawn donde no existe): un fork del
+  worker de uvicorn copiaría threads y locks tomados a mitad de uso.
+- Un cupo se libera cuando el future termina (add_done_callback), no cuando
+  el request deja de esperar: si el request supera
+  PASSWORD_POOL_TIMEOUT_SECONDS recibe PoolBusy (→ 503), pero el hash
+  sigue ocupando su cupo hasta que el hijo termina.
+- Métricas: espera en cola y tiempo de hash (ms), en stats().
+
+PASSWORD_POOL_WORKERS=0 ejecuta en el mismo proceso (mismo límite de cola).
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from argon2.exceptions import VerifyMismatchError
+
+from .config import get_settings
+from .security import ph
+
+logger = logging.getLogger(__name__)
+
+_SAMPLES = 1000
+
+
+class PoolBusy(Exception):
+    """Demasiadas operaciones de contraseña en vuelo; reintentar más tarde."""
+
+
+# --- funciones que corren en el proceso hijo (deben ser top-level) ---
+def _timed(fn, *args):
+    started = time.time()
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, started, (time.perf_counter() - t0) * 1000
+
+
+def _hash(plain: str) -> str:
+    return ph.hash(plain)
+
+
+def _verify(plain: str, hashed: str) -> bool:
+    try:
+        return ph.verify(hashed, plain)
+    except VerifyMismatchError:
+        return False
+
+
+def _verify_and_rehash(plain: str, hashed: str) -> tuple[bool, str | None]:
+    if not _verify(plain, hashed):
+        return False, None
+    try:
+        needs = ph.check_needs_rehash(hashed)
+    except Exception:
+        needs = True
+    return True, (ph.hash(plain) if needs else None)
+
+
+# --- lado del API ---
+_lock = threading.Lock()
+_executor: ProcessPoolExecutor | None = None
+_slots: threading.BoundedSemaphore | None = None
+_in_flight = 0
+_counts = {"hash": 0, "verify": 0, "verify_and_rehash": 0, "rehashed": 0, "rejected": 0, "timeouts": 0}
+_wait_ms: deque = deque(maxlen=_SAMPLES)
+_hash_ms: deque = deque(maxlen=_SAMPLES)
+
+
+def _get_slots() -> threading.BoundedSemaphore:
+    global _slots
+    if _slots is None:
+        with _lock:
+            if _slots is None:
+                s = get_settings()
+                _slots = threading.BoundedSemaphore(max(1, s.PASSWORD_POOL_WORKERS) + max(0, s.PASSWORD_POOL_MAX_QUEUE))
+    return _slots
+
+
+def _get_executor() -> ProcessPoolExecutor | None:
+    global _executor
+    workers = get_settings().PASSWORD_POOL_WORKERS
+    if workers <= 0:
+        return None
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+                logger.info(f"🔐 Pool de contraseñas: {workers} proceso(s)")
+    return _executor
+
+
+def _reset_executor() -> None:
+    global _executor
+    with _lock:
+        old, _executor = _executor, None
+    if old is not None:
+        old.shutdown(wait=False, cancel_futures=True)
+
+
+def _acquire(slots: threading.BoundedSemaphore) -> None:
+    global _in_flight
+    if not slots.acquire(blocking=False):
+        with _lock:
+            _counts["rejected"] += 1
+        raise PoolBusy()
+    with _lock:
+        _in_flight += 1
+
+
+def _release(slots: threading.BoundedSemaphore) -> None:
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+    slots.release()
+
+
+def _submit(executor: ProcessPoolExecutor, slots, fn, *args):
+    """Encola en el pool con un cupo que se libera al terminar el future (no al dejar de esperarlo)."""
+    _acquire(slots)
+    try:
+        future = executor.submit(_timed, fn, *args)
+    except BaseException:
+        _release(slots)
+        raise
+    future.add_done_callback(lambda _f: _release(slots))
+    return future
+
+
+def _wait(future):
+    try:
+        return future.result(timeout=get_settings().PASSWORD_POOL_TIMEOUT_SECONDS)
+    except FutureTimeout:
+        future.cancel()   # si aún estaba en cola no llega a correr; si corre, conserva su cupo
+        with _lock:
+            _counts["timeouts"] += 1
+        logger.warning("⚠️ Pool de contraseñas: operación sobre el timeout, respondiendo 503")
+        raise PoolBusy() from None
+
+
+def _run(kind: str, fn, *args):
+    slots = _get_slots()
+    submitted = time.time()
+    executor = _get_executor()
+    if executor is None:
+        _acquire(slots)
+        try:
+            result, started, hash_ms = _timed(fn, *args)
+        finally:
+            _release(slots)
+    else:
+        try:
+            result, started, hash_ms = _wait(_submit(executor, slots, fn, *args))
+        except BrokenProcessPool:
+            # un hijo murió (OOM, kill): se recrea el pool y se reintenta una vez
+            logger.warning("⚠️ Pool de contraseñas roto, recreando")
+            _reset_executor()
+            result, started, hash_ms = _wait(_submit(_get_executor(), slots, fn, *args))
+    with _lock:
+        _counts[kind] += 1
+        _wait_ms.append(max(0.0, (started - submitted) * 1000))
+        _hash_ms.append(hash_ms)
+    return result
+
+
+def hash_password(plain: str) -> str:
+    return _run("hash", _hash, plain)
+
+
+def verify_password(plain: str, hashed: str) -> bool:
+    return _run("verify", _verify, plain, hashed)
+
+
+def verify_and_rehash(plain: str, hashed: str) -> tuple[bool, str | None]:
+    """(válida, nuevo hash si los parámetros del actual están desactualizados, si no None)."""
+    ok, new_hash = _run("verify_and_rehash", _verify_and_rehash, plain, hashed)
+    if new_hash:
+        with _lock:
+            _counts["rehashed"] += 1
+    return ok, new_hash
+
+
+def _summary(samples) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "avg": round(sum(ordered) / len(ordered), 2),
+        "p50": round(ordered[len(ordered) // 2], 2),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+def stats() -> dict:
+    s = get_settings()
+    with _lock:
+        return {
+            "workers": s.PASSWORD_POOL_WORKERS,
+            "max_queue": s.PASSWORD_POOL_MAX_QUEUE,
+            "in_flight": _in_flight,
+            **_counts,
+            "queue_wait_ms": _summary(list(_wait_ms)),
+            "hash_ms": _summary(list(_hash_ms)),
+        }
@@ -0,0 +1,238 @@
+"""
+Profiler muestreado bajo demanda para un request (solo Admin).
+
+measure_endpoint da el tiempo total; cuando la lentitud está en Python
+(normalización con pandas en los uploads, loops de formateo en apsa_list,
+escritura de CSV) hace falta ver *dónde*. Con `?__profile=1` (o el header
+`X-Profile: 1`) y un JWT Admin, ProfilerMiddleware:
+
+1. marca el request con un ContextVar y arranca un thread que cada
+   PROFILE_INTERVAL_MS lee sys._current_frames() (Python puro, sin
+   dependencias nativas ni settrace: el costo es solo del request perfilado);
+2. muestrea el thread del event loop (endpoints async) y los workers del
+   threadpool de anyio que estén ejecutando *este* request (se reconoce por
+   el contexto que anyio copia al worker: WorkerThread.run lo tiene como
+   variable local `context`);
+3. descarta la respuesta del endpoint y devuelve el perfil:
+   `__profile_format=speedscope` (default, JSON para https://www.speedscope.app)
+   o `collapsed` (texto "frame;frame;frame N" para flamegraph.pl).
+
+Seguro para dejar activo (PROFILE_ENABLED): sin JWT Admin el parámetro se
+ignora, hay un solo perfil a la vez (los demás corren normal, con
+`X-Profile: busy`) y el muestreo se corta a los PROFILE_MAX_SECONDS.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from urllib.parse import parse_qs
+
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from .auth import verify_token
+from .config import get_settings
+
+_active: ContextVar["Profile | None"] = ContextVar("profiler", default=None)
+_busy = threading.Lock()
+_ANYIO_WORKER = os.path.join("anyio", "_backends", "_asyncio.py")
+_MAX_DEPTH = 200
+
+
+def _frame_key(code) -> tuple[str, str, int]:
+    return (code.co_qualname, code.co_filename, code.co_firstlineno)
+
+
+def _is_worker_run(frame) -> bool:
+    code = frame.f_code
+    return code.co_name == "run" and code.co_filename.endswith(_ANYIO_WORKER)
+
+
+class Profile:
+    """Stacks muestreados de un request: (thread, frames de raíz a hoja) → muestras."""
+
+    def __init__(self, interval: float, max_seconds: float, loop_thread: int):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.loop_thread = loop_thread
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        deadline = self.started + self.max_seconds
+        while not self._stop.wait(self.interval) and time.perf_counter() < deadline:
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                if tid == self.loop_thread:
+                    self._record("event loop", frame, None)
+                else:
+                    self._record_worker(frame)
+            self.sample_count += 1
+
+    def _record_worker(self, leaf) -> None:
+        # sube hasta WorkerThread.run y mira si el contexto que ejecuta es el de este request
+        frame, depth = leaf, 0
+        while frame is not None and depth < _MAX_DEPTH:
+            if _is_worker_run(frame):
+                ctx = frame.f_locals.get("context")
+                if ctx is not None and ctx.get(_active) is self:
+                    self._record("threadpool", leaf, frame)
+                return
+            frame, depth = frame.f_back, depth + 1
+
+    def _record(self, thread: str, leaf, base) -> None:
+        stack = []
+        frame = leaf
+        while frame is not None and frame is not base and len(stack) < _MAX_DEPTH:
+            stack.append(_frame_key(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        self.samples[(thread, tuple(stack))] += 1
+
+    # --- formatos de salida ---
+    @staticmethod
+    def _label(key: tuple[str, str, int]) -> str:
+        name, filename, line = key
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    def collapsed(self) -> str:
+        lines = [
+            ";".join([thread, *(self._label(k) for k in stack)]) + f" {n}"
+            for (thread, stack), n in self.samples.most_common()
+        ]
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, name: str) -> dict:
+        frames: list[dict] = []
+        index: dict[tuple, int] = {}
+
+        def frame_id(key) -> int:
+            if key not in index:
+                index[key] = len(frames)
+                frames.append({"name": key[0], "file": key[1], "line": key[2]})
+            return index[key]
+
+        interval_ms = self.interval * 1000
+        profiles = []
+        for thread in ("event loop", "threadpool"):
+            rows = [(stack, n) for (t, stack), n in self.samples.items() if t == thread]
+            if not rows:
+                continue
+            total = sum(n for _, n in rows) * interval_ms
+            profiles.append({
+                "type": "sampled",
+                "name": f"{name} [{thread}]",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": [[frame_id(k) for k in stack] for stack, _ in rows],
+                "weights": [n * interval_ms for _, n in rows],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "quality-backend profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+def _is_admin(scope) -> bool:
+    headers = dict(scope.get("headers") or [])
+    scheme, _, credentials = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not credentials:
+        return False
+    try:
+        decoded = verify_token(HTTPAuthorizationCredentials(scheme=scheme, credentials=credentials))
+    except HTTPException:
+        return False
+    return "Admin" in (decoded.get("roles") or [])
+
+
+def _requested(scope) -> tuple[bool, str]:
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    headers = dict(scope.get("headers") or [])
+    wanted = query.get("__profile", [""])[0] in ("1", "true") or headers.get(b"x-profile", b"") in (b"1", b"true")
+    fmt = query.get("__profile_format", ["speedscope"])[0]
+    return wanted, ("collapsed" if fmt == "collapsed" else "speedscope")
+
+
+class ProfilerMiddleware:
+    """Atiende `?__profile=1` (Admin): ejecuta el request bajo el sampler y responde el perfil."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        wanted, fmt = _requested(scope)
+        if not wanted or not _is_admin(scope):
+            await self.app(scope, receive, send)
+            return
+        if not _busy.acquire(blocking=False):
+            await self.app(scope, receive, _with_header(send, b"busy"))
+            return
+
+        s = get_settings()
+        profile = Profile(s.PROFILE_INTERVAL_MS / 1000, s.PROFILE_MAX_SECONDS, threading.get_ident())
+        status = {"code": 500}
+
+        async def _swallow(message):
+            # la respuesta real se descarta; solo interesa el status
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+
+        token = _active.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, _swallow)
+        finally:
+            profile.stop()
+            _active.reset(token)
+            _busy.release()
+
+        name = f"{scope['method']} {scope['path']} → {status['code']} ({profile.elapsed * 1000:.0f} ms, {profile.sample_count} muestras)"
+        if fmt == "collapsed":
+            body, media_type = profile.collapsed().encode("utf-8"), b"text/plain; charset=utf-8"
+        else:
+            body, media_type = json.dumps(profile.speedscope(name)).encode("utf-8"), b"application/json"
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", media_type),
+                (b"content-length", str(len(body)).encode()),
+                (b"x-profile", b"1"),
+                (b"x-profile-status", str(status["code"]).encode()),
+                (b"x-profile-ms", f"{profile.elapsed * 1000:.1f}".encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _with_header(send, value: bytes):
+    async def _send(message):
+        if message["type"] == "http.response.start":
+            message = {**message, "headers": [*message.get("headers", []), (b"x-profile", value)]}
+        await send(message)
+    return _send
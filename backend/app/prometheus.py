@@ -0,0 +1,263 @@
+"""
+Métricas en formato de exposición de texto de Prometheus (sin prometheus_client).
+
+/admin/performance/* devuelve JSON ad-hoc que el monitoreo no puede
+scrapear. render() arma el texto (version 0.0.4) con:
+
+- quality_http_request_duration_seconds   histograma por método/ruta/status
+  (RequestMetricsMiddleware, todas las rutas; la ruta es la plantilla)
+- quality_http_requests_in_flight         gauge
+- quality_sql_statement_duration_seconds  histograma por fingerprint (sql_trace)
+- quality_ingest_rows_total / _seconds_total / _last_rows_per_second por fuente
+- quality_cache_{hits,misses}_total, quality_cache_hit_ratio por cache
+- quality_db_pool_*                       checked out, overflow, tamaño y
+  espera por conexión (TimedQueuePool)
+
+Los histogramas se derivan de los LatencyHistogram de timing.py (buckets log
+de ~3%), así que los `le` son aproximados dentro de esa precisión.
+Con varios workers, los histogramas HTTP y SQL, las ingestas, los caches y
+los extra_counters de cada worker van a su segmento compartido
+(shared_metrics.py) y render(others=...) los suma: cualquier worker que
+atienda el scrape expone los totales de todos. Los gauges (in-flight, pool de
+conexiones, extra_gauges) son instantáneos y quedan los del worker que
+atiende. Tras /admin/performance/reset los contadores pueden bajar (los
+segmentos de la generación anterior dejan de sumarse): Prometheus lo trata
+como un reinicio del contador.
+"""
+import threading
+import time
+
+from .timing import LatencyHistogram
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SQL_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_lock = threading.Lock()
+_requests: dict[tuple[str, str, str], LatencyHistogram] = {}
+_in_flight = 0
+_ingest: dict[str, dict] = {}
+
+
+# --- registro ---
+def record_request(method: str, route: str, status: int, seconds: float) -> None:
+    key = (method, route, str(status))
+    with _lock:
+        h = _requests.get(key)
+        if h is None:
+            h = _requests[key] = LatencyHistogram()
+        h.record(seconds)
+
+
+def record_ingest(source: str, rows: int, seconds: float) -> None:
+    with _lock:
+        e = _ingest.setdefault(source, {"rows": 0, "seconds": 0.0, "loads": 0, "last_rps": 0.0, "last_ts": 0.0})
+        e["rows"] += rows
+        e["seconds"] += seconds
+        e["loads"] += 1
+        e["last_rps"] = rows / seconds if seconds > 0 else 0.0
+        e["last_ts"] = time.time()
+
+
+def export_series() -> tuple[dict, dict]:
+    """Copia de lo de este proceso: ({(método, ruta, status): hist}, {fuente: ingesta})."""
+    with _lock:
+        return (
+            {k: _copy(h) for k, h in _requests.items()},
+            {k: dict(v) for k, v in _ingest.items()},
+        )
+
+
+def _copy(h: LatencyHistogram) -> LatencyHistogram:
+    out = LatencyHistogram()
+    out.merge(h)
+    return out
+
+
+def _merge_ingest(into: dict, other: dict) -> None:
+    for source, e in other.items():
+        t = into.setdefault(source, {"rows": 0, "seconds": 0.0, "loads": 0, "last_rps": 0.0, "last_ts": 0.0})
+        t["rows"] += e["rows"]
+        t["seconds"] += e["seconds"]
+        t["loads"] += e["loads"]
+        if e["last_ts"] > t["last_ts"]:
+            t["last_rps"], t["last_ts"] = e["last_rps"], e["last_ts"]
+
+
+def absorb(requests: dict, ingest: dict) -> None:
+    """Suma lo que dejó un worker anterior en el segmento (ver timing.absorb)."""
+    with _lock:
+        for k, h in requests.items():
+            _requests.setdefault(k, LatencyHistogram()).merge(h)
+        _merge_ingest(_ingest, ingest)
+
+
+class RequestMetricsMiddleware:
+    """Latencia (hasta el último byte del body) e in-flight de cada request HTTP."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _in_flight
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        with _lock:
+            _in_flight += 1
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            with _lock:
+                _in_flight -= 1
+            route = scope.get("route")
+            # sin ruta (404 de paths arbitrarios): una sola serie para no explotar la cardinalidad
+            label = getattr(route, "path", None) or "<sin ruta>"
+            record_request(scope["method"], label, status["code"], time.perf_counter() - t0)
+
+
+# --- exposición ---
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**kw) -> str:
+    if not kw:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in kw.items()) + "}"
+
+
+def _fmt(v: float) -> str:
+    if isinstance(v, int):
+        return str(v)
+    return repr(float(v))
+
+
+class _Writer:
+    def __init__(self):
+        self.lines: list[str] = []
+
+    def header(self, name: str, kind: str, help_text: str) -> None:
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value, **labels) -> None:
+        self.lines.append(f"{name}{_labels(**labels)} {_fmt(value)}")
+
+    def histogram(self, name: str, hist: LatencyHistogram, bounds, **labels) -> None:
+        for le, n in zip(bounds, hist.cumulative(bounds)):
+            self.sample(f"{name}_bucket", n, **labels, le=_fmt(le))
+        self.sample(f"{name}_bucket", hist.count, **labels, le="+Inf")
+        self.sample(f"{name}_sum", hist.total_us / 1_000_000, **labels)
+        self.sample(f"{name}_count", hist.count, **labels)
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def _merge_counters(into: dict, caches: dict, counters) -> None:
+    for name, c in caches.items():
+        t = into["caches"].setdefault(name, {"hits": 0, "misses": 0})
+        t["hits"] += c.get("hits", 0)
+        t["misses"] += c.get("misses", 0)
+    for name, help_text, value, labels in counters:
+        key = (name, tuple(sorted(labels.items())))
+        prev = into["counters"].get(key)
+        into["counters"][key] = (help_text, value + (prev[1] if prev else 0), labels)
+
+
+def render(*, statements=(), caches: dict | None = None, pool=None, extra_gauges=(), extra_counters=(), others=()) -> str:
+    """
+    Args:
+        statements: [(fingerprint, sql, LatencyHistogram)] de sql_trace.statement_histograms()
+        caches: {nombre: {"hits": int, "misses": int}}
+        pool: el pool del engine (TimedQueuePool para la espera por conexión)
+        extra_gauges: [(nombre, help, valor, {labels})]
+        extra_counters: igual que extra_gauges, para valores monótonos (nombre terminado en _total)
+        others: [(requests, ingest, {"caches": ..., "counters": [...]})] de otros workers
+            (shared_metrics.other_series); se suman a los de este proceso
+    """
+    w = _Writer()
+
+    requests, ingest = export_series()
+    totals = {"caches": {}, "counters": {}}
+    _merge_counters(totals, caches or {}, extra_counters)
+    for other_requests, other_ingest, other_process in others:
+        for k, h in other_requests.items():
+            requests.setdefault(k, LatencyHistogram()).merge(h)
+        _merge_ingest(ingest, other_ingest)
+        _merge_counters(totals, other_process.get("caches", {}), other_process.get("counters", ()))
+    with _lock:
+        in_flight = _in_flight
+
+    w.header("quality_http_request_duration_seconds", "histogram", "Latencia de requests HTTP por ruta")
+    for (method, route, status), h in sorted(requests.items()):
+        w.histogram("quality_http_request_duration_seconds", h, HTTP_BUCKETS, method=method, route=route, status=status)
+    w.header("quality_http_requests_in_flight", "gauge", "Requests HTTP en curso")
+    w.sample("quality_http_requests_in_flight", in_flight)
+
+    w.header("quality_sql_statement_duration_seconds", "histogram", "Duración de sentencias SQL por fingerprint")
+    for fp, sql, h in statements:
+        w.histogram("quality_sql_statement_duration_seconds", h, SQL_BUCKETS, fingerprint=fp, statement=sql[:120])
+
+    w.header("quality_ingest_rows_total", "counter", "Filas ingeridas por fuente")
+    for source, e in sorted(ingest.items()):
+        w.sample("quality_ingest_rows_total", e["rows"], source=source)
+    w.header("quality_ingest_seconds_total", "counter", "Segundos gastados en ingestas por fuente")
+    for source, e in sorted(ingest.items()):
+        w.sample("quality_ingest_seconds_total", e["seconds"], source=source)
+    w.header("quality_ingest_loads_total", "counter", "Cargas publicadas por fuente")
+    for source, e in sorted(ingest.items()):
+        w.sample("quality_ingest_loads_total", e["loads"], source=source)
+    w.header("quality_ingest_last_rows_per_second", "gauge", "Filas/s de la última ingesta por fuente")
+    for source, e in sorted(ingest.items()):
+        w.sample("quality_ingest_last_rows_per_second", e["last_rps"], source=source)
+
+    caches = totals["caches"]
+    w.header("quality_cache_hits_total", "counter", "Aciertos por cache")
+    for name, c in sorted(caches.items()):
+        w.sample("quality_cache_hits_total", c.get("hits", 0), cache=name)
+    w.header("quality_cache_misses_total", "counter", "Fallos por cache")
+    for name, c in sorted(caches.items()):
+        w.sample("quality_cache_misses_total", c.get("misses", 0), cache=name)
+    w.header("quality_cache_hit_ratio", "gauge", "Aciertos / (aciertos + fallos) por cache")
+    for name, c in sorted(caches.items()):
+        total = c.get("hits", 0) + c.get("misses", 0)
+        w.sample("quality_cache_hit_ratio", (c.get("hits", 0) / total) if total else 0.0, cache=name)
+
+    if pool is not None:
+        w.header("quality_db_pool_size", "gauge", "Conexiones base del pool")
+        w.sample("quality_db_pool_size", pool.size())
+        w.header("quality_db_pool_checked_out", "gauge", "Conexiones prestadas en este momento")
+        w.sample("quality_db_pool_checked_out", pool.checkedout())
+        w.header("quality_db_pool_overflow", "gauge", "Conexiones sobre pool_size (negativo = aún no creadas)")
+        w.sample("quality_db_pool_overflow", pool.overflow())
+        wait_hist = getattr(pool, "wait_hist", None)
+        if wait_hist is not None:
+            with pool.wait_lock:
+                w.header("quality_db_pool_wait_seconds", "histogram", "Espera por una conexión libre del pool")
+                w.histogram("quality_db_pool_wait_seconds", wait_hist, POOL_WAIT_BUCKETS)
+                w.header("quality_db_pool_timeouts_total", "counter", "Checkouts que expiraron esperando conexión")
+                w.sample("quality_db_pool_timeouts_total", pool.wait_timeouts)
+
+    for name, help_text, value, labels in extra_gauges:
+        w.header(name, "gauge", help_text)
+        w.sample(name, value, **labels)
+    seen = set()
+    for (name, _), (help_text, value, labels) in sorted(totals["counters"].items()):
+        if name not in seen:
+            w.header(name, "counter", help_text)
+            seen.add(name)
+        w.sample(name, value, **labels)
+
+    return w.text()
@@ -0,0 +1,151 @@
+"""
+Mantención de la tabla refresh_tokens y rotación en un solo round-trip.
+
+Cada login y cada refresh insertan una fila y nada borraba las viejas, así
+que la tabla (y sus índices) solo crecía. Aquí:
+
+- rotate(): revoca el token actual e inserta el nuevo en UNA sentencia
+  (UPDATE ... RETURNING + INSERT encadenados con CTEs) que además trae los
+  datos del usuario. El `WHERE NOT revoked` del UPDATE hace la rotación
+  atómica: dos refresh simultáneos con el mismo token → solo uno gana.
+- purge(): borra en batches los tokens expirados y los revocados con más de
+  REFRESH_TOKEN_REVOKED_RETENTION_HOURS (commit por batch, sin locks largos).
+- maybe_schedule_purge(): la purga corre en background como mucho una vez
+  cada REFRESH_TOKEN_PURGE_INTERVAL_MINUTES, disparada desde login/refresh.
+
+Índices: migrations/add_refresh_token_maintenance.sql (parcial
+`(token_hash) WHERE NOT revoked` para la rotación).
+"""
+import logging
+import threading
+from datetime import datetime
+from time import monotonic, perf_counter, sleep
+
+from sqlalchemy import text
+
+from .config import get_settings
+from .db import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ROTATE_SQL = text("""
+WITH old AS (
+    UPDATE refresh_tokens
+       SET revoked = true
+     WHERE token_hash = :old_hash
+       AND NOT revoked
+       AND expires_at > now()
+ RETURNING id, user_id
+), usr AS (
+    SELECT u.id, u.email, u.full_name, u.roles
+      FROM users u
+      JOIN old ON old.user_id = u.id
+     WHERE u.is_active
+), ins AS (
+    INSERT INTO refresh_tokens (user_id, token_hash, expires_at, revoked, parent_id)
+    SELECT usr.id, :new_hash, :expires_at, false, old.id
+      FROM usr JOIN old ON old.user_id = usr.id
+ RETURNING id
+)
+SELECT old.id AS old_id, usr.id AS user_id, usr.email, usr.full_name, usr.roles
+  FROM old LEFT JOIN usr ON usr.id = old.user_id
+""")
+
+PURGE_BATCH_SQL = text("""
+DELETE FROM refresh_tokens
+ WHERE id IN (
+    SELECT id FROM refresh_tokens
+     WHERE expires_at < now()
+        OR (revoked AND created_at < now() - make_interval(hours => :retention_hours))
+     LIMIT :batch
+ )
+""")
+
+
+class RotationError(Exception):
+    """Token inválido/expirado/ya usado (reason="invalid") o usuario inactivo (reason="inactive")."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def rotate(db, old_hash: str, new_hash: str, expires_at: datetime):
+    """
+    Revoca `old_hash` e inserta `new_hash` (parent_id = el viejo) en un solo
+    round-trip. Retorna la fila del usuario (user_id, email, full_name, roles).
+    Hace commit; si el token no sirve hace rollback y lanza RotationError.
+    """
+    row = db.execute(ROTATE_SQL, {"old_hash": old_hash, "new_hash": new_hash, "expires_at": expires_at}).first()
+    if row is None or row.user_id is None:
+        # usuario inactivo: no se consume el token (igual que antes)
+        db.rollback()
+        raise RotationError("invalid" if row is None else "inactive")
+    db.commit()
+    return row
+
+
+def purge(db, *, batch: int | None = None, max_batches: int | None = None, pause_seconds: float = 0.05) -> dict:
+    """Borra tokens expirados y revocados viejos en batches. Retorna {deleted, batches, ms}."""
+    s = get_settings()
+    batch = batch or s.REFRESH_TOKEN_PURGE_BATCH
+    t0 = perf_counter()
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        n = db.execute(PURGE_BATCH_SQL, {"batch": batch, "retention_hours": s.REFRESH_TOKEN_REVOKED_RETENTION_HOURS}).rowcount
+        db.commit()
+        deleted += n
+        batches += 1
+        if n < batch:
+            break
+        sleep(pause_seconds)  # deja respirar al autovacuum / a otros writers
+    out = {"deleted": deleted, "batches": batches, "ms": round((perf_counter() - t0) * 1000, 1)}
+    if deleted:
+        logger.info(f"🧹 refresh_tokens: {deleted:,} filas purgadas en {batches} batch(es), {out['ms']:.0f} ms")
+    return out
+
+
+_lock = threading.Lock()
+_running = False
+_last_started: float | None = None
+_last_result: dict | None = None
+
+
+def _purge_worker() -> None:
+    global _running, _last_result
+    db = SessionLocal()
+    try:
+        result = purge(db)
+        with _lock:
+            _last_result = result
+    except Exception:
+        db.rollback()
+        logger.exception("❌ Error purgando refresh_tokens")
+    finally:
+        db.close()
+        with _lock:
+            _running = False
+
+
+def maybe_schedule_purge(force: bool = False) -> bool:
+    """Lanza la purga en background si pasó el intervalo (o force). False si no correspondía."""
+    global _running, _last_started
+    interval = get_settings().REFRESH_TOKEN_PURGE_INTERVAL_MINUTES * 60
+    with _lock:
+        if _running:
+            return False
+        if not force and (interval <= 0 or (_last_started is not None and monotonic() - _last_started < interval)):
+            return False
+        _running = True
+        _last_started = monotonic()
+    threading.Thread(target=_purge_worker, name="refresh-token-purge", daemon=True).start()
+    return True
+
+
+def status() -> dict:
+    with _lock:
+        return {
+            "running": _running,
+            "seconds_since_last": round(monotonic() - _last_started, 1) if _last_started else None,
+            "last_result": _last_result,
+        }
@@ -0,0 +1,109 @@
+"""
+Búsqueda libre sobre protocolos APSA (codigo_cmdic / descripcion / tag).
+
+Tres modos, todos respaldados por índices GIN (ver migrations/add_apsa_search_indexes.sql):
+- contains: ILIKE '%q%' (lo que usan /apsa/list y /export/apsa.csv) → índices trigram (pg_trgm)
+- ranked:   full-text sobre search_tsv, ordenado por relevancia (ts_rank_cd)
+- prefix:   autocompletado; cada palabra se trata como prefijo ('tub:*')
+
+Config 'simple': sin stemming ni stopwords, porque la mayoría de las búsquedas
+son códigos y tags que deben calzar literalmente.
+"""
+import re
+
+from sqlalchemy import select, func, or_, literal_column
+from sqlalchemy.orm import Session
+
+from .models.apsa_protocol import ApsaProtocol
+
+SEARCH_CONFIG = "simple"
+# Palabras para tsquery: letras/dígitos (incluye acentos); el resto separa
+_TOKEN_RE = re.compile(r"[0-9A-Za-zÀ-ÖØ-öø-ÿ]+")
+
+
+def _escape_like(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def contains_filter(q: str):
+    """ILIKE '%q%' sobre las 3 columnas (mismo comportamiento histórico del filtro q)."""
+    like = f"%{q.strip()}%"
+    return or_(
+        ApsaProtocol.codigo_cmdic.ilike(like),
+        ApsaProtocol.descripcion.ilike(like),
+        ApsaProtocol.tag.ilike(like),
+    )
+
+
+def _tokens(q: str) -> list[str]:
+    return [t.lower() for t in _TOKEN_RE.findall(q or "")]
+
+
+def build_tsquery(q: str, *, prefix: bool = False):
+    """
+    tsquery AND de las palabras de q. Con prefix=True cada palabra es prefijo.
+    Retorna None si q no tiene palabras buscables.
+    """
+    toks = _tokens(q)
+    if not toks:
+        return None
+    suffix = ":*" if prefix else ""
+    # tokens ya saneados por _TOKEN_RE: no pueden traer operadores de tsquery
+    expr = " & ".join(f"{t}{suffix}" for t in toks)
+    return func.to_tsquery(literal_column(f"'{SEARCH_CONFIG}'"), expr)
+
+
+def search_ranked(db: Session, load_id: int, q: str, *, limit: int = 50, prefix: bool = False) -> list:
+    """Protocolos que calzan con q, ordenados por relevancia."""
+    tsq = build_tsquery(q, prefix=prefix)
+    if tsq is None:
+        return []
+    rank = func.ts_rank_cd(ApsaProtocol.search_tsv, tsq).label("rank")
+    return db.execute(
+        select(
+            ApsaProtocol.id,
+            ApsaProtocol.codigo_cmdic,
+            ApsaProtocol.descripcion,
+            ApsaProtocol.tag,
+            ApsaProtocol.subsistema,
+            ApsaProtocol.tipo,
+            ApsaProtocol.status_bim360,
+            rank,
+        )
+        .where(ApsaProtocol.load_id == load_id, ApsaProtocol.search_tsv.op("@@")(tsq))
+        .order_by(rank.desc(), ApsaProtocol.codigo_cmdic.asc())
+        .limit(limit)
+    ).all()
+
+
+def suggest(db: Session, load_id: int, q: str, *, limit: int = 10) -> list[str]:
+    """
+    Autocompletado: primero códigos que EMPIEZAN con q (trigram, ILIKE 'q%'),
+    luego códigos cuyo texto tiene palabras con esos prefijos (full-text).
+    """
+    q = (q or "").strip()
+    if not q:
+        return []
+
+    out: list[str] = []
+    codes = db.execute(
+        select(ApsaProtocol.codigo_cmdic)
+        .where(
+            ApsaProtocol.load_id == load_id,
+            ApsaProtocol.codigo_cmdic.ilike(_escape_like(q) + "%", escape="\\"),
+        )
+        .group_by(ApsaProtocol.codigo_cmdic)
+        .order_by(ApsaProtocol.codigo_cmdic.asc())
+        .limit(limit)
+    ).scalars().all()
+    out.extend(c for c in codes if c)
+
+    if len(out) < limit:
+        seen = set(out)
+        for r in search_ranked(db, load_id, q, limit=limit * 2, prefix=True):
+            if r.codigo_cmdic and r.codigo_cmdic not in seen:
+                seen.add(r.codigo_cmdic)
+                out.append(r.codigo_cmdic)
+                if len(out) >= limit:
+                    break
+    return out
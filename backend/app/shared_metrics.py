@@ -0,0 +1,393 @@
+"""
+Métricas de performance compartidas entre workers (segmentos mmap en disco).
+
+Con varios workers de uvicorn cada proceso tiene sus propios histogramas y
+/admin/performance/* mostraba los del worker que atendía. Se comparten:
+
+- timing.py: endpoints y measure_query (/stats, /summary)
+- sql_trace.py: histogramas por fingerprint y N+1 (/sql, /prometheus)
+- slow_requests.py: requests lentos (/slow)
+- prometheus.py: latencia HTTP por ruta e ingestas, más los contadores de
+  proceso registrados con register_counters() (caches, pool de contraseñas)
+
+- Cada worker toma un slot libre `worker-<n>.seg` en METRICS_SHARED_DIR
+  (flock exclusivo mientras vive; METRICS_SHARED_SLOTS como máximo) y cada
+  METRICS_SHARED_FLUSH_SECONDS vuelca en él sus series serializadas
+  (LatencyHistogram.dump: buckets dispersos + ventanas por minuto; JSON para
+  N+1, ingestas, requests lentos y contadores). El hot path sigue siendo en
+  memoria.
+- Los endpoints admin leen los segmentos de los demás (other_series) y los
+  fusionan con lo vivo del proceso actual.
+- Cada segmento es un seqlock: el escritor deja `seq` impar mientras escribe;
+  el lector reintenta si lo ve impar o cambiado, sin locks entre procesos.
+- Sobreviven reinicios: el segmento de un worker muerto se sigue sumando y
+  el worker que toma su slot carga esos datos y continúa desde ahí.
+- Reset: /admin/performance/reset sube la generación en `control.seg`; los
+  segmentos de generaciones anteriores se ignoran y cada worker limpia los
+  suyos en su siguiente volcado.
+
+Requiere fcntl (Linux/macOS); sin él, o con METRICS_SHARED_ENABLED=False,
+las estadísticas quedan por proceso como antes.
+"""
+import atexit
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock → estadísticas por proceso
+    fcntl = None
+
+from . import prometheus, slow_requests, sql_trace, timing
+from .config import get_settings
+from .timing import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"QMETRIC2"
+_HEADER = struct.Struct("<8sQQQdQ")     # magic, seq, generation, pid, updated_at, payload_len
+_KEY = struct.Struct("<BHH")            # kind, len(nombre), len(descripción)
+_GEN = struct.Struct("<Q")
+_ROWS = struct.Struct("<q")
+_JSON_LEN = struct.Struct("<I")
+
+# kinds de _KEY: nombre / descripción / cuerpo
+_ENDPOINT = 0     # endpoint / "" / histograma
+_QUERY = 1        # endpoint / query / histograma
+_REQUEST = 2      # "método status" / ruta / histograma
+_STATEMENT = 3    # fingerprint / sql / histograma + filas
+_JSON = 4         # sección ("n_plus_one", "ingest", "process", "slow") / "" / json
+
+SERIES = ("endpoints", "queries", "requests", "ingest", "process", "statements", "n_plus_one", "slow")
+_READ_RETRIES = 5
+
+_lock = threading.Lock()
+_state: dict = {"fd": None, "mm": None, "slot": None, "pid": None, "generation": 0, "thread": None, "truncated": False}
+
+
+def _dir() -> str:
+    d = get_settings().METRICS_SHARED_DIR or os.path.join(tempfile.gettempdir(), "quality_metrics")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def _segment_size() -> int:
+    return max(64 * 1024, get_settings().METRICS_SHARED_SEGMENT_KB * 1024)
+
+
+def enabled() -> bool:
+    return fcntl is not None and get_settings().METRICS_SHARED_ENABLED
+
+
+# --- generación (reset global) ---
+def _control_path() -> str:
+    return os.path.join(_dir(), "control.seg")
+
+
+def _read_generation() -> int:
+    try:
+        with open(_control_path(), "rb") as f:
+            data = f.read(_GEN.size)
+        return _GEN.unpack(data)[0] if len(data) == _GEN.size else 0
+    except FileNotFoundError:
+        return 0
+
+
+def _bump_generation() -> int:
+    fd = os.open(_control_path(), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        data = os.pread(fd, _GEN.size, 0)
+        gen = (_GEN.unpack(data)[0] if len(data) == _GEN.size else 0) + 1
+        os.pwrite(fd, _GEN.pack(gen), 0)
+        return gen
+    finally:
+        os.close(fd)
+
+
+# --- serialización ---
+_counter_sources: list = []
+
+
+def register_counters(fn) -> None:
+    """
+    fn() → {"caches": {nombre: {"hits", "misses"}}, "counters": [(nombre, help, valor, {labels})]}
+    de este proceso; se vuelca con el resto y prometheus.render() lo suma.
+    """
+    _counter_sources.append(fn)
+
+
+def process_counters() -> dict:
+    out = {"caches": {}, "counters": []}
+    for fn in _counter_sources:
+        part = fn()
+        out["caches"].update(part.get("caches", {}))
+        out["counters"].extend(part.get("counters", []))
+    return out
+
+
+def _local_series() -> dict:
+    endpoints, queries = timing.export_series()
+    statements, n_plus_one = sql_trace.export_series()
+    requests, ingest = prometheus.export_series()
+    return {
+        "endpoints": endpoints, "queries": queries, "requests": requests, "ingest": ingest,
+        "process": process_counters(), "statements": statements, "n_plus_one": n_plus_one,
+        "slow": slow_requests.export_entries(),
+    }
+
+
+def _chunk(kind: int, name: str, desc: str, body: bytes) -> bytes:
+    name_b, desc_b = name.encode("utf-8")[:65535], desc.encode("utf-8")[:65535]
+    return _KEY.pack(kind, len(name_b), len(desc_b)) + name_b + desc_b + body
+
+
+def _json_body(value) -> bytes:
+    data = json.dumps(value, default=str).encode("utf-8")
+    return _JSON_LEN.pack(len(data)) + data
+
+
+def _encode(series: dict, limit: int) -> tuple[bytes, bool]:
+    # en orden de prioridad: si el segmento se llena se pierden las últimas (requests lentos primero)
+    chunks = [_chunk(_ENDPOINT, name, "", h.dump()) for name, h in series["endpoints"].items()]
+    chunks += [_chunk(_QUERY, ep, desc, h.dump()) for ep, per in series["queries"].items() for desc, h in per.items()]
+    chunks += [_chunk(_REQUEST, f"{m} {status}", route, h.dump()) for (m, route, status), h in series["requests"].items()]
+    chunks.append(_chunk(_JSON, "ingest", "", _json_body(series["ingest"])))
+    chunks.append(_chunk(_JSON, "process", "", _json_body(series["process"])))
+    chunks += [_chunk(_STATEMENT, fp, e["sql"], e["hist"].dump() + _ROWS.pack(e["rows"])) for fp, e in series["statements"].items()]
+    n1 = [{"route": r, "fingerprint": fp, **v} for (r, fp), v in series["n_plus_one"].items()]
+    chunks.append(_chunk(_JSON, "n_plus_one", "", _json_body(n1)))
+    chunks.append(_chunk(_JSON, "slow", "", _json_body(series["slow"])))
+
+    parts, size, truncated = [], 0, False
+    for chunk in chunks:
+        if size + len(chunk) > limit:
+            truncated = True
+            break
+        parts.append(chunk)
+        size += len(chunk)
+    return b"".join(parts), truncated
+
+
+def _decode(payload) -> dict:
+    out = {"endpoints": {}, "queries": {}, "requests": {}, "ingest": {}, "process": {},
+           "statements": {}, "n_plus_one": {}, "slow": []}
+    offset = 0
+    while offset < len(payload):
+        kind, name_len, desc_len = _KEY.unpack_from(payload, offset)
+        offset += _KEY.size
+        name = bytes(payload[offset:offset + name_len]).decode("utf-8")
+        offset += name_len
+        desc = bytes(payload[offset:offset + desc_len]).decode("utf-8")
+        offset += desc_len
+        if kind == _JSON:
+            (length,) = _JSON_LEN.unpack_from(payload, offset)
+            offset += _JSON_LEN.size
+            value = json.loads(bytes(payload[offset:offset + length]))
+            offset += length
+            if name == "n_plus_one":
+                value = {(v.pop("route"), v.pop("fingerprint")): v for v in value}
+            out[name] = value
+            continue
+        h, offset = LatencyHistogram.load(payload, offset)
+        if kind == _ENDPOINT:
+            out["endpoints"][name] = h
+        elif kind == _QUERY:
+            out["queries"].setdefault(name, {})[desc] = h
+        elif kind == _REQUEST:
+            method, _, status = name.partition(" ")
+            out["requests"][(method, desc, status)] = h
+        elif kind == _STATEMENT:
+            (rows,) = _ROWS.unpack_from(payload, offset)
+            offset += _ROWS.size
+            out["statements"][name] = {"sql": desc, "hist": h, "rows": rows}
+    return out
+
+
+def _absorb(series: dict) -> None:
+    timing.absorb(series["endpoints"], series["queries"])
+    sql_trace.absorb(series["statements"], series["n_plus_one"])
+    prometheus.absorb(series["requests"], series["ingest"])
+    slow_requests.absorb(series["slow"])
+
+
+def _read_segment(mm) -> tuple[int, int, float, bytes] | None:
+    """(generation, pid, updated_at, payload) consistente según el seqlock, o None."""
+    for _ in range(_READ_RETRIES):
+        magic, seq, gen, pid, updated_at, length = _HEADER.unpack_from(mm, 0)
+        if magic != _MAGIC:
+            return None
+        if seq % 2:
+            time.sleep(0.001)
+            continue
+        payload = mm[_HEADER.size:_HEADER.size + length]
+        if _HEADER.unpack_from(mm, 0)[1] == seq:
+            return gen, pid, updated_at, payload
+    return None
+
+
+def _write_segment(mm, generation: int, payload: bytes) -> None:
+    seq = _HEADER.unpack_from(mm, 0)[1] if mm[:8] == _MAGIC else 0
+    seq += 1 if seq % 2 == 0 else 0                      # impar: escribiendo
+    _HEADER.pack_into(mm, 0, _MAGIC, seq, generation, os.getpid(), time.time(), 0)
+    mm[_HEADER.size:_HEADER.size + len(payload)] = payload
+    _HEADER.pack_into(mm, 0, _MAGIC, seq + 1, generation, os.getpid(), time.time(), len(payload))
+
+
+# --- slot del worker ---
+def _claim_slot():
+    size = _segment_size()
+    for n in range(get_settings().METRICS_SHARED_SLOTS):
+        path = os.path.join(_dir(), f"worker-{n}.seg")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            continue
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+        return n, fd, mmap.mmap(fd, size)
+    return None
+
+
+def start() -> bool:
+    """Toma un slot, carga lo que dejó el worker anterior en él y arranca el volcado periódico."""
+    if not enabled():
+        return False
+    with _lock:
+        if _state["pid"] == os.getpid():
+            return _state["slot"] is not None
+        _state.update(fd=None, mm=None, slot=None, pid=os.getpid(), thread=None)
+        claimed = _claim_slot()
+        if claimed is None:
+            logger.warning("⚠️ Sin slots libres para métricas compartidas (METRICS_SHARED_SLOTS); quedan por proceso")
+            return False
+        slot, fd, mm = claimed
+        _state.update(fd=fd, mm=mm, slot=slot, generation=_read_generation())
+        previous = _read_segment(mm)
+    if previous and previous[0] == _state["generation"]:
+        _absorb(_decode(previous[3]))
+    thread = threading.Thread(target=_flush_loop, name="shared-metrics", daemon=True)
+    _state["thread"] = thread
+    thread.start()
+    atexit.register(flush)  # lo registrado desde el último volcado no se pierde al apagar el worker
+    logger.info("📊 Métricas compartidas: slot %s en %s", slot, _dir())
+    return True
+
+
+def _after_fork() -> None:
+    # el hijo hereda el fd (y el flock) del padre y no el thread: necesita su propio slot
+    had_slot = _state["slot"] is not None
+    _state.update(fd=None, mm=None, slot=None, pid=None, thread=None)
+    if had_slot:
+        start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def flush() -> None:
+    """Vuelca los histogramas de este proceso en su segmento (no hace nada sin slot)."""
+    mm = _state["mm"]
+    if mm is None or _state["pid"] != os.getpid():
+        return
+    gen = _read_generation()
+    if gen != _state["generation"]:
+        # alguien pidió reset global: lo de este worker es de la generación anterior
+        timing.reset_stats()
+        sql_trace.reset()
+        slow_requests.reset()
+        _state["generation"] = gen
+    payload, truncated = _encode(_local_series(), len(mm) - _HEADER.size)
+    if truncated and not _state["truncated"]:
+        logger.warning("⚠️ Segmento de métricas lleno (METRICS_SHARED_SEGMENT_KB); se omiten series")
+    _state["truncated"] = truncated
+    with _lock:
+        _write_segment(mm, gen, payload)
+
+
+def _flush_loop() -> None:
+    interval = max(1, get_settings().METRICS_SHARED_FLUSH_SECONDS)
+    while _state["pid"] == os.getpid():
+        time.sleep(interval)
+        try:
+            flush()
+        except Exception:
+            logger.exception("❌ Error volcando métricas compartidas")
+
+
+def other_series(*names: str) -> list[tuple]:
+    """
+    Por cada segmento de otro slot con la generación vigente, la tupla de las
+    series pedidas (ver SERIES), p.ej. other_series("statements", "n_plus_one").
+    """
+    if not enabled() or _state["pid"] != os.getpid():
+        return []
+    gen = _read_generation()
+    out = []
+    for meta, payload in _scan(gen):
+        if meta["slot"] != _state["slot"]:
+            series = _decode(payload)
+            out.append(tuple(series[n] for n in names))
+    return out
+
+
+def other_workers() -> list[tuple[dict, dict]]:
+    """(endpoints, queries) de los demás workers, para timing.get_all_stats()."""
+    return other_series("endpoints", "queries")
+
+
+def _scan(generation: int):
+    d = _dir()
+    for name in sorted(os.listdir(d)):
+        if not (name.startswith("worker-") and name.endswith(".seg")):
+            continue
+        try:
+            with open(os.path.join(d, name), "rb") as f:
+                if os.fstat(f.fileno()).st_size < _HEADER.size:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    seg = _read_segment(mm)
+        except OSError:
+            continue
+        if seg is None or seg[0] != generation:
+            continue
+        slot = int(name[len("worker-"):-len(".seg")])
+        yield {"slot": slot, "pid": seg[1], "updated_at": seg[2], "bytes": len(seg[3])}, seg[3]
+
+
+def reset_all() -> None:
+    """Reset global: nueva generación (los demás workers se limpian en su próximo volcado)."""
+    if not enabled() or _state["mm"] is None:
+        return
+    _state["generation"] = _bump_generation()
+    flush()
+
+
+def status() -> dict:
+    if not enabled():
+        return {"enabled": False}
+    gen = _read_generation()
+    now = time.time()
+    workers = [
+        {"slot": meta["slot"], "pid": meta["pid"], "bytes": meta["bytes"],
+         "seconds_since_flush": round(now - meta["updated_at"], 1), "current": meta["slot"] == _state["slot"]}
+        for meta, _ in _scan(gen)
+    ]
+    return {
+        "enabled": True,
+        "dir": _dir(),
+        "slot": _state["slot"],
+        "generation": gen,
+        "flush_seconds": get_settings().METRICS_SHARED_FLUSH_SECONDS,
+        "workers": workers,
+        "truncated": _state["truncated"],
+    }
@@ -0,0 +1,156 @@
+"""
+Buffer acotado de los requests lentos recientes (/admin/performance/slow).
+
+Los histogramas dicen *que* una ruta tiene p99 alto pero no *qué* pasó en ese
+request. SqlTraceMiddleware llama begin()/finish() con su RequestTrace; si el
+request tardó SLOW_REQUEST_THRESHOLD_MS o más, se guarda una entrada con:
+
+- ruta (plantilla), método, path, query params y path params
+- usuario y load_ids leídos (sql_trace.annotate / annotate_load)
+- status, duración y todas las sentencias SQL con su tiempo (trace.summary())
+- opcional (SLOW_REQUEST_STACK_SAMPLE): un stack de Python tomado *mientras*
+  el request seguía corriendo, apenas pasó el umbral. Lo toma un thread
+  vigía sobre el último thread que ejecutó SQL para ese request; en
+  endpoints async sin SQL no hay thread propio y no hay muestra.
+
+Es un ring buffer (deque con maxlen SLOW_REQUEST_BUFFER_SIZE): los más
+viejos salen primero; entries() los ordena del más lento al más rápido.
+Cada worker guarda los suyos y los vuelca al segmento compartido
+(shared_metrics.py); entries() recibe en `others` los de los demás workers.
+Cada entrada lleva el pid del worker que la atendió.
+"""
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl
+
+from .config import get_settings
+from .logging_setup import current_request_id
+
+_SENSITIVE = re.compile(r"pass|hash|token|secret", re.I)
+_STACK_MAX_FRAMES = 40
+_WATCH_INTERVAL = 0.2
+
+_lock = threading.Lock()
+_entries: deque | None = None
+_in_flight: dict[int, object] = {}    # id(trace) → RequestTrace
+_stacks: dict[int, list[str]] = {}    # id(trace) → stack muestreado
+_watcher: threading.Thread | None = None
+
+
+def _buffer() -> deque:
+    global _entries
+    if _entries is None:
+        _entries = deque(maxlen=max(1, get_settings().SLOW_REQUEST_BUFFER_SIZE))
+    return _entries
+
+
+# --- muestreo de stack ---
+def _sample(thread_id: int) -> list[str] | None:
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return None
+    return [line.rstrip() for line in traceback.format_stack(frame)[-_STACK_MAX_FRAMES:]]
+
+
+def _watch() -> None:
+    while True:
+        time.sleep(_WATCH_INTERVAL)
+        threshold = get_settings().SLOW_REQUEST_THRESHOLD_MS / 1000
+        now = time.perf_counter()
+        with _lock:
+            pending = [
+                (key, trace) for key, trace in _in_flight.items()
+                if key not in _stacks and trace.thread_id is not None and now - trace.started >= threshold
+            ]
+        for key, trace in pending:
+            stack = _sample(trace.thread_id)
+            if stack is not None:
+                with _lock:
+                    if key in _in_flight:
+                        _stacks[key] = stack
+
+
+def _ensure_watcher() -> None:
+    global _watcher
+    if _watcher is None:
+        _watcher = threading.Thread(target=_watch, name="slow-request-sampler", daemon=True)
+        _watcher.start()
+
+
+# --- hooks del middleware ---
+def begin(trace) -> None:
+    s = get_settings()
+    if s.SLOW_REQUEST_THRESHOLD_MS <= 0 or not s.SLOW_REQUEST_STACK_SAMPLE:
+        return
+    with _lock:
+        _in_flight[id(trace)] = trace
+        _ensure_watcher()
+
+
+def _params(scope) -> dict:
+    query: dict[str, list[str]] = {}
+    for k, v in parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True):
+        query.setdefault(k, []).append("***" if _SENSITIVE.search(k) else v)
+    query = {k: v[0] if len(v) == 1 else v for k, v in query.items()}
+    return {"query": query, "path": {k: str(v) for k, v in (scope.get("path_params") or {}).items()}}
+
+
+def finish(trace, scope, status: int) -> None:
+    duration_ms = (time.perf_counter() - trace.started) * 1000
+    with _lock:
+        stack = _stacks.pop(id(trace), None)
+        _in_flight.pop(id(trace), None)
+    threshold = get_settings().SLOW_REQUEST_THRESHOLD_MS
+    if threshold <= 0 or duration_ms < threshold:
+        return
+    entry = {
+        "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "request_id": current_request_id(),
+        "pid": os.getpid(),
+        "method": trace.method,
+        "route": trace.route,
+        "path": trace.path,
+        "params": _params(scope),
+        "user": trace.tags.get("user"),
+        "load_ids": trace.tags.get("load_ids", {}),
+        "status": status,
+        "duration_ms": round(duration_ms, 1),
+        **trace.summary(),
+        "stack_sample": stack,
+    }
+    with _lock:
+        _buffer().append(entry)
+
+
+# --- lectura ---
+def export_entries() -> list[dict]:
+    """Entradas de este proceso (para el segmento compartido)."""
+    with _lock:
+        return list(_buffer())
+
+
+def absorb(entries_: list[dict]) -> None:
+    """Recupera las entradas que dejó un worker anterior en su segmento."""
+    with _lock:
+        _buffer().extend(entries_)
+
+
+def entries(limit: int = 50, others=()) -> list[dict]:
+    """`others`: [entradas] de otros workers (shared_metrics.other_series)."""
+    with _lock:
+        out = list(_buffer())
+    for other in others:
+        out.extend(other)
+    out.sort(key=lambda e: e["duration_ms"], reverse=True)
+    return out[:limit]
+
+
+def reset() -> None:
+    with _lock:
+        _buffer().clear()
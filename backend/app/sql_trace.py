@@ -0,0 +1,336 @@
+"""
+Traza SQL automática por request (eventos de SQLAlchemy sobre app.db.engine).
+
+measure_query solo cubre los lugares donde alguien lo envolvió a mano. Aquí
+cada sentencia que pasa por el engine se atribuye al request en curso vía
+un ContextVar (lo pone SqlTraceMiddleware; Starlette lo propaga al
+threadpool de los endpoints sync):
+
+- Por sentencia: fingerprint (SQL normalizado: literales → ?, listas IN
+  colapsadas), duración, filas (cursor.rowcount) y parámetros (recortados,
+  con las claves sensibles ocultas).
+- Por fingerprint, global: LatencyHistogram (ver timing.py), con tope de
+  SQL_TRACE_MAX_FINGERPRINTS distintos.
+- N+1: al cerrar el request, si un mismo fingerprint se ejecutó
+  SQL_TRACE_N_PLUS_ONE_THRESHOLD veces o más, se loguea y se acumula en
+  n_plus_one() por (ruta, fingerprint).
+
+- Contexto: annotate()/annotate_load() agregan usuario y load_ids a la
+  traza; slow_requests.py guarda la traza completa de los requests lentos.
+- Sentencias lentas: auto_explain.py captura su plan (muestreado, opt-in).
+
+Las sentencias fuera de un request (threads de fondo, scripts) solo van a
+los histogramas globales. Con varios workers, export_series() va al segmento
+compartido (shared_metrics.py) y las lecturas reciben `others` con lo de los
+demás workers.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+
+from . import auto_explain, slow_requests
+from .config import get_settings
+from .timing import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+_SENSITIVE = re.compile(r"pass|hash|token|secret", re.I)
+_PARAMS_MAX_CHARS = 300
+_SQL_MAX_CHARS = 2000
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?\b")
+_RE_IN_LIST = re.compile(r"\(\s*(?:\?|%\([^)]+\)s|%s|\$\d+)(?:\s*,\s*(?:\?|%\([^)]+\)s|%s|\$\d+))+\s*\)")
+_RE_PARAM = re.compile(r"%\([^)]+\)s|%s|\$\d+")
+_RE_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    s = _RE_STRING.sub("?", sql)
+    s = _RE_NUMBER.sub("?", s)
+    s = _RE_PARAM.sub("?", s)
+    s = _RE_IN_LIST.sub("(?...)", s)
+    return _RE_SPACE.sub(" ", s).strip()
+
+
+_fp_cache: dict[str, tuple[str, str]] = {}
+_FP_CACHE_MAX = 2048
+
+
+def fingerprint(sql: str) -> tuple[str, str]:
+    """(id corto, SQL normalizado). Cacheado: los SELECT de SQLAlchemy se repiten literalmente."""
+    hit = _fp_cache.get(sql)
+    if hit is not None:
+        return hit
+    norm = normalize_sql(sql)
+    out = (hashlib.sha1(norm.encode("utf-8")).hexdigest()[:12], norm[:_SQL_MAX_CHARS])
+    if len(_fp_cache) >= _FP_CACHE_MAX:
+        _fp_cache.clear()
+    _fp_cache[sql] = out
+    return out
+
+
+def _redact_params(params) -> str:
+    if params is None:
+        return ""
+    if isinstance(params, dict):
+        params = {k: ("***" if _SENSITIVE.search(str(k)) else v) for k, v in params.items()}
+    elif isinstance(params, (list, tuple)) and params and isinstance(params[0], dict):
+        params = [f"<{len(params)} filas (executemany)>"]
+    text = repr(params)
+    return text if len(text) <= _PARAMS_MAX_CHARS else text[:_PARAMS_MAX_CHARS] + "…"
+
+
+# --- traza por request ---
+@dataclass
+class RequestTrace:
+    method: str
+    path: str
+    started: float = field(default_factory=time.perf_counter)
+    route: str | None = None
+    statements: list = field(default_factory=list)   # dicts, hasta SQL_TRACE_MAX_STATEMENTS
+    dropped: int = 0
+    count: int = 0
+    sql_ms: float = 0.0
+    by_fingerprint: dict = field(default_factory=dict)  # fp → veces
+    tags: dict = field(default_factory=dict)            # usuario, load_ids, ... (annotate())
+    thread_id: int | None = None                        # último thread que ejecutó SQL / anotó
+
+    def add(self, fp: str, sql: str, ms: float, rows: int, params: str, max_statements: int) -> None:
+        self.count += 1
+        self.sql_ms += ms
+        self.by_fingerprint[fp] = self.by_fingerprint.get(fp, 0) + 1
+        if len(self.statements) < max_statements:
+            self.statements.append({"fingerprint": fp, "sql": sql, "ms": round(ms, 3), "rows": rows, "params": params})
+        else:
+            self.dropped += 1
+
+    def summary(self) -> dict:
+        return {
+            "sql_count": self.count,
+            "sql_ms": round(self.sql_ms, 3),
+            "statements": self.statements,
+            "statements_dropped": self.dropped,
+        }
+
+
+_current: ContextVar[RequestTrace | None] = ContextVar("sql_trace", default=None)
+
+
+def current() -> RequestTrace | None:
+    return _current.get()
+
+
+def annotate(**tags) -> None:
+    """Agrega datos al request en curso (usuario, ...). No hace nada fuera de un request."""
+    trace = _current.get()
+    if trace is not None:
+        trace.tags.update(tags)
+        trace.thread_id = threading.get_ident()
+
+
+def annotate_load(source: str, load_id: int | None) -> None:
+    """Registra qué carga leyó el request (para diagnosticar requests lentos)."""
+    trace = _current.get()
+    if trace is not None and load_id is not None:
+        trace.tags.setdefault("load_ids", {})[source] = load_id
+
+
+# --- agregados globales ---
+_lock = threading.Lock()
+_statements: dict[str, dict] = {}   # fp → {"sql": str, "hist": LatencyHistogram, "rows": int}
+_n_plus_one: dict[tuple[str, str], dict] = {}
+_overflow_fp = ("otros", "(fingerprints sobre SQL_TRACE_MAX_FINGERPRINTS)")
+
+
+def _record_global(fp: str, sql: str, seconds: float, rows: int) -> None:
+    with _lock:
+        entry = _statements.get(fp)
+        if entry is None:
+            if len(_statements) >= get_settings().SQL_TRACE_MAX_FINGERPRINTS:
+                fp, sql = _overflow_fp
+                entry = _statements.get(fp)
+            if entry is None:
+                entry = _statements[fp] = {"sql": sql, "hist": LatencyHistogram(), "rows": 0}
+        entry["hist"].record(seconds)
+        entry["rows"] += max(0, rows)
+
+
+def _copy_statement(e: dict) -> dict:
+    h = LatencyHistogram()
+    h.merge(e["hist"])
+    return {"sql": e["sql"], "hist": h, "rows": e["rows"]}
+
+
+def export_series() -> tuple[dict, dict]:
+    """Copia de lo de este proceso: ({fp: {sql, hist, rows}}, {(ruta, fp): {sql, occurrences, max_per_request}})."""
+    with _lock:
+        return (
+            {fp: _copy_statement(e) for fp, e in _statements.items()},
+            {k: dict(v) for k, v in _n_plus_one.items()},
+        )
+
+
+def _merge_into(statements: dict, n1: dict, other_statements: dict, other_n1: dict) -> None:
+    for fp, e in other_statements.items():
+        target = statements.get(fp)
+        if target is None:
+            statements[fp] = _copy_statement(e)
+        else:
+            target["hist"].merge(e["hist"])
+            target["rows"] += e["rows"]
+    for k, v in other_n1.items():
+        target = n1.setdefault(k, {"sql": v["sql"], "occurrences": 0, "max_per_request": 0})
+        target["occurrences"] += v["occurrences"]
+        target["max_per_request"] = max(target["max_per_request"], v["max_per_request"])
+
+
+def absorb(statements: dict, n1: dict) -> None:
+    """Suma lo que dejó un worker anterior en el segmento (ver timing.absorb)."""
+    with _lock:
+        _merge_into(_statements, _n_plus_one, statements, n1)
+
+
+def _merged(others) -> tuple[dict, dict]:
+    statements, n1 = export_series()
+    for other_statements, other_n1 in others:
+        _merge_into(statements, n1, other_statements, other_n1)
+    return statements, n1
+
+
+def statement_stats(limit: int = 50, order_by: str = "total", others=()) -> list[dict]:
+    """`others`: [(statements, n_plus_one)] de otros workers (shared_metrics.other_series)."""
+    key = {"total": "total_time_ms", "calls": "calls", "p99": "p99", "avg": "avg_time_ms"}.get(order_by, "total_time_ms")
+    statements, _ = _merged(others)
+    now = time.time()
+    rows = [
+        {"fingerprint": fp, "sql": e["sql"], "rows": e["rows"], **e["hist"].snapshot(now)}
+        for fp, e in statements.items()
+    ]
+    rows.sort(key=lambda r: r[key], reverse=True)
+    return rows[:limit]
+
+
+def statement_histograms(others=()) -> list[tuple[str, str, LatencyHistogram]]:
+    """(fingerprint, sql, histograma) de cada sentencia, sumando `others`; para exportar métricas (copias)."""
+    statements, _ = _merged(others)
+    return [(fp, e["sql"], e["hist"]) for fp, e in statements.items()]
+
+
+def n_plus_one(others=()) -> list[dict]:
+    _, n1 = _merged(others)
+    out = [{"route": r, "fingerprint": fp, **v} for (r, fp), v in n1.items()]
+    out.sort(key=lambda r: r["occurrences"], reverse=True)
+    return out
+
+
+def reset() -> None:
+    with _lock:
+        _statements.clear()
+        _n_plus_one.clear()
+
+
+# --- eventos del engine ---
+def _before(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("sql_trace_t0", []).append(time.perf_counter())
+
+
+def _after(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get("sql_trace_t0")
+    if not stack:
+        return
+    seconds = time.perf_counter() - stack.pop()
+    try:
+        rows = cursor.rowcount
+    except Exception:
+        rows = -1
+    fp, sql = fingerprint(statement)
+    _record_global(fp, sql, seconds, rows)
+    auto_explain.maybe_capture(fp, statement, parameters, seconds, executemany)
+    trace = _current.get()
+    if trace is not None:
+        trace.thread_id = threading.get_ident()
+        s = get_settings()
+        params = _redact_params(parameters) if s.SQL_TRACE_CAPTURE_PARAMS else ""
+        trace.add(fp, sql, seconds * 1000, rows, params, s.SQL_TRACE_MAX_STATEMENTS)
+
+
+def _on_error(exception_context):
+    # la sentencia falló: no queda un after_cursor_execute que saque el t0
+    conn = exception_context.connection
+    if conn is not None:
+        stack = conn.info.get("sql_trace_t0")
+        if stack:
+            stack.pop()
+
+
+_installed = False
+
+
+def install(engine) -> None:
+    """Registra los hooks en el engine (idempotente)."""
+    global _installed
+    if _installed:
+        return
+    event.listen(engine, "before_cursor_execute", _before)
+    event.listen(engine, "after_cursor_execute", _after)
+    event.listen(engine, "handle_error", _on_error)
+    _installed = True
+
+
+# --- middleware ---
+def route_label(scope) -> str:
+    """Plantilla de la ruta ("/export/jobs/{job_id}") o el path si no matcheó ninguna."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("path", "")
+
+
+def _check_n_plus_one(trace: RequestTrace) -> None:
+    threshold = get_settings().SQL_TRACE_N_PLUS_ONE_THRESHOLD
+    if threshold <= 0:
+        return
+    label = f"{trace.method} {trace.route}"
+    for fp, n in trace.by_fingerprint.items():
+        if n < threshold:
+            continue
+        sql = next((st["sql"] for st in trace.statements if st["fingerprint"] == fp), "")
+        logger.warning(f"⚠️ Posible N+1 en {label}: {n}× {sql[:160]}")
+        with _lock:
+            entry = _n_plus_one.setdefault((label, fp), {"sql": sql, "occurrences": 0, "max_per_request": 0})
+            entry["occurrences"] += 1
+            entry["max_per_request"] = max(entry["max_per_request"], n)
+
+
+class SqlTraceMiddleware:
+    """Abre una RequestTrace por request HTTP y al final revisa patrones N+1."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = RequestTrace(method=scope["method"], path=scope["path"])
+        status = {"code": 500}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        token = _current.set(trace)
+        slow_requests.begin(trace)
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            trace.route = route_label(scope)
+            _current.reset(token)
+            _check_n_plus_one(trace)
+            slow_requests.finish(trace, scope, status["code"])
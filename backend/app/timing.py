@@ -4,18 +4,251 @@ Mide tiempos de ejecución de endpoints y queries SQL.
 """
 import time
 import logging
+import struct
+from array import array
 from functools import wraps
 from typing import Callable, Any
 from contextlib import contextmanager
-from collections import defaultdict
 import threading
 
 logger = logging.getLogger(__name__)
 
-# Almacenamiento thread-safe de métricas
+
+# ---------------------------------------------------------------------------
+# Histogramas de latencia de memoria fija (log-buckets estilo HDR)
+# ---------------------------------------------------------------------------
+# Valores en microsegundos. Bajo 2^SUB_BITS µs cada µs es su propio bucket;
+# sobre eso cada potencia de 2 se divide en 2^SUB_BITS sub-buckets → error
+# relativo máximo 1/2^SUB_BITS (~3%). Índice en O(1) con bit_length().
+SUB_BITS = 5
+_SUB = 1 << SUB_BITS
+_MAX_US = (1 << 34) - 1                  # ~4.7 h; más arriba se satura
+_N_BUCKETS = (_MAX_US.bit_length() - SUB_BITS - 1) * _SUB + 2 * _SUB
+
+WINDOW_SLOT_SECONDS = 60
+WINDOW_SLOTS = 6                         # ventana de 5 min completos + el minuto en curso
+QUANTILES = (("p50", 0.50), ("p90", 0.90), ("p99", 0.99), ("p999", 0.999))
+
+
+def _bucket_index(us: int) -> int:
+    if us < _SUB:
+        return us
+    e = us.bit_length() - SUB_BITS - 1
+    return e * _SUB + (us >> e)
+
+
+def _bucket_value(idx: int) -> float:
+    """Punto medio del rango de valores del bucket (en µs)."""
+    if idx < _SUB:
+        return float(idx)
+    e = idx // _SUB - 1
+    m = idx - e * _SUB
+    return ((m << e) + ((m + 1) << e) - 1) / 2
+
+
+def _bucket_upper(idx: int) -> int:
+    """Mayor valor (µs) que cae en el bucket."""
+    if idx < _SUB:
+        return idx
+    e = idx // _SUB - 1
+    m = idx - e * _SUB
+    return ((m + 1) << e) - 1
+
+
+def _quantiles(buckets, count: int) -> dict:
+    if not count:
+        return {name: 0.0 for name, _ in QUANTILES}
+    targets = [(name, max(1, int(count * q + 0.5))) for name, q in QUANTILES]
+    out, seen, t = {}, 0, 0
+    for idx, n in enumerate(buckets):
+        if not n:
+            continue
+        seen += n
+        while t < len(targets) and seen >= targets[t][1]:
+            out[targets[t][0]] = round(_bucket_value(idx) / 1000, 3)
+            t += 1
+        if t == len(targets):
+            break
+    return out
+
+
+_HEAD = struct.Struct("<QQQQ")          # count, total_us, min_us, max_us
+_SLOT_HEAD = struct.Struct("<qI")        # epoch del minuto, llamadas en el slot
+_U32 = struct.Struct("<I")
+_NO_MIN = (1 << 64) - 1
+
+
+def _dump_sparse(buckets) -> bytes:
+    idx = array("H", (j for j, n in enumerate(buckets) if n))
+    counts = array("I", (buckets[j] for j in idx))
+    return _U32.pack(len(idx)) + idx.tobytes() + counts.tobytes()
+
+
+def _load_sparse(data, offset: int, into) -> int:
+    (nnz,) = _U32.unpack_from(data, offset)
+    offset += _U32.size
+    idx = array("H", bytes(data[offset:offset + 2 * nnz]))
+    offset += 2 * nnz
+    counts = array("I", bytes(data[offset:offset + 4 * nnz]))
+    for j, n in zip(idx, counts):
+        into[j] = n
+    return offset + 4 * nnz
+
+
+class LatencyHistogram:
+    """
+    Histograma de latencias con memoria constante (~4 KB por slot, sin importar
+    cuántas llamadas) y ventanas deslizantes por minuto.
+
+    record() es O(1) salvo al entrar a un minuto nuevo, donde se limpia el slot
+    que se reutiliza. No es thread-safe: se usa bajo _metrics_lock.
+    """
+
+    __slots__ = ("count", "total_us", "min_us", "max_us", "buckets", "_slots", "_slot_epoch", "_slot_count")
+
+    def __init__(self):
+        self.count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_us = 0
+        self.buckets = array("I", bytes(4 * _N_BUCKETS))
+        self._slots = [array("I", bytes(4 * _N_BUCKETS)) for _ in range(WINDOW_SLOTS)]
+        self._slot_epoch = [-1] * WINDOW_SLOTS
+        self._slot_count = [0] * WINDOW_SLOTS
+
+    def record(self, seconds: float, now: float | None = None) -> None:
+        us = min(_MAX_US, max(0, int(seconds * 1_000_000)))
+        idx = _bucket_index(us)
+        self.count += 1
+        self.total_us += us
+        self.min_us = us if self.min_us is None else min(self.min_us, us)
+        self.max_us = max(self.max_us, us)
+        self.buckets[idx] += 1
+
+        epoch = int((time.time() if now is None else now) // WINDOW_SLOT_SECONDS)
+        i = epoch % WINDOW_SLOTS
+        if self._slot_epoch[i] != epoch:
+            self._slots[i] = array("I", bytes(4 * _N_BUCKETS))
+            self._slot_epoch[i] = epoch
+            self._slot_count[i] = 0
+        self._slots[i][idx] += 1
+        self._slot_count[i] += 1
+
+    def window(self, minutes: int, now: float | None = None) -> dict:
+        """Llamadas, rate (req/s) y percentiles de los últimos `minutes` min (+ el minuto en curso)."""
+        now = time.time() if now is None else now
+        epoch = int(now // WINDOW_SLOT_SECONDS)
+        minutes = max(1, min(minutes, WINDOW_SLOTS - 1))
+        merged = array("I", bytes(4 * _N_BUCKETS))
+        count = 0
+        for i in range(WINDOW_SLOTS):
+            if epoch - minutes <= self._slot_epoch[i] <= epoch and self._slot_count[i]:
+                count += self._slot_count[i]
+                slot = self._slots[i]
+                for j, n in enumerate(slot):
+                    if n:
+                        merged[j] += n
+        covered = minutes * WINDOW_SLOT_SECONDS + (now % WINDOW_SLOT_SECONDS)
+        return {"calls": count, "rate_per_s": round(count / covered, 4), **_quantiles(merged, count)}
+
+    def cumulative(self, bounds_seconds) -> list[int]:
+        """Conteos acumulados por límite superior (segundos, ascendentes), p.ej. para buckets `le` de Prometheus."""
+        bounds_us = [b * 1_000_000 for b in bounds_seconds]
+        out, acc, b = [], 0, 0
+        for idx, n in enumerate(self.buckets):
+            upper = _bucket_upper(idx)
+            while b < len(bounds_us) and upper > bounds_us[b]:
+                out.append(acc)
+                b += 1
+            if b == len(bounds_us):
+                break
+            acc += n
+        while len(out) < len(bounds_us):
+            out.append(acc)
+        return out
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        """Suma `other` en este histograma (ventanas alineadas por minuto; gana el minuto más reciente)."""
+        if not other.count:
+            return
+        self.count += other.count
+        self.total_us += other.total_us
+        if other.min_us is not None:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+        self.max_us = max(self.max_us, other.max_us)
+        for j, n in enumerate(other.buckets):
+            if n:
+                self.buckets[j] += n
+        for i in range(WINDOW_SLOTS):
+            epoch = other._slot_epoch[i]
+            if epoch < 0 or epoch < self._slot_epoch[i]:
+                continue
+            if epoch > self._slot_epoch[i]:
+                self._slots[i] = array("I", other._slots[i])
+                self._slot_epoch[i] = epoch
+                self._slot_count[i] = other._slot_count[i]
+                continue
+            slot = self._slots[i]
+            for j, n in enumerate(other._slots[i]):
+                if n:
+                    slot[j] += n
+            self._slot_count[i] += other._slot_count[i]
+
+    # Serialización compacta (buckets dispersos) para compartir entre procesos (shared_metrics.py)
+    def dump(self) -> bytes:
+        parts = [_HEAD.pack(self.count, self.total_us, _NO_MIN if self.min_us is None else self.min_us, self.max_us)]
+        parts.append(_dump_sparse(self.buckets))
+        for i in range(WINDOW_SLOTS):
+            parts.append(_SLOT_HEAD.pack(self._slot_epoch[i], self._slot_count[i]))
+            parts.append(_dump_sparse(self._slots[i]) if self._slot_count[i] else _U32.pack(0))
+        return b"".join(parts)
+
+    @classmethod
+    def load(cls, data, offset: int = 0) -> tuple["LatencyHistogram", int]:
+        """Inverso de dump(); retorna (histograma, offset siguiente)."""
+        h = cls()
+        h.count, h.total_us, min_us, h.max_us = _HEAD.unpack_from(data, offset)
+        h.min_us = None if min_us == _NO_MIN else min_us
+        offset = _load_sparse(data, offset + _HEAD.size, h.buckets)
+        for i in range(WINDOW_SLOTS):
+            h._slot_epoch[i], h._slot_count[i] = _SLOT_HEAD.unpack_from(data, offset)
+            offset = _load_sparse(data, offset + _SLOT_HEAD.size, h._slots[i])
+        return h, offset
+
+    def snapshot(self, now: float | None = None) -> dict:
+        total_ms = self.total_us / 1000
+        return {
+            "calls": self.count,
+            "total_time_ms": round(total_ms, 3),
+            "avg_time_ms": round(total_ms / self.count, 3) if self.count else 0,
+            "min_time_ms": round((self.min_us or 0) / 1000, 3),
+            "max_time_ms": round(self.max_us / 1000, 3),
+            **_quantiles(self.buckets, self.count),
+            "windows": {"1m": self.window(1, now), "5m": self.window(5, now)},
+        }
+
+
+# Almacenamiento thread-safe de métricas (memoria constante por nombre)
 _metrics_lock = threading.Lock()
-_endpoint_metrics = defaultdict(list)  # {endpoint_name: [durations]}
-_query_metrics = defaultdict(list)     # {endpoint_name: [(query_desc, duration)]}
+_endpoint_metrics: dict[str, LatencyHistogram] = {}           # {endpoint: hist}
+_query_metrics: dict[str, dict[str, LatencyHistogram]] = {}   # {endpoint: {query_desc: hist}}
+
+
+def record_endpoint(name: str, seconds: float) -> None:
+    with _metrics_lock:
+        h = _endpoint_metrics.get(name)
+        if h is None:
+            h = _endpoint_metrics[name] = LatencyHistogram()
+        h.record(seconds)
+
+
+def record_query(endpoint_name: str, description: str, seconds: float) -> None:
+    with _metrics_lock:
+        per_endpoint = _query_metrics.setdefault(endpoint_name, {})
+        h = per_endpoint.get(description)
+        if h is None:
+            h = per_endpoint[description] = LatencyHistogram()
+        h.record(seconds)
 
 
 class TimingContext:
@@ -32,7 +265,7 @@ class TimingContext:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.duration = time.perf_counter() - self.start_time
-        logger.info(f"⏱️  {self.operation}: {self.duration*1000:.2f}ms")
+        logger.debug("⏱️ %s: %.2fms", self.operation, self.duration * 1000)
         return False
 
 
@@ -51,28 +284,23 @@ def measure_endpoint(endpoint_name: str = None):
         @wraps(func)
         def wrapper(*args, **kwargs):
             start_time = time.perf_counter()
-
-            logger.info(f"\n{'='*60}")
-            logger.info(f"🚀 START: {name}")
-            logger.info(f"{'='*60}")
-
             try:
                 result = func(*args, **kwargs)
                 duration = time.perf_counter() - start_time
 
                 # Almacenar métrica
-                with _metrics_lock:
-                    _endpoint_metrics[name].append(duration)
+                record_endpoint(name, duration)
 
-                logger.info(f"{'='*60}")
-                logger.info(f"✅ END: {name} - Total: {duration*1000:.2f}ms ({duration:.3f}s)")
-                logger.info(f"{'='*60}\n")
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("✅ %s: %.2fms", name, duration * 1000,
+                                extra={"endpoint": name, "duration_ms": round(duration * 1000, 2)})
 
                 return result
 
             except Exception as e:
                 duration = time.perf_counter() - start_time
-                logger.error(f"❌ ERROR in {name} after {duration*1000:.2f}ms: {str(e)}")
+                logger.error("❌ ERROR in %s after %.2fms: %s", name, duration * 1000, e,
+                             extra={"endpoint": name, "duration_ms": round(duration * 1000, 2)})
                 raise
 
         return wrapper
@@ -89,97 +317,119 @@ def measure_query(query_description: str, endpoint_name: str = None):
             result = db.execute(query).scalar()
     """
     start_time = time.perf_counter()
-    query_number = _get_query_count(endpoint_name) + 1
-
-    logger.info(f"  📊 Query #{query_number}: {query_description}")
-
     try:
         yield
         duration = time.perf_counter() - start_time
 
         # Almacenar métrica
         if endpoint_name:
-            with _metrics_lock:
-                _query_metrics[endpoint_name].append((query_description, duration))
+            record_query(endpoint_name, query_description, duration)
 
-        logger.info(f"     ⏱️  Completed in {duration*1000:.2f}ms")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📊 Query %s: %.2fms", query_description, duration * 1000,
+                         extra={"endpoint": endpoint_name, "query": query_description, "duration_ms": round(duration * 1000, 2)})
 
     except Exception as e:
         duration = time.perf_counter() - start_time
-        logger.error(f"     ❌ Query failed after {duration*1000:.2f}ms: {str(e)}")
+        logger.error("❌ Query %s failed after %.2fms: %s", query_description, duration * 1000, e,
+                     extra={"endpoint": endpoint_name, "query": query_description})
         raise
 
 
-def _get_query_count(endpoint_name: str = None) -> int:
-    """Retorna el número actual de queries para un endpoint."""
-    if not endpoint_name:
-        return 0
+def _empty_stats() -> dict:
+    return {
+        "calls": 0,
+        "total_time_ms": 0,
+        "avg_time_ms": 0,
+        "min_time_ms": 0,
+        "max_time_ms": 0,
+        **{name: 0.0 for name, _ in QUANTILES},
+        "queries": {},
+    }
+
+
+def _endpoint_stats(endpoints: dict, queries: dict, endpoint_name: str, now: float) -> dict:
+    h = endpoints.get(endpoint_name)
+    out = h.snapshot(now) if h is not None else _empty_stats()
+    out["queries"] = {
+        desc: qh.snapshot(now)
+        for desc, qh in sorted(queries.get(endpoint_name, {}).items())
+    }
+    return out
+
+
+def _copy(h: LatencyHistogram) -> LatencyHistogram:
+    out = LatencyHistogram()
+    out.merge(h)
+    return out
+
+
+def export_series() -> tuple[dict, dict]:
+    """Copia de los histogramas de este proceso: ({endpoint: hist}, {endpoint: {query: hist}})."""
     with _metrics_lock:
-        return len(_query_metrics.get(endpoint_name, []))
+        return (
+            {name: _copy(h) for name, h in _endpoint_metrics.items()},
+            {ep: {desc: _copy(h) for desc, h in per.items()} for ep, per in _query_metrics.items()},
+        )
 
 
-def get_endpoint_stats(endpoint_name: str) -> dict:
+def absorb(endpoints: dict, queries: dict) -> None:
+    """Suma histogramas externos a los de este proceso (p.ej. los que dejó un worker anterior)."""
+    with _metrics_lock:
+        for name, h in endpoints.items():
+            _endpoint_metrics.setdefault(name, LatencyHistogram()).merge(h)
+        for ep, per in queries.items():
+            target = _query_metrics.setdefault(ep, {})
+            for desc, h in per.items():
+                target.setdefault(desc, LatencyHistogram()).merge(h)
+
+
+def _merged(others) -> tuple[dict, dict]:
+    endpoints, queries = export_series()
+    for other_endpoints, other_queries in others:
+        for name, h in other_endpoints.items():
+            endpoints.setdefault(name, LatencyHistogram()).merge(h)
+        for ep, per in other_queries.items():
+            target = queries.setdefault(ep, {})
+            for desc, h in per.items():
+                target.setdefault(desc, LatencyHistogram()).merge(h)
+    return endpoints, queries
+
+
+def get_endpoint_stats(endpoint_name: str, others=()) -> dict:
     """
     Obtiene estadísticas de un endpoint específico.
 
+    `others`: [(endpoints, queries)] de otros workers (shared_metrics.other_workers())
+    que se suman a los de este proceso.
+
     Returns:
         {
             "calls": int,
-            "total_time_ms": float,
-            "avg_time_ms": float,
-            "min_time_ms": float,
-            "max_time_ms": float,
-            "queries": [
-                {"description": str, "time_ms": float},
-                ...
-            ]
+            "total_time_ms", "avg_time_ms", "min_time_ms", "max_time_ms": float,
+            "p50", "p90", "p99", "p999": float,        # ms, error relativo ≤ ~3%
+            "windows": {"1m": {...}, "5m": {...}},      # calls, rate_per_s y percentiles
+            "queries": {query_desc: {mismas claves}}   # por cada measure_query del endpoint
         }
     """
-    with _metrics_lock:
-        durations = _endpoint_metrics.get(endpoint_name, [])
-        queries = _query_metrics.get(endpoint_name, [])
-
-        if not durations:
-            return {
-                "calls": 0,
-                "total_time_ms": 0,
-                "avg_time_ms": 0,
-                "min_time_ms": 0,
-                "max_time_ms": 0,
-                "queries": []
-            }
-
-        durations_ms = [d * 1000 for d in durations]
-
-        # Tomar queries de la última ejecución
-        last_queries = []
-        if queries:
-            # Asumimos que las queries se acumulan, tomamos las últimas
-            query_count = len(queries) // len(durations)
-            last_queries = queries[-query_count:] if query_count > 0 else queries
-
-        return {
-            "calls": len(durations),
-            "total_time_ms": sum(durations_ms),
-            "avg_time_ms": sum(durations_ms) / len(durations_ms),
-            "min_time_ms": min(durations_ms),
-            "max_time_ms": max(durations_ms),
-            "last_execution_queries": [
-                {"description": desc, "time_ms": dur * 1000}
-                for desc, dur in last_queries
-            ]
-        }
-
-
-def get_all_stats() -> dict:
-    """Obtiene estadísticas de todos los endpoints instrumentados."""
-    with _metrics_lock:
-        endpoint_names = set(_endpoint_metrics.keys()) | set(_query_metrics.keys())
-
-        return {
-            name: get_endpoint_stats(name)
-            for name in sorted(endpoint_names)
-        }
+    if not others:
+        now = time.time()
+        with _metrics_lock:
+            return _endpoint_stats(_endpoint_metrics, _query_metrics, endpoint_name, now)
+    endpoints, queries = _merged(others)
+    return _endpoint_stats(endpoints, queries, endpoint_name, time.time())
+
+
+def get_all_stats(others=()) -> dict:
+    """Obtiene estadísticas de todos los endpoints instrumentados (+ los de `others`, ver get_endpoint_stats)."""
+    if not others:
+        now = time.time()
+        with _metrics_lock:
+            names = set(_endpoint_metrics) | set(_query_metrics)
+            return {name: _endpoint_stats(_endpoint_metrics, _query_metrics, name, now) for name in sorted(names)}
+    endpoints, queries = _merged(others)
+    now = time.time()
+    return {name: _endpoint_stats(endpoints, queries, name, now) for name in sorted(set(endpoints) | set(queries))}
 
 
 def reset_stats():
@@ -214,13 +464,14 @@ def print_summary(endpoint_name: str = None):
         logger.info(f"\n🎯 Endpoint: {name}")
         logger.info(f"   Calls: {data['calls']}")
         logger.info(f"   Average: {data['avg_time_ms']:.2f}ms")
+        logger.info(f"   p50 / p90 / p99: {data['p50']:.2f} / {data['p90']:.2f} / {data['p99']:.2f}ms")
         logger.info(f"   Min: {data['min_time_ms']:.2f}ms")
         logger.info(f"   Max: {data['max_time_ms']:.2f}ms")
         logger.info(f"   Total: {data['total_time_ms']:.2f}ms")
 
-        if data['last_execution_queries']:
-            logger.info(f"\n   Last Execution Queries ({len(data['last_execution_queries'])}):")
-            for i, q in enumerate(data['last_execution_queries'], 1):
-                logger.info(f"     {i}. {q['description']}: {q['time_ms']:.2f}ms")
+        if data['queries']:
+            logger.info(f"\n   Queries ({len(data['queries'])}):")
+            for i, (desc, q) in enumerate(data['queries'].items(), 1):
+                logger.info(f"     {i}. {desc}: avg {q['avg_time_ms']:.2f}ms, p99 {q['p99']:.2f}ms ({q['calls']} calls)")
 
     logger.info("\n" + "="*80 + "\n")
@@ -65,4 +65,47 @@ def discipline_from_subsystem(subs: str) -> str:
     if not code:
         return ""
     m = re.match(r"(\d{2})\d{2}-", code)  # primeros 2 dígitos
-    return m.group(1) if m else ""
\ No newline at end of file
+    return m.group(1) if m else ""
+
+def revision_sort_key(rev) -> tuple[int, int, str, int]:
+    """
+    Clave para ordenar revisiones ACONEX (mayor = más reciente).
+
+    Las revisiones numéricas (0, 1, 2...) son posteriores a las alfabéticas
+    (A, B, C... emisiones previas a aprobación). '1.0' (Excel) cuenta como 1.
+    """
+    s = str(rev if rev is not None else "").strip().upper()
+    if not s or s in ("NAN", "NONE", "NULL"):
+        return (0, 0, "", 0)
+    m = re.fullmatch(r"(\d+)(?:\.0+)?", s)
+    if m:
+        return (2, int(m.group(1)), "", 0)
+    m = re.fullmatch(r"([A-Z]+)(\d*)", s)
+    if m:
+        return (1, len(m.group(1)), m.group(1), int(m.group(2) or 0))
+    return (1, 0, s, 0)
+
+
+def latest_revision_flags(doc_keys, revisions, dates=None) -> list[bool]:
+    """
+    Marca la fila con la última revisión por documento (clave ya normalizada).
+
+    Desempate: fecha de recepción (si viene) y luego la posición en el archivo
+    (la fila posterior gana). Claves vacías no se agrupan: todas quedan True.
+    """
+    n = len(doc_keys)
+    flags = [False] * n
+    best: dict[str, tuple] = {}
+    for i in range(n):
+        key = doc_keys[i]
+        if not key:
+            flags[i] = True
+            continue
+        d = dates[i] if dates is not None else None
+        rank = (revision_sort_key(revisions[i]), d if d is not None else float("-inf"), i)
+        cur = best.get(key)
+        if cur is None or rank > cur:
+            best[key] = rank
+    for rank in best.values():
+        flags[rank[2]] = True
+    return flags
@@ -0,0 +1,94 @@
+"""
+Exports a Excel (.xlsx) en streaming con openpyxl en modo write-only.
+
+Las filas se van escribiendo a disco a medida que llegan del cursor de la BD
+(openpyxl write-only no guarda las celdas en memoria), el libro se cierra en
+un archivo temporal y recién ahí se responde con FileResponse. El temporal se
+borra cuando terminó de enviarse (BackgroundTask).
+
+Memoria acotada: ~ un batch del cursor (yield_per), sin importar si son 2k o 200k filas.
+"""
+import logging
+import os
+import tempfile
+from typing import Iterable
+
+from fastapi.responses import FileResponse
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+from starlette.background import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# filas por batch del cursor server-side al exportar
+XLSX_YIELD_PER = 2000
+
+
+def _clean(v):
+    # openpyxl rechaza caracteres de control (vienen a veces pegados desde BIM360)
+    if isinstance(v, str):
+        return ILLEGAL_CHARACTERS_RE.sub("", v)
+    return v
+
+
+def write_xlsx(
+    header: list[str],
+    rows: Iterable[list],
+    *,
+    sheet_title: str = "Datos",
+    col_widths: list[int] | None = None,
+) -> tuple[str, int]:
+    """
+    Escribe header + rows a un .xlsx temporal.
+
+    Returns:
+        (path del temporal, filas escritas). El caller debe borrar el archivo.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_title[:31])
+    ws.freeze_panes = "A2"
+    for i, width in enumerate(col_widths or [], start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    bold = Font(bold=True)
+    header_cells = []
+    for h in header:
+        c = WriteOnlyCell(ws, value=h)
+        c.font = bold
+        header_cells.append(c)
+    ws.append(header_cells)
+
+    n = 0
+    for row in rows:
+        ws.append([_clean(v) for v in row])
+        n += 1
+
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb.save(path)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path, n
+
+
+def remove_temp_file(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        logger.warning(f"⚠️ No se pudo borrar el temporal {path}")
+
+
+def xlsx_file_response(path: str, filename: str) -> FileResponse:
+    """Envía el .xlsx y lo borra al terminar."""
+    return FileResponse(
+        path,
+        media_type=XLSX_MEDIA_TYPE,
+        filename=filename,
+        background=BackgroundTask(remove_temp_file, path),
+    )
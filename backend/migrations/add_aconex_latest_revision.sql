@@ -0,0 +1,44 @@
+-- ============================================================================
+-- MIGRACIÓN: Índice de última revisión por documento ACONEX
+-- Fecha: 2025-11-24
+-- Objetivo: Que matching y conteos (válidos / duplicados / error de SS)
+--           trabajen sobre UNA fila por documento (la última revisión)
+-- Base de datos: PostgreSQL 12+
+-- ============================================================================
+
+-- PASO 1: Columna is_latest (la calcula la ingesta en /admin/upload/aconex)
+-- ============================================================================
+ALTER TABLE aconex_docs
+    ADD COLUMN IF NOT EXISTS is_latest BOOLEAN NOT NULL DEFAULT TRUE;
+
+-- PASO 2: Índice parcial SOLO sobre las últimas revisiones
+-- ============================================================================
+CREATE INDEX IF NOT EXISTS idx_aconex_latest_doc_norm
+    ON aconex_docs (load_id, document_no_norm, subsystem_code_norm)
+    WHERE is_latest;
+
+-- PASO 3: Backfill de cargas existentes
+-- ============================================================================
+-- Ejecutar: python scripts/backfill_aconex_latest.py
+-- (usa exactamente la misma regla de orden de revisiones que la ingesta)
+
+-- PASO 4: Verificar
+-- ============================================================================
+SELECT load_id,
+       COUNT(*)                                   AS filas,
+       COUNT(*) FILTER (WHERE is_latest)          AS ultimas_revisiones,
+       COUNT(DISTINCT document_no_norm)           AS documentos_unicos
+FROM aconex_docs
+GROUP BY load_id
+ORDER BY load_id;
+
+-- ============================================================================
+-- NOTAS
+-- ============================================================================
+-- 1. Orden de revisiones: numéricas (0, 1, 2...) > alfabéticas (A, B, C...).
+--    Desempate por fecha de recepción y luego por posición en el archivo.
+-- 2. Los conteos de "cargados" y "duplicados" siguen usando TODAS las filas.
+-- 3. ROLLBACK:
+--    DROP INDEX IF EXISTS idx_aconex_latest_doc_norm;
+--    ALTER TABLE aconex_docs DROP COLUMN IF EXISTS is_latest;
+-- ============================================================================
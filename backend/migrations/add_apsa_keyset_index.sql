@@ -0,0 +1,30 @@
+-- ============================================================================
+-- MIGRACIÓN: Índice para paginación keyset de /apsa/list
+-- Fecha: 2025-11-25
+-- Objetivo: Que la página N no tenga que construir y descartar (N-1)*page_size
+--           filas (LIMIT/OFFSET). El cursor busca directo en el índice.
+-- Base de datos: PostgreSQL 12+
+-- ============================================================================
+
+-- Mismo orden que el ORDER BY del endpoint: (subsistema, codigo_cmdic, id),
+-- precedido por load_id para que cada carga sea un rango contiguo del índice.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apsa_load_keyset
+    ON apsa_protocols (load_id, subsistema, codigo_cmdic, id);
+
+-- Verificar (debe aparecer "Index Scan using idx_apsa_load_keyset"):
+/*
+EXPLAIN
+SELECT id, codigo_cmdic, subsistema
+FROM apsa_protocols
+WHERE load_id = 123
+  AND (subsistema, codigo_cmdic, id) > ('5620-S01-003', 'ABC-123', 45678)
+ORDER BY subsistema, codigo_cmdic, id
+LIMIT 51;
+*/
+
+-- ============================================================================
+-- NOTAS
+-- - CONCURRENTLY no bloquea escrituras, pero no puede ir dentro de una transacción.
+-- - El modo offset (page/page_size) sigue disponible y usa el mismo orden.
+-- - ROLLBACK: DROP INDEX CONCURRENTLY IF EXISTS idx_apsa_load_keyset;
+-- ============================================================================
@@ -0,0 +1,59 @@
+-- ============================================================================
+-- MIGRACIÓN: Índices de búsqueda libre para APSA (full-text + trigramas)
+-- Fecha: 2025-11-26
+-- Objetivo: Que el filtro q de /apsa/list y /export/apsa.csv (ILIKE '%q%')
+--           deje de escanear toda la carga, y habilitar /apsa/search
+--           (ranking) y /apsa/search/suggest (autocompletado por prefijo)
+-- Base de datos: PostgreSQL 12+ (extensión pg_trgm)
+-- ============================================================================
+
+-- PASO 1: Extensión de trigramas (requiere permisos de owner de la BD)
+-- ============================================================================
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- PASO 2: Documento full-text generado (codigo + descripcion + tag)
+-- ============================================================================
+-- 'simple' = sin stemming: códigos y tags calzan literalmente
+ALTER TABLE apsa_protocols
+    ADD COLUMN IF NOT EXISTS search_tsv tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('simple', coalesce(codigo_cmdic, '') || ' ' ||
+                              coalesce(descripcion, '') || ' ' ||
+                              coalesce(tag, ''))
+    ) STORED;
+
+-- PASO 3: Índices GIN
+-- ============================================================================
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apsa_search_tsv
+    ON apsa_protocols USING gin (search_tsv);
+
+-- Trigramas: aceleran ILIKE '%q%' y ILIKE 'q%' (q de 3+ caracteres)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apsa_trgm_codigo_cmdic
+    ON apsa_protocols USING gin (codigo_cmdic gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apsa_trgm_descripcion
+    ON apsa_protocols USING gin (descripcion gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apsa_trgm_tag
+    ON apsa_protocols USING gin (tag gin_trgm_ops);
+
+ANALYZE apsa_protocols;
+
+-- PASO 4: Verificar (debe aparecer "Bitmap Index Scan on idx_apsa_trgm_...")
+-- ============================================================================
+/*
+EXPLAIN
+SELECT count(*) FROM apsa_protocols
+WHERE load_id = 123
+  AND (codigo_cmdic ILIKE '%bomba%' OR descripcion ILIKE '%bomba%' OR tag ILIKE '%bomba%');
+*/
+
+-- ============================================================================
+-- NOTAS
+-- - ADD COLUMN ... GENERATED reescribe la tabla (bloqueo exclusivo): hacerlo
+--   en una ventana de mantenimiento. Los CREATE INDEX CONCURRENTLY no bloquean.
+-- - Búsquedas de 1-2 caracteres no pueden usar trigramas (vuelven a Seq Scan).
+-- - Benchmark: python scripts/bench_search.py --rows 100000 1000000
+-- - ROLLBACK:
+--   DROP INDEX IF EXISTS idx_apsa_trgm_tag, idx_apsa_trgm_descripcion,
+--                        idx_apsa_trgm_codigo_cmdic, idx_apsa_search_tsv;
+--   ALTER TABLE apsa_protocols DROP COLUMN IF EXISTS search_tsv;
+-- ============================================================================
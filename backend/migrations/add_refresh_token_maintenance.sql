@@ -0,0 +1,45 @@
+-- ============================================================================
+-- MIGRACIÓN: Índices para rotación y purga de refresh_tokens
+-- Fecha: 2025-12-03
+-- Objetivo: /auth/refresh rota el token con un UPDATE ... WHERE token_hash = ?
+--           AND NOT revoked (índice parcial, solo los tokens vivos) y la purga
+--           periódica (app/refresh_tokens.py) borra expirados/revocados en
+--           batches sin recorrer toda la tabla
+-- Base de datos: PostgreSQL 12+
+-- ============================================================================
+
+-- PASO 1: Índice parcial para la rotación (mucho más chico que el completo)
+-- ============================================================================
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_refresh_tokens_active_hash
+    ON refresh_tokens (token_hash)
+    WHERE NOT revoked;
+
+-- PASO 2: Índices para la purga y para "revocar todos los tokens del usuario"
+-- ============================================================================
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_refresh_tokens_expires_at
+    ON refresh_tokens (expires_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_refresh_tokens_user_active
+    ON refresh_tokens (user_id)
+    WHERE NOT revoked;
+
+-- PASO 3: Purga inicial (la app luego purga sola cada
+-- REFRESH_TOKEN_PURGE_INTERVAL_MINUTES). En tablas muy grandes, mejor dejar
+-- que lo haga la app en batches o correr este DELETE varias veces con LIMIT.
+-- ============================================================================
+DELETE FROM refresh_tokens
+ WHERE expires_at < now()
+    OR (revoked AND created_at < now() - interval '24 hours');
+
+VACUUM (ANALYZE) refresh_tokens;
+
+-- PASO 4: Verificar (debe aparecer "Index Scan using idx_refresh_tokens_active_hash")
+-- ============================================================================
+-- EXPLAIN
+-- UPDATE refresh_tokens SET revoked = true
+--  WHERE token_hash = 'x' AND NOT revoked AND expires_at > now();
+
+-- ============================================================================
+-- Nota: ix_refresh_tokens_token_hash (completo) se mantiene: /auth/logout
+-- busca el token aunque ya esté revocado.
+-- ============================================================================
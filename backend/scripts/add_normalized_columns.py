@@ -40,6 +40,7 @@ if not os.path.exists(env_file):
 # Importar módulos
 try:
     from app.db import engine
+    from app.normalization import norm_sql_text
     from sqlalchemy import text
 except Exception as e:
     logger.error(f"❌ Error de configuración: {str(e)}")
@@ -98,7 +99,7 @@ def add_normalized_columns():
             ALTER TABLE apsa_protocols
             ADD COLUMN {col_name} {col_type}
             GENERATED ALWAYS AS (
-                UPPER(TRIM(REPLACE(REPLACE(REPLACE({original_col}, ' ', ''), '-', ''), '_', '')))
+                {norm_sql_text(original_col)}
             ) STORED
             """
 
@@ -139,7 +140,7 @@ def add_normalized_columns():
             ALTER TABLE aconex_docs
             ADD COLUMN {col_name} {col_type}
             GENERATED ALWAYS AS (
-                UPPER(TRIM(REPLACE(REPLACE(REPLACE({original_col}, ' ', ''), '-', ''), '_', '')))
+                {norm_sql_text(original_col)}
             ) STORED
             """
 
@@ -0,0 +1,86 @@
+"""
+Recalcula aconex_docs.is_latest (última revisión por documento) en cargas existentes.
+
+IMPORTANTE: Ejecutar desde el directorio backend, DESPUÉS de
+migrations/add_aconex_latest_revision.sql:
+  python scripts/backfill_aconex_latest.py
+
+Usa la misma regla que la ingesta (app.utils.latest_revision_flags), así que
+las cargas antiguas quedan igual que si se hubieran subido hoy.
+"""
+import sys
+import os
+
+# Asegurar que estamos en el directorio correcto
+script_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(script_dir)
+os.chdir(backend_dir)
+sys.path.insert(0, backend_dir)
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Importar módulos
+try:
+    import pandas as pd
+    from sqlalchemy import select, update, bindparam
+    from app.db import SessionLocal
+    from app.models.load import Load, SourceEnum
+    from app.models.aconex_doc import AconexDoc
+    from app.utils import latest_revision_flags
+except Exception as e:
+    logger.error(f"❌ Error de configuración: {str(e)}")
+    logger.error("💡 Ejecuta primero: python scripts/verify_connection.py")
+    sys.exit(1)
+
+
+def backfill_load(db, load_id: int) -> tuple[int, int]:
+    rows = db.execute(
+        select(AconexDoc.id, AconexDoc.document_no_norm, AconexDoc.revision, AconexDoc.date_received)
+        .where(AconexDoc.load_id == load_id)
+        .order_by(AconexDoc.id.asc())  # id = orden de inserción = posición en el archivo
+    ).all()
+    if not rows:
+        return 0, 0
+
+    received = pd.to_datetime(pd.Series([r[3] for r in rows]), errors="coerce", dayfirst=True, format="mixed")
+    received_ts = [None if pd.isna(d) else d.timestamp() for d in received]
+    flags = latest_revision_flags([r[1] for r in rows], [r[2] for r in rows], received_ts)
+
+    stmt = (
+        update(AconexDoc.__table__)
+        .where(AconexDoc.__table__.c.id == bindparam("row_id"))
+        .values(is_latest=bindparam("flag"))
+    )
+    params = [{"row_id": r[0], "flag": f} for r, f in zip(rows, flags)]
+    chunk_size = 1000
+    for i in range(0, len(params), chunk_size):
+        db.execute(stmt, params[i:i + chunk_size])
+    db.commit()
+    return len(rows), sum(flags)
+
+
+def main() -> bool:
+    db = SessionLocal()
+    try:
+        load_ids = db.execute(
+            select(Load.id).where(Load.source == SourceEnum.ACONEX).order_by(Load.id.asc())
+        ).scalars().all()
+        logger.info(f"📊 Cargas ACONEX a procesar: {len(load_ids)}")
+        for lid in load_ids:
+            total, latest = backfill_load(db, lid)
+            logger.info(f"  ✅ load {lid}: {latest:,} últimas revisiones de {total:,} filas")
+        return True
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except Exception as e:
+        logger.error(f"\n❌ Error fatal: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,139 @@
+"""
+Benchmark de compresión de respuestas: bytes ahorrados vs costo de CPU.
+
+Usa payloads sintéticos con la misma forma que las respuestas reales
+(no necesita BD):
+  - /apsa/list con page_size=500 (JSON)
+  - /metrics/subsistemas (JSON, ~400 subsistemas)
+  - /export/apsa.csv (CSV ';' con BOM, 20k filas)
+
+IMPORTANTE: Ejecutar desde el directorio backend:
+  python scripts/bench_compression.py
+  python scripts/bench_compression.py --csv-rows 200000 --runs 3
+
+Para cada encoding instalado (gzip siempre; zstd/br si están zstandard/brotli)
+y varios niveles reporta tamaño, ratio y ms de CPU (mediana). También mide el
+modo streaming (chunks de 64 KB con flush), que es como se comprimen los exports.
+"""
+import sys
+import os
+import argparse
+import json
+import random
+import statistics
+from time import process_time
+
+# Asegurar que estamos en el directorio correcto
+script_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(script_dir)
+os.chdir(backend_dir)
+sys.path.insert(0, backend_dir)
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Importar módulos
+try:
+    from app.compression import available_encodings, compress_bytes, make_coder
+except Exception as e:
+    logger.error(f"❌ Error de configuración: {str(e)}")
+    sys.exit(1)
+
+LEVELS = {"gzip": [1, 6, 9], "zstd": [1, 3, 9], "br": [1, 4, 9]}
+STREAM_CHUNK = 64 * 1024
+
+WORDS = ["PROTOCOLO", "TUBERIA", "SOLDADURA", "VALVULA", "BOMBA", "ESTRUCTURA", "HORMIGON",
+         "CABLE", "INSTRUMENTO", "TABLERO", "MOTOR", "PRUEBA", "HIDROSTATICA", "INSPECCION"]
+
+
+def _row(rnd: random.Random, i: int) -> dict:
+    subs = f"56{rnd.randint(10, 40)}-S{rnd.randint(1, 9):02d}-{rnd.randint(1, 30):03d}"
+    aconex = rnd.choice(["Cargado", "Cargado", "Error de SS", ""])
+    return {
+        "document_no": f"{subs[:4]}-{rnd.choice('ABCDEFGH')}{rnd.randint(10, 99)}-{i:07d}",
+        "rev": "0",
+        "descripcion": "PROTOCOLO — " + " ".join(rnd.choice(WORDS) for _ in range(5)),
+        "tag": f"TAG-{rnd.randint(0, 99999):05d}",
+        "subsistema": subs,
+        "aconex": aconex,
+        "status": rnd.choice(["ABIERTO", "CERRADO"]),
+    }
+
+
+def build_payloads(csv_rows: int) -> dict[str, bytes]:
+    rnd = random.Random(42)
+    page = {"rows": [_row(rnd, i) for i in range(500)], "total": 180_000, "page": 1, "page_size": 500}
+
+    subs = []
+    for i in range(400):
+        total = rnd.randint(20, 900)
+        cargados = rnd.randint(0, total)
+        subs.append({
+            "subsistema": f"56{10 + i // 12}-S{i % 9 + 1:02d}-{i:03d}",
+            "total": total, "cargados": cargados,
+            "errores_ss": rnd.randint(0, total - cargados),
+            "pct": round(cargados * 100 / total, 2),
+        })
+
+    lines = ["NÚMERO DE DOCUMENTO ACONEX;REV.;DESCRIPCIÓN;TAG;SUBSISTEMA;Aconex;Status"]
+    for i in range(csv_rows):
+        r = _row(rnd, i)
+        lines.append(";".join([r["document_no"], "0", r["descripcion"], r["tag"], r["subsistema"], r["aconex"], r["status"]]))
+
+    return {
+        "apsa_list_500.json": json.dumps(page, ensure_ascii=False).encode("utf-8"),
+        "metrics_subsistemas.json": json.dumps(subs, ensure_ascii=False).encode("utf-8"),
+        f"export_apsa_{csv_rows}.csv": ("\ufeff" + "\n".join(lines)).encode("utf-8"),
+    }
+
+
+def _cpu_ms(fn, runs: int) -> tuple[float, bytes]:
+    samples, out = [], b""
+    for _ in range(runs):
+        t0 = process_time()
+        out = fn()
+        samples.append((process_time() - t0) * 1000)
+    return statistics.median(samples), out
+
+
+def _streamed(encoding: str, level: int, data: bytes) -> bytes:
+    c = make_coder(encoding, level)
+    parts = [c.compress(data[i:i + STREAM_CHUNK], flush=True) for i in range(0, len(data), STREAM_CHUNK)]
+    parts.append(c.finish())
+    return b"".join(parts)
+
+
+def main() -> bool:
+    parser = argparse.ArgumentParser(description="Benchmark de compresión de respuestas")
+    parser.add_argument("--csv-rows", type=int, default=20_000)
+    parser.add_argument("--runs", type=int, default=5, help="Repeticiones por medición (se reporta la mediana)")
+    args = parser.parse_args()
+
+    encodings = list(available_encodings())
+    logger.info(f"🔧 Encodings disponibles: {', '.join(encodings)}")
+
+    for name, data in build_payloads(args.csv_rows).items():
+        logger.info("\n" + "=" * 80)
+        logger.info(f"📊 {name}: {len(data):,} bytes sin comprimir")
+        logger.info("=" * 80)
+        logger.info(f"  {'encoding':<10} {'nivel':>5} {'bytes':>12} {'ratio':>7} {'cpu ms':>9} {'stream bytes':>13} {'stream ms':>10}")
+        for enc in encodings:
+            for level in LEVELS[enc]:
+                ms, out = _cpu_ms(lambda: compress_bytes(enc, level, data), args.runs)
+                sms, sout = _cpu_ms(lambda: _streamed(enc, level, data), args.runs)
+                logger.info(
+                    f"  {enc:<10} {level:>5} {len(out):>12,} {len(data) / max(1, len(out)):>6.1f}x "
+                    f"{ms:>9.2f} {len(sout):>13,} {sms:>10.2f}"
+                )
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except Exception as e:
+        logger.error(f"\n❌ Error fatal: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
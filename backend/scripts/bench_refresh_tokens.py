@@ -0,0 +1,184 @@
+"""
+Benchmark de /auth/refresh con una tabla refresh_tokens grande.
+
+Crea tablas TEMPORALES `users` y `refresh_tokens` (en la sesión tapan a las
+reales, que no se tocan) con datos sintéticos y compara:
+  1. Rotación anterior: SELECT token + SELECT user + UPDATE + INSERT (4 round-trips)
+  2. Rotación nueva (app/refresh_tokens.ROTATE_SQL), solo índice completo
+  3. Rotación nueva + índice parcial (token_hash) WHERE NOT revoked
+  4. Purga en batches (app/refresh_tokens.purge) y rotación después de purgar
+
+IMPORTANTE: Ejecutar desde el directorio backend:
+  python scripts/bench_refresh_tokens.py                   # 1M tokens
+  python scripts/bench_refresh_tokens.py --rows 200000 --runs 200
+"""
+import sys
+import os
+import argparse
+import statistics
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+# Asegurar que estamos en el directorio correcto
+script_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(script_dir)
+os.chdir(backend_dir)
+sys.path.insert(0, backend_dir)
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Importar módulos
+try:
+    from sqlalchemy import text
+    from app.db import engine
+    from app.refresh_tokens import ROTATE_SQL, purge
+except Exception as e:
+    logger.error(f"❌ Error de configuración: {str(e)}")
+    logger.error("💡 Ejecuta primero: python scripts/verify_connection.py")
+    sys.exit(1)
+
+SETUP_SQL = [
+    """
+    CREATE TEMP TABLE users (
+        id        serial PRIMARY KEY,
+        email     varchar(255) NOT NULL,
+        full_name varchar(255),
+        roles     varchar(100) NOT NULL DEFAULT 'User',
+        is_active boolean NOT NULL DEFAULT true
+    )
+    """,
+    """
+    CREATE TEMP TABLE refresh_tokens (
+        id         serial PRIMARY KEY,
+        user_id    integer NOT NULL,
+        token_hash varchar(128) NOT NULL,
+        created_at timestamp NOT NULL DEFAULT now(),
+        expires_at timestamp NOT NULL,
+        revoked    boolean NOT NULL DEFAULT false,
+        parent_id  integer
+    )
+    """,
+]
+
+# ~10% vivos, ~60% revocados (cada refresh revoca uno), ~30% expirados
+FILL_SQL = [
+    "INSERT INTO users (email, full_name) SELECT 'u' || g || '@bench.local', 'Usuario ' || g FROM generate_series(1, :users) g",
+    """
+    INSERT INTO refresh_tokens (user_id, token_hash, created_at, expires_at, revoked)
+    SELECT 1 + g % :users,
+           encode(sha256(g::text::bytea), 'hex'),
+           now() - ((g % 30) || ' days')::interval - interval '2 days',
+           CASE WHEN g % 10 < 3 THEN now() - interval '1 day' ELSE now() + interval '14 days' END,
+           g % 10 BETWEEN 3 AND 8
+    FROM generate_series(1, :rows) g
+    """,
+    "CREATE INDEX ON refresh_tokens (token_hash)",
+    "ANALYZE users",
+    "ANALYZE refresh_tokens",
+]
+
+OLD_STEPS = [
+    "SELECT id, user_id FROM refresh_tokens WHERE token_hash = :old_hash AND NOT revoked AND expires_at > now()",
+    "SELECT id, email, full_name, roles, is_active FROM users WHERE id = :user_id",
+    "UPDATE refresh_tokens SET revoked = true WHERE id = :id",
+    "INSERT INTO refresh_tokens (user_id, token_hash, expires_at, revoked, parent_id) VALUES (:user_id, :new_hash, :expires_at, false, :id)",
+]
+
+
+def _active_hashes(conn, n: int) -> list[str]:
+    return conn.execute(text(
+        "SELECT token_hash FROM refresh_tokens WHERE NOT revoked AND expires_at > now() ORDER BY random() LIMIT :n"
+    ), {"n": n}).scalars().all()
+
+
+def rotate_old(conn, old_hash: str, new_hash: str, expires_at) -> None:
+    rt = conn.execute(text(OLD_STEPS[0]), {"old_hash": old_hash}).first()
+    conn.execute(text(OLD_STEPS[1]), {"user_id": rt.user_id}).first()
+    conn.execute(text(OLD_STEPS[2]), {"id": rt.id})
+    conn.execute(text(OLD_STEPS[3]), {"user_id": rt.user_id, "new_hash": new_hash, "expires_at": expires_at, "id": rt.id})
+    conn.commit()
+
+
+def rotate_new(conn, old_hash: str, new_hash: str, expires_at) -> None:
+    row = conn.execute(ROTATE_SQL, {"old_hash": old_hash, "new_hash": new_hash, "expires_at": expires_at}).first()
+    assert row is not None and row.user_id is not None
+    conn.commit()
+
+
+def timed(conn, fn, hashes: list[str], tag: str) -> dict:
+    expires_at = datetime.now(timezone.utc) + timedelta(days=14)
+    samples = []
+    for i, h in enumerate(hashes):
+        t0 = perf_counter()
+        fn(conn, h, f"{tag}-{i:08d}", expires_at)
+        samples.append((perf_counter() - t0) * 1000)
+    samples.sort()
+    return {
+        "p50": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1],
+    }
+
+
+def main() -> bool:
+    parser = argparse.ArgumentParser(description="Benchmark rotación/purga de refresh_tokens")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--runs", type=int, default=500, help="Rotaciones por variante")
+    args = parser.parse_args()
+
+    results = []
+    with engine.connect() as conn:
+        for ddl in SETUP_SQL:
+            conn.execute(text(ddl))
+        logger.info(f"⏳ Generando {args.rows:,} refresh tokens sintéticos...")
+        for sql in FILL_SQL:
+            conn.execute(text(sql), {"rows": args.rows, "users": args.users})
+        conn.commit()
+
+        hashes = _active_hashes(conn, args.runs * 4)
+        chunks = [hashes[i * args.runs:(i + 1) * args.runs] for i in range(4)]
+
+        results.append(("anterior (4 round-trips)", timed(conn, rotate_old, chunks[0], "old")))
+        results.append(("CTE, índice completo", timed(conn, rotate_new, chunks[1], "cte")))
+
+        conn.execute(text("CREATE INDEX ON refresh_tokens (token_hash) WHERE NOT revoked"))
+        conn.execute(text("CREATE INDEX ON refresh_tokens (expires_at)"))
+        conn.execute(text("ANALYZE refresh_tokens"))
+        conn.commit()
+        results.append(("CTE + índice parcial", timed(conn, rotate_new, chunks[2], "cte-partial")))
+
+        before = conn.execute(text("SELECT count(*) FROM refresh_tokens")).scalar()
+        purge_result = purge(conn, pause_seconds=0)
+        after = conn.execute(text("SELECT count(*) FROM refresh_tokens")).scalar()
+        conn.execute(text("ANALYZE refresh_tokens"))
+        conn.commit()
+        results.append(("CTE tras purga", timed(conn, rotate_new, chunks[3], "cte-purged")))
+
+        conn.execute(text("DROP TABLE IF EXISTS refresh_tokens"))
+        conn.execute(text("DROP TABLE IF EXISTS users"))
+        conn.commit()
+
+    logger.info("\n" + "=" * 80)
+    logger.info(f"📊 ROTACIÓN con {args.rows:,} tokens ({args.runs} rotaciones por variante)")
+    logger.info("=" * 80)
+    logger.info(f"  {'variante':<28} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for name, r in results:
+        logger.info(f"  {name:<28} {r['p50']:>9.2f} {r['p95']:>9.2f} {r['max']:>9.2f}")
+    logger.info(
+        f"\n🧹 Purga: {purge_result['deleted']:,} filas en {purge_result['batches']} batch(es), "
+        f"{purge_result['ms']:.0f} ms ({before:,} → {after:,} filas)"
+    )
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except Exception as e:
+        logger.error(f"\n❌ Error fatal: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
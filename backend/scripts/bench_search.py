@@ -0,0 +1,160 @@
+"""
+Benchmark de la búsqueda libre APSA: ILIKE sin índice vs trigramas vs full-text.
+
+Genera datos sintéticos en una tabla TEMPORAL (no toca apsa_protocols),
+así que se puede correr contra cualquier PostgreSQL con pg_trgm disponible.
+
+IMPORTANTE: Ejecutar desde el directorio backend:
+  python scripts/bench_search.py                       # 100k y 1M filas
+  python scripts/bench_search.py --rows 100000 --runs 5
+
+Mide, por tamaño:
+  1. ILIKE '%q%' sin índices (comportamiento anterior: Seq Scan)
+  2. ILIKE '%q%' con índices GIN trigram
+  3. Full-text (search_tsv @@ tsquery) rankeado
+  4. Autocompletado por prefijo (tsquery 'q:*')
+"""
+import sys
+import os
+import argparse
+import statistics
+from time import perf_counter
+
+# Asegurar que estamos en el directorio correcto
+script_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(script_dir)
+os.chdir(backend_dir)
+sys.path.insert(0, backend_dir)
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Importar módulos
+try:
+    from sqlalchemy import text
+    from app.db import engine
+    from app.models.apsa_protocol import SEARCH_TSV_SQL
+except Exception as e:
+    logger.error(f"❌ Error de configuración: {str(e)}")
+    logger.error("💡 Ejecuta primero: python scripts/verify_connection.py")
+    sys.exit(1)
+
+VOCAB = [
+    "PROTOCOLO", "TUBERIA", "SOLDADURA", "VALVULA", "BOMBA", "ESTRUCTURA", "HORMIGON",
+    "CABLE", "INSTRUMENTO", "TABLERO", "MOTOR", "ESTANQUE", "SOPORTE", "BRIDA", "PRUEBA",
+    "HIDROSTATICA", "TORQUE", "AISLACION", "MALLA", "TIERRA", "FUNDACION", "PERNOS",
+    "ALINEAMIENTO", "INSPECCION", "VISUAL", "CONCRETO", "ARMADURA", "MOLDAJE", "CHANCADOR",
+    "CORREA", "TRANSPORTADORA", "SENSOR", "TRANSMISOR", "BANDEJA", "ESCALERILLA",
+]
+
+SETUP_SQL = """
+CREATE TEMP TABLE bench_apsa (
+    id           serial PRIMARY KEY,
+    load_id      integer NOT NULL,
+    codigo_cmdic varchar(120),
+    descripcion  text,
+    tag          varchar(120),
+    search_tsv   tsvector GENERATED ALWAYS AS ({tsv}) STORED
+)
+"""
+
+FILL_SQL = """
+INSERT INTO bench_apsa (load_id, codigo_cmdic, descripcion, tag)
+SELECT 1,
+       (50 + g % 10)::text || lpad(((g / 10) % 100)::text, 2, '0') || '-'
+           || chr(65 + (g % 26)) || lpad((g % 97)::text, 2, '0') || '-' || lpad(g::text, 7, '0'),
+       (:vocab)[1 + (g * 7) % :n] || ' ' || (:vocab)[1 + (g * 13) % :n] || ' '
+           || (:vocab)[1 + (g * 31) % :n] || ' ' || (:vocab)[1 + (g * 3) % :n],
+       'TAG-' || lpad(((g * 7919) % 99999)::text, 5, '0')
+FROM generate_series(1, :rows) AS g
+"""
+
+TRGM_INDEXES = [
+    "CREATE INDEX ON bench_apsa USING gin (codigo_cmdic gin_trgm_ops)",
+    "CREATE INDEX ON bench_apsa USING gin (descripcion gin_trgm_ops)",
+    "CREATE INDEX ON bench_apsa USING gin (tag gin_trgm_ops)",
+    "CREATE INDEX ON bench_apsa USING gin (search_tsv)",
+]
+
+ILIKE_SQL = """
+SELECT id, codigo_cmdic FROM bench_apsa
+WHERE load_id = 1 AND (codigo_cmdic ILIKE :p OR descripcion ILIKE :p OR tag ILIKE :p)
+ORDER BY codigo_cmdic LIMIT 50
+"""
+
+FTS_SQL = """
+SELECT id, codigo_cmdic, ts_rank_cd(search_tsv, to_tsquery('simple', :q)) AS rank
+FROM bench_apsa
+WHERE load_id = 1 AND search_tsv @@ to_tsquery('simple', :q)
+ORDER BY rank DESC, codigo_cmdic LIMIT 50
+"""
+
+# Términos típicos de la pantalla Log Protocolos (raro, frecuente, código, tag)
+TERMS = ["hidrostatica", "bomba", "5620", "tag-0421"]
+
+
+def timed(conn, sql: str, params: dict, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        t0 = perf_counter()
+        conn.execute(text(sql), params).fetchall()
+        samples.append((perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def bench_size(rows: int, runs: int) -> list[tuple[str, str, float]]:
+    results = []
+    with engine.connect() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        conn.execute(text("DROP TABLE IF EXISTS bench_apsa"))
+        conn.execute(text(SETUP_SQL.format(tsv=SEARCH_TSV_SQL)))
+        logger.info(f"⏳ Generando {rows:,} filas sintéticas...")
+        conn.execute(text(FILL_SQL), {"vocab": VOCAB, "n": len(VOCAB), "rows": rows})
+        conn.execute(text("ANALYZE bench_apsa"))
+
+        for term in TERMS:
+            results.append(("ILIKE sin índice", term, timed(conn, ILIKE_SQL, {"p": f"%{term}%"}, runs)))
+
+        logger.info("⏳ Creando índices GIN (trigram + full-text)...")
+        for ddl in TRGM_INDEXES:
+            conn.execute(text(ddl))
+        conn.execute(text("ANALYZE bench_apsa"))
+
+        for term in TERMS:
+            results.append(("ILIKE + trigram", term, timed(conn, ILIKE_SQL, {"p": f"%{term}%"}, runs)))
+            words = " & ".join(w for w in term.replace("-", " ").split() if w)
+            results.append(("full-text rank", term, timed(conn, FTS_SQL, {"q": words}, runs)))
+            prefix = " & ".join(f"{w}:*" for w in term.replace("-", " ").split() if w)
+            results.append(("prefijo (suggest)", term, timed(conn, FTS_SQL, {"q": prefix}, runs)))
+
+        conn.execute(text("DROP TABLE IF EXISTS bench_apsa"))
+        conn.rollback()
+    return results
+
+
+def main() -> bool:
+    parser = argparse.ArgumentParser(description="Benchmark búsqueda APSA")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--runs", type=int, default=5, help="Repeticiones por consulta (se reporta la mediana)")
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        results = bench_size(rows, args.runs)
+        logger.info("\n" + "=" * 80)
+        logger.info(f"📊 RESULTADOS con {rows:,} filas (mediana de {args.runs} corridas)")
+        logger.info("=" * 80)
+        logger.info(f"  {'modo':<20} {'término':<14} {'ms':>10}")
+        for mode, term, ms in results:
+            logger.info(f"  {mode:<20} {term:<14} {ms:>10.2f}")
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except Exception as e:
+        logger.error(f"\n❌ Error fatal: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,196 @@
+"""
+Captura planes EXPLAIN antes/después de mover las comparaciones a las columnas *_norm.
+
+"Antes"   = normalización en runtime (REPLACE/UPPER/TRIM sobre cada fila)
+"Después" = columnas GENERATED codigo_cmdic_norm / document_no_norm / subsystem_code_norm
+            + última revisión ACONEX (is_latest) — lo que usan hoy los endpoints
+
+IMPORTANTE: Ejecutar desde el directorio backend:
+  python scripts/explain_normalized_queries.py                 # solo EXPLAIN
+  python scripts/explain_normalized_queries.py --analyze       # EXPLAIN ANALYZE (ejecuta las queries)
+  python scripts/explain_normalized_queries.py --json planes.json --check
+
+--check termina con código 1 si algún plan "después" hace Seq Scan sobre
+apsa_protocols / aconex_docs (útil en CI contra una BD con datos).
+"""
+import sys
+import os
+import json
+import argparse
+
+# Asegurar que estamos en el directorio correcto
+script_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(script_dir)
+os.chdir(backend_dir)
+sys.path.insert(0, backend_dir)
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Importar módulos
+try:
+    from sqlalchemy import select, func, distinct
+    from app.db import SessionLocal
+    from app.models.load import Load, SourceEnum
+    from app.models.apsa_protocol import ApsaProtocol
+    from app.models.aconex_doc import AconexDoc
+    from app.normalization import norm_sql as N
+    from app.explain import explain, plan_outline, seq_scanned_tables
+except Exception as e:
+    logger.error(f"❌ Error de configuración: {str(e)}")
+    logger.error("💡 Ejecuta primero: python scripts/verify_connection.py")
+    sys.exit(1)
+
+WATCHED_TABLES = {"apsa_protocols", "aconex_docs"}
+
+
+def latest_load_id(db, source: SourceEnum):
+    return db.execute(
+        select(Load.id).where(Load.source == source)
+        .order_by(Load.loaded_at.desc(), Load.id.desc()).limit(1)
+    ).scalar()
+
+
+def build_cases(apsa_id: int, aconex_id: int) -> list[tuple[str, object, object]]:
+    """(nombre, statement_antes, statement_después) por cada consulta migrada."""
+    cases = []
+
+    # /metrics/cards → documentos únicos
+    cases.append((
+        "metrics_cards.aconex_unicos",
+        select(func.count(func.distinct(N(AconexDoc.document_no)))).where(AconexDoc.load_id == aconex_id),
+        select(func.count(func.distinct(AconexDoc.document_no_norm))).where(
+            AconexDoc.load_id == aconex_id, AconexDoc.is_latest, AconexDoc.document_no_norm.isnot(None)
+        ),
+    ))
+
+    # /metrics/cards → válidos (match con APSA)
+    cases.append((
+        "metrics_cards.aconex_validos",
+        select(func.count(func.distinct(N(AconexDoc.document_no)))).where(
+            AconexDoc.load_id == aconex_id,
+            select(1).where(
+                ApsaProtocol.load_id == apsa_id,
+                N(ApsaProtocol.codigo_cmdic) == N(AconexDoc.document_no),
+            ).exists(),
+        ),
+        select(func.count(func.distinct(AconexDoc.document_no_norm))).where(
+            AconexDoc.load_id == aconex_id,
+            AconexDoc.is_latest,
+            AconexDoc.document_no_norm.isnot(None),
+            select(1).where(
+                ApsaProtocol.load_id == apsa_id,
+                ApsaProtocol.codigo_cmdic_norm == AconexDoc.document_no_norm,
+            ).exists(),
+        ),
+    ))
+
+    # /aconex/unmatched y /debug/aconex/unmatched
+    cases.append((
+        "aconex_unmatched.count",
+        select(func.count()).select_from(AconexDoc).where(
+            AconexDoc.load_id == aconex_id,
+            ~select(1).where(
+                ApsaProtocol.load_id == apsa_id,
+                N(ApsaProtocol.codigo_cmdic) == N(AconexDoc.document_no),
+            ).exists(),
+        ),
+        select(func.count()).select_from(AconexDoc).where(
+            AconexDoc.load_id == aconex_id,
+            AconexDoc.is_latest,
+            ~select(1).where(
+                ApsaProtocol.load_id == apsa_id,
+                ApsaProtocol.codigo_cmdic_norm == AconexDoc.document_no_norm,
+            ).exists(),
+        ),
+    ))
+
+    # /aconex/duplicates
+    old_key = N(AconexDoc.document_no)
+    cases.append((
+        "aconex_duplicates",
+        select(old_key, func.count()).where(
+            AconexDoc.load_id == aconex_id, func.length(func.trim(AconexDoc.document_no)) > 0
+        ).group_by(old_key).having(func.count() >= 2),
+        select(AconexDoc.document_no_norm, func.count()).where(
+            AconexDoc.load_id == aconex_id, AconexDoc.document_no_norm != ""
+        ).group_by(AconexDoc.document_no_norm).having(func.count() >= 2),
+    ))
+
+    # /export/aconex-ss-errors.csv
+    def ss_errors(code_a, code_b, ss_a, ss_b, *extra):
+        code_only = select(1).where(AconexDoc.load_id == aconex_id, *extra, code_a == code_b).exists()
+        code_ss = select(1).where(AconexDoc.load_id == aconex_id, *extra, code_a == code_b, ss_a == ss_b).exists()
+        return select(ApsaProtocol.codigo_cmdic).where(
+            ApsaProtocol.load_id == apsa_id, code_only, ~code_ss
+        )
+
+    cases.append((
+        "export_aconex_ss_errors",
+        ss_errors(N(AconexDoc.document_no), N(ApsaProtocol.codigo_cmdic),
+                  N(AconexDoc.subsystem_code), N(ApsaProtocol.subsistema)),
+        ss_errors(AconexDoc.document_no_norm, ApsaProtocol.codigo_cmdic_norm,
+                  AconexDoc.subsystem_code_norm, ApsaProtocol.subsistema_norm, AconexDoc.is_latest),
+    ))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN antes/después de columnas *_norm")
+    parser.add_argument("--analyze", action="store_true", help="Usar EXPLAIN ANALYZE (ejecuta las queries)")
+    parser.add_argument("--json", dest="json_path", help="Guardar los planes completos en este archivo")
+    parser.add_argument("--check", action="store_true", help="Falla si un plan 'después' hace Seq Scan en tablas grandes")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        apsa_id = latest_load_id(db, SourceEnum.APSA)
+        aconex_id = latest_load_id(db, SourceEnum.ACONEX)
+        if not apsa_id or not aconex_id:
+            logger.error("❌ Faltan cargas APSA o ACONEX para generar los planes")
+            return False
+
+        captured = {}
+        failures = []
+        for name, before, after in build_cases(apsa_id, aconex_id):
+            logger.info("=" * 80)
+            logger.info(f"📊 {name}")
+            plans = {}
+            for label, stmt in (("antes", before), ("despues", after)):
+                plan = explain(db, stmt, analyze=args.analyze, buffers=args.analyze)
+                plans[label] = plan
+                total = plan.get("Plan", {}).get("Total Cost")
+                logger.info(f"  [{label}] costo total estimado: {total}")
+                if args.analyze:
+                    logger.info(f"  [{label}] tiempo real: {plan.get('Execution Time')} ms")
+                for line in plan_outline(plan):
+                    logger.info(f"      {line}")
+            seq = seq_scanned_tables(plans["despues"]) & WATCHED_TABLES
+            if seq:
+                failures.append((name, sorted(seq)))
+                logger.warning(f"  ⚠️  'después' aún hace Seq Scan en: {sorted(seq)}")
+            captured[name] = plans
+            db.rollback()  # EXPLAIN ANALYZE no debe dejar nada abierto
+
+        if args.json_path:
+            with open(args.json_path, "w", encoding="utf-8") as fh:
+                json.dump({"apsa_load_id": apsa_id, "aconex_load_id": aconex_id, "plans": captured}, fh, indent=2)
+            logger.info(f"\n💾 Planes guardados en {args.json_path}")
+
+        if args.check and failures:
+            logger.error(f"\n❌ {len(failures)} consultas siguen con Seq Scan: {failures}")
+            return False
+        return True
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except Exception as e:
+        logger.error(f"\n❌ Error fatal: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,424 @@
+"""
+Generador de libros APSA / ACONEX sintéticos para pruebas de escala.
+
+No podemos compartir los Excel de producción, así que esto produce archivos
+con la misma forma que esperan /admin/upload/apsa y /admin/upload/aconex:
+
+  APSA    hoja "APSA": filas de banner antes del encabezado (lo detecta
+          find_header_row_for_apsa), columnas en las mismas letras que el
+          original (E código, G tipo, I descripción, N subsistema, W tag,
+          Z disciplina, AA status)
+  ACONEX  hoja "Cargados ACONEX": encabezado en la fila 1, varias revisiones
+          por documento (en orden aleatorio), "Subsystem N°" como
+          "5620-S01-003 - DESCRIPCIÓN"
+
+Subsistemas con el formato de SUBSYSTEM_REGEX y disciplinas 50–59 con una
+distribución sesgada como la real. Ratios ajustables:
+
+  --unmatched-ratio    protocolos APSA sin documento en ACONEX
+  --ss-mismatch-ratio  protocolos con documento pero con otro subsistema en
+                       la última revisión (los "Error de SS")
+  --duplicate-ratio    documentos ACONEX con más de una revisión (en parte con
+                       un subsistema distinto en revisiones viejas)
+  --noise-ratio        N° de documento con otros separadores ("5620 S01_003"):
+                       calzan normalizados pero no en modo strict
+
+Los defaults reproducen la escala del "Error de SS" de /metrics/cards que
+documenta OPTIMIZATION_STATUS.md (>15 min con EXISTS / NOT EXISTS
+normalizando en runtime): 100k protocolos (el tramo ">100k" de
+SOLUCION_ERROR_SS.md) → ~151k filas ACONEX (seed 42), 15% con error de SS y
+30% de documentos con revisiones. Con la consulta antigua cada protocolo sin
+match o con error de SS recorre todo aconex_docs: del orden de 10^10
+comparaciones normalizadas (estimado; minutos, no segundos). Con las
+columnas *_norm la misma carga debe responder en segundos.
+
+Con --db inserta directo (COPY) dos cargas nuevas en loads / apsa_protocols
+/ aconex_docs, con is_latest ya calculado. Excel admite 1.048.576 filas por
+hoja: sobre eso solo se puede usar --db.
+
+--db no pasa por /admin/upload/*, así que no corre _on_load_published: un
+servidor que ya esté arriba no invalida nada. Se corrige solo (el cache de
+totales y los artefactos se direccionan por load_id; el índice de /apsa/list
+se reconstruye en el primer request), pero el primer listado va por SQL, la
+primera descarga se genera en vivo y las métricas de ingesta no cuentan la
+carga. Con --notify URL (y un JWT Admin en QUALITY_ADMIN_TOKEN o --token) el
+script llama al terminar a /admin/exports/artifacts/render (disco compartido:
+sirve para todos los workers) y /admin/apsa-index/rebuild (solo el worker
+que atiende; los demás lo arman en su primer /apsa/list).
+
+IMPORTANTE: Ejecutar desde el directorio backend:
+  python scripts/generate_synthetic_data.py                              # 100k → <tmp>/quality_synthetic/*.xlsx
+  python scripts/generate_synthetic_data.py --rows 500000 --out /tmp/scale
+  python scripts/generate_synthetic_data.py --rows 2000000 --db --notify http://localhost:8000
+"""
+import sys
+import os
+import argparse
+import random
+import string
+import tempfile
+from datetime import date, timedelta
+from time import perf_counter
+
+# Asegurar que estamos en el directorio correcto
+script_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(script_dir)
+os.chdir(backend_dir)
+sys.path.insert(0, backend_dir)
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Importar módulos
+try:
+    from openpyxl import Workbook
+    from app.utils import (
+        SUBSYSTEM_REGEX, extract_subsystem_code, discipline_from_subsystem, normalize_disc_code, revision_sort_key,
+    )
+except Exception as e:
+    logger.error(f"❌ Error de configuración: {str(e)}")
+    logger.error("💡 Instala las dependencias: pip install -r requirements.txt")
+    sys.exit(1)
+
+XLSX_MAX_ROWS = 1_048_576
+
+# Peso relativo de cada disciplina (50–59); 53/55/52 concentran la mayoría, como en obra
+DISCIPLINE_WEIGHTS = {50: 3, 51: 5, 52: 14, 53: 20, 54: 11, 55: 17, 56: 12, 57: 8, 58: 6, 59: 4}
+DISCIPLINE_NAMES = {
+    50: "GENERAL", 51: "MOVIMIENTO DE TIERRAS", 52: "HORMIGONES", 53: "ESTRUCTURAS",
+    54: "ARQUITECTURA", 55: "MECÁNICA", 56: "PIPING", 57: "ELÉCTRICA",
+    58: "INSTRUMENTACIÓN", 59: "TELECOMUNICACIONES",
+}
+TIPOS = [
+    "PROTOCOLO DE INSPECCIÓN VISUAL", "PROTOCOLO DE TORQUE", "PRUEBA HIDROSTÁTICA",
+    "PROTOCOLO DE ALINEAMIENTO", "PROTOCOLO DE SOLDADURA", "PRUEBA DE AISLACIÓN",
+    "PROTOCOLO DE HORMIGONADO", "PROTOCOLO DE MONTAJE", "PRUEBA DE CONTINUIDAD",
+    "PROTOCOLO DE CALIBRACIÓN",
+]
+VOCAB = [
+    "TUBERIA", "VALVULA", "BOMBA", "ESTRUCTURA", "CABLE", "INSTRUMENTO", "TABLERO", "MOTOR",
+    "ESTANQUE", "SOPORTE", "BRIDA", "MALLA", "TIERRA", "FUNDACION", "PERNOS", "CHANCADOR",
+    "CORREA", "TRANSPORTADORA", "SENSOR", "TRANSMISOR", "BANDEJA", "ESCALERILLA", "CONCRETO",
+    "ARMADURA", "MOLDAJE", "CUBIERTA", "COLECTOR", "CICLON", "ESPESADOR", "CELDA",
+]
+AREAS = ["PLANTA CONCENTRADORA", "ESPESADORES", "FILTRADO", "CHANCADO PRIMARIO", "MOLIENDA", "FLOTACIÓN"]
+STATUSES = [("CERRADO", 58), ("ABIERTO", 37), ("ANULADO", 2), ("", 3)]   # "" → NAN en la ingesta
+REVISIONS = ["A", "B", "C", "0", "1", "2", "3"]
+
+APSA_BANNER = [
+    ["PROYECTO SINTÉTICO — CONTROL DE CALIDAD"],
+    ["LISTADO APSA DE PROTOCOLOS"],
+    ["Generado por scripts/generate_synthetic_data.py"],
+    [],
+]
+# (letra, encabezado) en las posiciones del archivo original; el resto son columnas de relleno
+APSA_COLUMNS = {
+    "A": "ITEM", "B": "ÁREA", "C": "CONTRATO", "D": "EMPRESA",
+    "E": "N° CÓDIGO CMDIC", "F": "REV", "G": "TIPO PROTOCOLO", "H": "ESPECIALIDAD",
+    "I": "DESCRIPCIÓN DE ELEMENTOS", "J": "PLANO", "K": "FECHA EMISIÓN", "L": "SISTEMA",
+    "M": "SUBSISTEMA DESCRIPCIÓN", "N": "SUBSISTEMA", "O": "OBSERVACIONES",
+    "W": "TAG", "Z": "DISCIPLINA", "AA": "STATUS BIM 360 FIELD",
+}
+ACONEX_HEADER = [
+    "Document No", "Title", "Revision", "Date Received", "Transmitted", "Discipline",
+    "File Name", "Function", "System N°", "Equipment/Tag N°", "Status", "Subsystem N°",
+]
+
+
+def _col_index(letter: str) -> int:
+    n = 0
+    for ch in letter:
+        n = n * 26 + (ord(ch) - 64)
+    return n - 1
+
+
+APSA_WIDTH = max(_col_index(c) for c in APSA_COLUMNS) + 1
+APSA_HEADER = [""] * APSA_WIDTH
+for _letter, _name in APSA_COLUMNS.items():
+    APSA_HEADER[_col_index(_letter)] = _name
+
+
+class Subsystem:
+    __slots__ = ("code", "discipline", "name", "system")
+
+    def __init__(self, code: str, discipline: int, name: str, system: str):
+        self.code, self.discipline, self.name, self.system = code, discipline, name, system
+
+
+def build_subsystems(rng: random.Random, n: int) -> list[Subsystem]:
+    """Códigos DDAA-XNN-SSS (SUBSYSTEM_REGEX); los dos primeros dígitos son la disciplina."""
+    disciplines = list(DISCIPLINE_WEIGHTS)
+    weights = list(DISCIPLINE_WEIGHTS.values())
+    out, seen = [], set()
+    while len(out) < n:
+        disc = rng.choices(disciplines, weights)[0]
+        area = rng.randint(10, 40)
+        mid = rng.choice(string.ascii_uppercase) + "".join(rng.choices(string.digits + string.ascii_uppercase, k=rng.choice((1, 2))))
+        code = f"{disc}{area:02d}-{mid}-{rng.randint(1, 999):03d}"
+        if code in seen:
+            continue
+        assert SUBSYSTEM_REGEX.fullmatch(code) and extract_subsystem_code(f"{code} - X") == code
+        seen.add(code)
+        name = f"{rng.choice(VOCAB)} {rng.choice(AREAS)}"
+        out.append(Subsystem(code, disc, name, f"{disc}{area:02d}"))
+    return out
+
+
+def _noisy(code: str, rng: random.Random) -> str:
+    # mismo código normalizado (sin espacios/guiones/underscores), distinto en modo strict
+    return "".join(rng.choice((" ", "_", "")) if ch == "-" else ch for ch in code)
+
+
+def generate(args):
+    """
+    Genera ("apsa", fila) y ("aconex", fila, is_latest) en un solo recorrido determinista
+    (mismo --seed → mismos datos, para poder recorrerlo una vez por tabla con --db).
+    """
+    rng = random.Random(args.seed)
+    subsystems = build_subsystems(rng, max(10, args.rows // args.protocols_per_subsystem))
+    by_discipline: dict[int, list[Subsystem]] = {}
+    for s in subsystems:
+        by_discipline.setdefault(s.discipline, []).append(s)
+    status_values = [s for s, _ in STATUSES]
+    status_weights = [w for _, w in STATUSES]
+    base_day = date(2023, 1, 1)
+
+    def aconex_doc(doc_no: str, sub: Subsystem, tag: str, title: str, n_revs: int, old_sub: Subsystem | None):
+        revs = sorted(rng.sample(REVISIONS, n_revs), key=revision_sort_key)
+        day = base_day + timedelta(days=rng.randint(0, 600))
+        rows = []
+        for k, rev in enumerate(revs):
+            latest = k == len(revs) - 1
+            s = sub if latest or old_sub is None else old_sub
+            day += timedelta(days=rng.randint(1, 40))
+            # separadores distintos por revisión: duplicado normalizado pero no en modo strict
+            no = _noisy(doc_no, rng) if rng.random() < args.noise_ratio else doc_no
+            rows.append(([
+                no, title, rev, day.strftime("%d/%m/%Y"), f"TRN-{rng.randint(1, 99999):05d}",
+                "" if rng.random() < 0.1 else f"{s.discipline} - {DISCIPLINE_NAMES[s.discipline]}",
+                f"{no}_{rev}.pdf", f"{s.discipline} - {DISCIPLINE_NAMES[s.discipline]}", s.system,
+                tag, "Aprobado" if latest else "Reemplazado", f"{s.code} - {s.name}",
+            ], latest))
+        rng.shuffle(rows)  # la ingesta decide la última revisión por revisión/fecha, no por posición
+        return rows
+
+    for i in range(1, args.rows + 1):
+        sub = rng.choice(subsystems)
+        tipo = rng.choice(TIPOS)
+        codigo = f"{sub.code}-P{i:07d}"
+        tag = f"{sub.system}-{rng.choice(string.ascii_uppercase)}{rng.choice(string.ascii_uppercase)}-{rng.randint(1, 9999):04d}"
+        desc = " ".join(rng.choices(VOCAB, k=rng.randint(2, 5)))
+        status = rng.choices(status_values, status_weights)[0]
+        # disciplina: a veces vacía (la ingesta la deriva del subsistema) o como "56,0"
+        r = rng.random()
+        disc = "" if r < 0.03 else (f"{sub.discipline},0" if r < 0.05 else sub.discipline)
+
+        row = [""] * APSA_WIDTH
+        row[0] = i
+        row[1] = rng.choice(AREAS)
+        row[2] = f"CT-{sub.system}"
+        row[3] = "CONTRATISTA SINTÉTICO"
+        row[4] = codigo
+        row[5] = rng.choice(REVISIONS)
+        row[6] = tipo
+        row[7] = DISCIPLINE_NAMES[sub.discipline]
+        row[8] = desc
+        row[9] = f"PL-{sub.code}-{rng.randint(1, 99):02d}"
+        row[10] = (base_day + timedelta(days=rng.randint(0, 700))).strftime("%d/%m/%Y")
+        row[11] = sub.system
+        row[12] = sub.name
+        row[13] = sub.code
+        row[_col_index("W")] = tag
+        row[_col_index("Z")] = disc
+        row[_col_index("AA")] = status
+        yield ("apsa", row)
+
+        if rng.random() < args.unmatched_ratio:
+            continue
+        doc_sub = sub
+        if rng.random() < args.ss_mismatch_ratio:
+            # otro subsistema, de preferencia de la misma disciplina (el error típico)
+            peers = by_discipline[sub.discipline]
+            pool = peers if len(peers) > 1 else subsystems
+            while doc_sub is sub:
+                doc_sub = rng.choice(pool)
+        n_revs = rng.randint(2, 4) if rng.random() < args.duplicate_ratio else 1
+        old_sub = rng.choice(subsystems) if n_revs > 1 and rng.random() < 0.3 else None
+        for aconex_row, latest in aconex_doc(codigo, doc_sub, tag, f"{tipo} {desc}", n_revs, old_sub):
+            yield ("aconex", aconex_row, latest)
+
+        # documentos ACONEX que no corresponden a ningún protocolo APSA
+        if rng.random() < args.aconex_only_ratio:
+            other = rng.choice(subsystems)
+            for aconex_row, latest in aconex_doc(f"{other.code}-D{i:07d}", other, "", "DOCUMENTO SIN PROTOCOLO", 1, None):
+                yield ("aconex", aconex_row, latest)
+
+
+# --- salida xlsx ---
+def write_xlsx(args) -> dict:
+    os.makedirs(args.out, exist_ok=True)
+    apsa_path = os.path.join(args.out, f"APSA_sintetico_{args.rows}.xlsx")
+    aconex_path = os.path.join(args.out, f"ACONEX_sintetico_{args.rows}.xlsx")
+
+    apsa_wb, aconex_wb = Workbook(write_only=True), Workbook(write_only=True)
+    apsa_ws = apsa_wb.create_sheet("APSA")
+    aconex_ws = aconex_wb.create_sheet("Cargados ACONEX")
+    for banner in APSA_BANNER:
+        apsa_ws.append(banner)
+    apsa_ws.append(APSA_HEADER)
+    aconex_ws.append(ACONEX_HEADER)
+
+    counts = {"apsa": 0, "aconex": 0}
+    for event in generate(args):
+        if event[0] == "apsa":
+            apsa_ws.append(event[1])
+        else:
+            aconex_ws.append(event[1])
+            if counts["aconex"] + 2 > XLSX_MAX_ROWS:
+                raise ValueError(f"ACONEX supera {XLSX_MAX_ROWS:,} filas (límite de Excel); usa menos --rows o --db")
+        counts[event[0]] += 1
+        if event[0] == "apsa" and counts["apsa"] % 100_000 == 0:
+            logger.info(f"   ... {counts['apsa']:,} protocolos")
+
+    logger.info("💾 Guardando libros (openpyxl comprime al cerrar)...")
+    apsa_wb.save(apsa_path)
+    aconex_wb.save(aconex_path)
+    return {**counts, "files": [apsa_path, aconex_path]}
+
+
+# --- salida BD ---
+APSA_COPY = "COPY apsa_protocols (load_id, codigo_cmdic, tipo, descripcion, tag, subsistema, disciplina, status_bim360) FROM STDIN"
+ACONEX_COPY = (
+    "COPY aconex_docs (load_id, document_no, title, discipline, function, subsystem_text, subsystem_code, "
+    "system_no, file_name, equipment_tag_no, date_received, revision, transmitted, is_latest) FROM STDIN"
+)
+
+
+def _apsa_record(row) -> tuple:
+    # mismas transformaciones que /admin/upload/apsa
+    disc = normalize_disc_code(row[_col_index("Z")]) or discipline_from_subsystem(row[13])
+    status = str(row[_col_index("AA")] or "NAN").upper()
+    return (row[4], row[6], row[8], row[_col_index("W")], row[13], disc, status)
+
+
+def _aconex_record(row, latest: bool) -> tuple:
+    disc = normalize_disc_code(row[5] or row[7])
+    return (row[0], row[1], disc, row[7], row[11], extract_subsystem_code(row[11]) or "",
+            row[8], row[6], row[9], row[3], row[2], row[4], latest)
+
+
+def seed_db(args) -> dict:
+    try:
+        from sqlalchemy import text
+        from app.db import engine
+    except Exception as e:
+        logger.error(f"❌ Error de configuración: {str(e)}")
+        logger.error("💡 Ejecuta primero: python scripts/verify_connection.py")
+        raise
+
+    counts = {}
+    with engine.connect() as conn:
+        # cargas + COPY en una sola transacción, como el upload (_store_load): otro
+        # worker nunca ve una carga nueva a medio llenar
+        load_ids = {}
+        for source in ("APSA", "ACONEX"):
+            load_ids[source] = conn.execute(
+                text("INSERT INTO loads (source, filename, file_hash) VALUES (:s, :f, NULL) RETURNING id"),
+                {"s": source, "f": f"{source}_sintetico_{args.rows}_seed{args.seed}.xlsx"},
+            ).scalar()
+
+        raw = conn.connection.driver_connection   # psycopg 3: COPY nativo
+        for source, sql, kind in (("APSA", APSA_COPY, "apsa"), ("ACONEX", ACONEX_COPY, "aconex")):
+            t0 = perf_counter()
+            n = 0
+            load_id = load_ids[source]
+            with raw.cursor() as cur, cur.copy(sql) as copy:
+                for event in generate(args):   # mismo seed → mismos datos en cada recorrido
+                    if event[0] != kind:
+                        continue
+                    record = _apsa_record(event[1]) if kind == "apsa" else _aconex_record(event[1], event[2])
+                    copy.write_row((load_id, *record))
+                    n += 1
+            counts[kind] = n
+            logger.info(f"   {source}: {n:,} filas en {perf_counter() - t0:.1f}s (load_id={load_id})")
+        conn.commit()
+
+        conn.execute(text("ANALYZE apsa_protocols"))
+        conn.execute(text("ANALYZE aconex_docs"))
+        conn.commit()
+    return {**counts, "load_ids": load_ids}
+
+
+def notify_api(base_url: str, token: str) -> None:
+    """Lo que haría _on_load_published en el servidor: artefactos (todos los workers) e índice (el que atienda)."""
+    import requests
+
+    headers = {"Authorization": f"Bearer {token}"}
+    for path in ("/admin/exports/artifacts/render", "/admin/apsa-index/rebuild"):
+        try:
+            r = requests.post(base_url.rstrip("/") + path, headers=headers, timeout=30)
+            r.raise_for_status()
+            logger.info(f"   🔔 {path}: {r.json()}")
+        except Exception as e:
+            logger.warning(f"   ⚠️ {path}: {e}")
+
+
+def main() -> bool:
+    parser = argparse.ArgumentParser(description="Genera libros APSA/ACONEX sintéticos (o los carga en la BD)")
+    parser.add_argument("--rows", type=int, default=100_000, help="Protocolos APSA (10k a 2M)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "quality_synthetic"),
+                        help="Directorio de salida de los .xlsx")
+    parser.add_argument("--db", action="store_true", help="Insertar directo en la BD (COPY) en vez de escribir .xlsx")
+    parser.add_argument("--protocols-per-subsystem", type=int, default=40)
+    parser.add_argument("--unmatched-ratio", type=float, default=0.08)
+    parser.add_argument("--ss-mismatch-ratio", type=float, default=0.15)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.30)
+    parser.add_argument("--noise-ratio", type=float, default=0.03)
+    parser.add_argument("--aconex-only-ratio", type=float, default=0.04)
+    parser.add_argument("--notify", metavar="URL", help="Con --db: API a avisar al terminar (p.ej. http://localhost:8000)")
+    parser.add_argument("--token", default=os.environ.get("QUALITY_ADMIN_TOKEN"), help="JWT Admin para --notify")
+    args = parser.parse_args()
+
+    if args.notify and not (args.db and args.token):
+        logger.error("❌ --notify requiere --db y un JWT Admin (--token o QUALITY_ADMIN_TOKEN)")
+        return False
+    if not 1 <= args.rows <= 5_000_000:
+        logger.error("❌ --rows fuera de rango (1 a 5.000.000)")
+        return False
+    if not args.db and args.rows + len(APSA_BANNER) + 1 > XLSX_MAX_ROWS:
+        logger.error(f"❌ {args.rows:,} filas no caben en una hoja de Excel ({XLSX_MAX_ROWS:,}); usa --db")
+        return False
+
+    logger.info("=" * 80)
+    logger.info(f"🧪 DATOS SINTÉTICOS: {args.rows:,} protocolos APSA (seed {args.seed})")
+    logger.info(
+        f"   sin match {args.unmatched_ratio:.0%} · error SS {args.ss_mismatch_ratio:.0%} · "
+        f"con revisiones {args.duplicate_ratio:.0%} · separadores distintos {args.noise_ratio:.0%}"
+    )
+    logger.info("=" * 80)
+
+    t0 = perf_counter()
+    result = seed_db(args) if args.db else write_xlsx(args)
+
+    logger.info(f"\n✅ APSA: {result['apsa']:,} filas · ACONEX: {result['aconex']:,} filas ({perf_counter() - t0:.1f}s)")
+    for path in result.get("files", []):
+        logger.info(f"   📄 {path} ({os.path.getsize(path) / 1_048_576:.1f} MB)")
+    if args.db:
+        logger.info(f"   🗄️  load_ids: {result['load_ids']} (las cargas vigentes pasan a ser estas)")
+        if args.notify:
+            notify_api(args.notify, args.token)
+        else:
+            logger.info("   💡 Un servidor ya levantado no se entera de estas cargas hasta el primer request (ver --notify)")
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except Exception as e:
+        logger.error(f"\n❌ Error fatal: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
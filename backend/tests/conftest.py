@@ -0,0 +1,9 @@
+import os
+import sys
+
+# los tests importan `app` como lo hace uvicorn desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings exige credenciales de BD; los tests no se conectan (el engine es lazy)
+for _var in ("DB_USER", "DB_PASSWORD", "DB_NAME"):
+    os.environ.setdefault(_var, "test")
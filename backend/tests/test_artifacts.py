@@ -0,0 +1,67 @@
+"""
+artifacts: re-render forzado de la publicación y _prune() frente a renders
+en curso de otro proceso (sin BD: el render de prueba escribe un archivo).
+"""
+import fcntl
+import os
+
+import pytest
+
+from app import artifacts
+from app.models.load import SourceEnum
+
+IDS_OLD = {SourceEnum.APSA: 1, SourceEnum.ACONEX: 2}
+IDS_NEW = {SourceEnum.APSA: 3, SourceEnum.ACONEX: 2}
+
+
+@pytest.fixture
+def spec(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "cache_dir", lambda: str(tmp_path))
+    calls = []
+
+    def render(db, load_ids, dest):
+        calls.append(load_ids[SourceEnum.APSA])
+        with open(dest, "w") as f:
+            f.write(f"render {len(calls)}\n")
+        return len(calls)
+
+    return artifacts.ArtifactSpec("test.csv", (SourceEnum.APSA,), "text/csv", "test.csv", render), calls
+
+
+def test_forced_render_overwrites_existing_address(spec):
+    spec, calls = spec
+    address = artifacts._render_one(None, spec, IDS_OLD)
+    first = artifacts._read_meta(address)
+    assert artifacts._render_one(None, spec, IDS_OLD) == address
+    assert len(calls) == 1   # ya existía: no se re-genera
+
+    artifacts._render_one(None, spec, IDS_OLD, force=True)
+    second = artifacts._read_meta(address)
+    assert len(calls) == 2
+    assert second["rows"] == 2 and second["etag"] != first["etag"]
+    with open(second["path"]) as f:
+        assert f.read() == "render 2\n"
+
+
+def test_prune_keeps_locks_and_busy_addresses(spec, tmp_path):
+    spec, _ = spec
+    old = artifacts._render_one(None, spec, IDS_OLD)
+    new = artifacts._render_one(None, spec, IDS_NEW)
+    busy = "f" * 64
+    for name in (f"{busy}.json", f"{busy}.abc.csv"):
+        (tmp_path / name).write_text("{}")
+
+    fd = os.open(tmp_path / f"{busy}.lock", os.O_RDWR | os.O_CREAT)
+    fcntl.flock(fd, fcntl.LOCK_EX)   # render en curso en "otro proceso"
+    try:
+        artifacts._prune({new})
+    finally:
+        os.close(fd)
+
+    left = set(os.listdir(tmp_path))
+    assert f"{old}.json" not in left and f"{old}.lock" in left
+    assert artifacts._read_meta(new) is not None
+    assert {f"{busy}.json", f"{busy}.abc.csv", f"{busy}.lock"} <= left
+
+    artifacts._prune({new})   # lock liberado: ahora sí se borra
+    assert f"{busy}.json" not in set(os.listdir(tmp_path))
@@ -0,0 +1,112 @@
+"""
+auto_explain.analyze_plan() contra el plan del "Error de SS" de /metrics/cards.
+
+BAD_PLAN tiene la forma del EXPLAIN (ANALYZE, FORMAT JSON) de la consulta
+que OPTIMIZATION_STATUS.md documenta como >15 min (EXISTS / NOT EXISTS con la
+normalización en runtime, antes de las columnas *_norm):
+
+    SELECT count(*) FROM apsa_protocols ap
+    WHERE ap.load_id = 12
+      AND EXISTS (SELECT 1 FROM aconex_docs acx
+                  WHERE acx.load_id = 13 AND N(acx.document_no) = N(ap.codigo_cmdic))
+      AND NOT EXISTS (SELECT 1 FROM aconex_docs acx
+                      WHERE acx.load_id = 13 AND N(acx.document_no) = N(ap.codigo_cmdic)
+                        AND N(acx.subsystem_code) = N(ap.subsistema))
+
+Como N(...) no es indexable, el lado interno de cada join es un Seq Scan de
+aconex_docs repetido por cada fila de APSA. GOOD_PLAN es la misma consulta
+sobre *_norm con idx_aconex_latest_doc_norm.
+"""
+from app.auto_explain import analyze_plan
+
+WATCH = {"apsa_protocols", "aconex_docs"}
+N_DOC = "upper(btrim(replace(replace(replace((acx.document_no)::text, ' ', ''), '-', ''), '_', '')))"
+N_COD = "upper(btrim(replace(replace(replace((ap.codigo_cmdic)::text, ' ', ''), '-', ''), '_', '')))"
+
+
+def _seq_scan(relation: str, alias: str, rows: int, loops: int, removed: int) -> dict:
+    return {
+        "Node Type": "Seq Scan", "Parent Relationship": "Inner", "Relation Name": relation, "Alias": alias,
+        "Filter": f"({alias}.load_id = {13 if relation == 'aconex_docs' else 12})",
+        "Actual Rows": rows, "Actual Loops": loops, "Rows Removed by Filter": removed,
+    }
+
+
+BAD_PLAN = {
+    "Node Type": "Aggregate", "Strategy": "Plain", "Actual Rows": 1, "Actual Loops": 1,
+    "Plans": [{
+        "Node Type": "Nested Loop", "Parent Relationship": "Outer", "Join Type": "Anti",
+        "Join Filter": f"(({N_DOC} = {N_COD}) AND (...subsystem_code... = ...subsistema...))",
+        "Rows Removed by Join Filter": 1_902_114_880, "Actual Rows": 2_314, "Actual Loops": 1,
+        "Plans": [
+            {
+                "Node Type": "Nested Loop", "Parent Relationship": "Outer", "Join Type": "Semi",
+                "Join Filter": f"({N_DOC} = {N_COD})",
+                "Rows Removed by Join Filter": 1_288_407_551, "Actual Rows": 38_977, "Actual Loops": 1,
+                "Plans": [
+                    {**_seq_scan("apsa_protocols", "ap", 61_240, 1, 58_003), "Parent Relationship": "Outer"},
+                    _seq_scan("aconex_docs", "acx", 21_034, 61_240, 41_880),
+                ],
+            },
+            _seq_scan("aconex_docs", "acx_1", 48_802, 38_977, 41_880),
+        ],
+    }],
+}
+
+GOOD_PLAN = {
+    "Node Type": "Aggregate", "Strategy": "Plain", "Actual Rows": 1, "Actual Loops": 1,
+    "Plans": [{
+        "Node Type": "Hash Join", "Parent Relationship": "Outer", "Join Type": "Anti",
+        "Hash Cond": "((ap.codigo_cmdic_norm = acx_1.document_no_norm) AND (ap.subsistema_norm = acx_1.subsystem_code_norm))",
+        "Actual Rows": 2_314, "Actual Loops": 1,
+        "Plans": [
+            {
+                "Node Type": "Nested Loop", "Parent Relationship": "Outer", "Join Type": "Semi",
+                "Actual Rows": 38_977, "Actual Loops": 1,
+                "Plans": [
+                    {"Node Type": "Bitmap Heap Scan", "Parent Relationship": "Outer", "Relation Name": "apsa_protocols",
+                     "Alias": "ap", "Recheck Cond": "(ap.load_id = 12)", "Actual Rows": 61_240, "Actual Loops": 1},
+                    {"Node Type": "Index Only Scan", "Parent Relationship": "Inner", "Index Name": "idx_aconex_latest_doc_norm",
+                     "Relation Name": "aconex_docs", "Alias": "acx",
+                     "Index Cond": "((acx.load_id = 13) AND (acx.document_no_norm = ap.codigo_cmdic_norm))",
+                     "Actual Rows": 1, "Actual Loops": 61_240},
+                ],
+            },
+            {
+                "Node Type": "Hash", "Parent Relationship": "Inner", "Actual Rows": 48_802, "Actual Loops": 1,
+                "Plans": [{"Node Type": "Index Only Scan", "Parent Relationship": "Outer",
+                           "Index Name": "idx_aconex_latest_doc_norm", "Relation Name": "aconex_docs", "Alias": "acx_1",
+                           "Index Cond": "(acx_1.load_id = 13)", "Actual Rows": 48_802, "Actual Loops": 1}],
+            },
+        ],
+    }],
+}
+
+
+def test_error_ss_bad_plan_is_flagged():
+    flags = analyze_plan(BAD_PLAN, WATCH)
+    assert "Nested Loop Anti Join (38,977 loops del lado interno, 1,902,114,880 filas descartadas por Join Filter)" in flags
+    assert "Nested Loop Semi Join (61,240 loops del lado interno, 1,288,407,551 filas descartadas por Join Filter)" in flags
+    # Actual Rows es por loop: el total es filas × loops
+    assert f"Seq Scan on aconex_docs ({21_034 * 61_240:,} filas en 61,240 loops)" in flags
+    assert f"Seq Scan on aconex_docs ({48_802 * 38_977:,} filas en 38,977 loops)" in flags
+    assert "Seq Scan on apsa_protocols (61,240 filas)" in flags
+
+
+def test_error_ss_plan_on_norm_columns_is_clean():
+    assert analyze_plan(GOOD_PLAN, WATCH) == []
+
+
+def test_correlated_subplan_is_flagged():
+    # aconex_subsistemas de /export/aconex-ss-errors: string_agg correlacionado por fila
+    plan = {
+        "Node Type": "Seq Scan", "Relation Name": "apsa_protocols", "Alias": "ap", "Actual Rows": 10, "Actual Loops": 1,
+        "Plans": [{
+            "Node Type": "Aggregate", "Parent Relationship": "SubPlan", "Subplan Name": "SubPlan 1",
+            "Actual Rows": 1, "Actual Loops": 2_314,
+            "Plans": [_seq_scan("aconex_docs", "acx_2", 3, 2_314, 48_799)],
+        }],
+    }
+    flags = analyze_plan(plan, {"aconex_docs"})
+    assert "SubPlan correlacionado SubPlan 1 (2,314 loops)" in flags
+    assert f"Seq Scan on aconex_docs ({3 * 2_314:,} filas en 2,314 loops)" in flags
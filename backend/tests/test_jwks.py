@@ -0,0 +1,151 @@
+"""
+JwksKeyStore contra un OIDC local (http.server): discovery + JWKS servidos
+desde un thread, con llaves RSA generadas en el test.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+from jwt.exceptions import PyJWKClientError
+
+from app.jwks import JwksKeyStore
+
+
+def _rsa_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def _jwk(private_key, kid: str) -> dict:
+    return {**json.loads(RSAAlgorithm.to_jwk(private_key.public_key())), "kid": kid, "use": "sig", "alg": "RS256"}
+
+
+class FakeOidc:
+    """Sirve /.well-known/openid-configuration y /keys; `keys` y `down` se cambian en caliente."""
+
+    def __init__(self):
+        self.keys: list[dict] = []
+        self.down = False
+        self.hits = {"discovery": 0, "jwks": 0}
+        oidc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if oidc.down:
+                    self.send_error(503)
+                    return
+                if self.path == "/.well-known/openid-configuration":
+                    oidc.hits["discovery"] += 1
+                    body = {"issuer": oidc.base, "jwks_uri": f"{oidc.base}/keys"}
+                elif self.path == "/keys":
+                    oidc.hits["jwks"] += 1
+                    body = {"keys": oidc.keys}
+                else:
+                    self.send_error(404)
+                    return
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.discovery_url = f"{self.base}/.well-known/openid-configuration"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(scope="module")
+def rsa_keys():
+    return {"k1": _rsa_key(), "k2": _rsa_key()}
+
+
+@pytest.fixture
+def oidc(rsa_keys):
+    server = FakeOidc()
+    server.keys = [_jwk(rsa_keys["k1"], "k1")]
+    yield server
+    server.close()
+
+
+def test_kid_lookup_verifies_token_without_network(oidc, rsa_keys):
+    store = JwksKeyStore(oidc.discovery_url, min_refetch_seconds=0, timeout=2)
+    token = jwt.encode({"sub": "u1"}, rsa_keys["k1"], algorithm="RS256", headers={"kid": "k1"})
+
+    key = store.get_signing_key(jwt.get_unverified_header(token)["kid"])
+    assert jwt.decode(token, key.key, algorithms=["RS256"])["sub"] == "u1"
+    assert oidc.hits == {"discovery": 1, "jwks": 1}
+
+    for _ in range(5):
+        store.get_signing_key("k1")
+    assert oidc.hits == {"discovery": 1, "jwks": 1}   # lookup en memoria
+    assert store.status()["hits"] == 5
+
+
+def test_unknown_kid_refetches_after_rotation(oidc, rsa_keys):
+    store = JwksKeyStore(oidc.discovery_url, min_refetch_seconds=0, timeout=2)
+    assert store.refresh()
+
+    oidc.keys = [_jwk(rsa_keys["k1"], "k1"), _jwk(rsa_keys["k2"], "k2")]   # Azure rota llaves
+    assert store.get_signing_key("k2").key_id == "k2"
+    assert oidc.hits["jwks"] == 2 and oidc.hits["discovery"] == 1
+    assert store.status()["unknown_kid_refetches"] == 1
+
+    with pytest.raises(PyJWKClientError):
+        store.get_signing_key("inventado")
+
+
+def test_unknown_kid_refetch_is_rate_limited(oidc):
+    store = JwksKeyStore(oidc.discovery_url, min_refetch_seconds=60, timeout=2)
+    assert store.refresh()
+    for _ in range(3):
+        with pytest.raises(PyJWKClientError):
+            store.get_signing_key("inventado")
+    assert oidc.hits["jwks"] == 1
+
+
+def test_stale_keys_are_served_while_revalidation_fails(oidc):
+    store = JwksKeyStore(oidc.discovery_url, refresh_seconds=1, min_refetch_seconds=0, timeout=2)
+    assert store.refresh()
+    oidc.down = True
+    store._fetched_at -= 10   # bastante más viejas que 2 × refresh_seconds
+
+    assert store.get_signing_key("k1").key_id == "k1"   # se sirve igual, sin esperar la red
+    deadline = time.monotonic() + 5
+    while store.status()["refresh_errors"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    status = store.status()
+    assert status["refresh_errors"] == 1 and status["last_error"]
+    assert status["kids"] == ["k1"]
+    assert store.get_signing_key("k1").key_id == "k1"
+
+    oidc.down = False
+    assert store.refresh()
+    assert store.status()["last_error"] is None
+
+
+def test_background_thread_picks_up_new_keys(oidc, rsa_keys):
+    store = JwksKeyStore(oidc.discovery_url, refresh_seconds=1, min_refetch_seconds=3600, timeout=2)
+    assert store.refresh()
+    oidc.keys = [_jwk(rsa_keys["k2"], "k2")]
+    store.start()
+    try:
+        deadline = time.monotonic() + 5
+        while "k2" not in store.status()["kids"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert store.status()["kids"] == ["k2"]
+        assert store.get_signing_key("k2").key_id == "k2"
+    finally:
+        store.stop()
@@ -0,0 +1,99 @@
+"""
+Columnas *_norm: planes antes/después y SQL de los endpoints migrados.
+
+Los planes son EXPLAIN (ANALYZE, FORMAT JSON) con la forma que producen las
+consultas con normalización en runtime (N(col) = REPLACE/UPPER/TRIM, no
+indexable) y las mismas sobre *_norm (scripts/explain_normalized_queries.py
+los captura contra una BD real). Aquí se verifica que analyze_plan() marca
+el anti-join y los Seq Scan en el "antes" y nada en el "después", y que las
+consultas que arman hoy los endpoints comparan *_norm y no N(...).
+"""
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app import main
+from app.auto_explain import analyze_plan
+from app.explain import seq_scanned_tables
+from app.normalization import norm_sql_text, normalize_code
+from test_auto_explain import BAD_PLAN as ERROR_SS_BEFORE, GOOD_PLAN as ERROR_SS_AFTER, N_COD, N_DOC, WATCH
+
+# /aconex/unmatched: NOT EXISTS (apsa con el mismo código) por cada doc ACONEX
+UNMATCHED_BEFORE = {
+    "Node Type": "Nested Loop", "Join Type": "Anti", "Actual Rows": 9_825, "Actual Loops": 1,
+    "Join Filter": f"({N_COD} = {N_DOC})", "Rows Removed by Join Filter": 2_386_911_024,
+    "Plans": [
+        {"Node Type": "Seq Scan", "Parent Relationship": "Outer", "Relation Name": "aconex_docs", "Alias": "acx",
+         "Filter": "(acx.load_id = 13)", "Actual Rows": 48_802, "Actual Loops": 1},
+        {"Node Type": "Seq Scan", "Parent Relationship": "Inner", "Relation Name": "apsa_protocols", "Alias": "ap",
+         "Filter": "(ap.load_id = 12)", "Actual Rows": 61_240, "Actual Loops": 48_802},
+    ],
+}
+UNMATCHED_AFTER = {
+    "Node Type": "Hash Join", "Join Type": "Anti", "Actual Rows": 9_825, "Actual Loops": 1,
+    "Hash Cond": "(acx.document_no_norm = ap.codigo_cmdic_norm)",
+    "Plans": [
+        {"Node Type": "Index Scan", "Parent Relationship": "Outer", "Index Name": "idx_aconex_latest_doc_norm",
+         "Relation Name": "aconex_docs", "Alias": "acx", "Index Cond": "(acx.load_id = 13)",
+         "Actual Rows": 48_802, "Actual Loops": 1},
+        {"Node Type": "Hash", "Parent Relationship": "Inner", "Actual Rows": 61_240, "Actual Loops": 1,
+         "Plans": [{"Node Type": "Index Only Scan", "Parent Relationship": "Outer", "Index Name": "idx_apsa_load_codigo_norm",
+                    "Relation Name": "apsa_protocols", "Alias": "ap", "Index Cond": "(ap.load_id = 12)",
+                    "Actual Rows": 61_240, "Actual Loops": 1}]},
+    ],
+}
+
+PLANS = {
+    "error_ss": (ERROR_SS_BEFORE, ERROR_SS_AFTER),
+    "aconex_unmatched": (UNMATCHED_BEFORE, UNMATCHED_AFTER),
+}
+
+
+def _nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from _nodes(child)
+
+
+@pytest.mark.parametrize("name", sorted(PLANS))
+def test_runtime_normalization_plan_is_flagged(name):
+    before, _ = PLANS[name]
+    flags = analyze_plan(before, WATCH)
+    assert any(f.startswith("Nested Loop Anti Join") for f in flags), flags
+    assert any(f.startswith("Seq Scan on aconex_docs") for f in flags), flags
+    assert seq_scanned_tables({"Plan": before}) & WATCH
+
+
+@pytest.mark.parametrize("name", sorted(PLANS))
+def test_norm_columns_plan_has_no_anti_join_loop_or_seq_scan(name):
+    _, after = PLANS[name]
+    assert analyze_plan(after, WATCH) == []
+    assert not seq_scanned_tables({"Plan": after}) & WATCH
+    conds = " ".join(n.get(k, "") for n in _nodes(after) for k in ("Hash Cond", "Index Cond", "Join Filter"))
+    assert "_norm" in conds and "replace(" not in conds
+
+
+def _sql(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.dialect())).lower()
+
+
+@pytest.mark.parametrize("stmt", [
+    pytest.param(main._unmatched_export_query(12, 13, False), id="aconex_unmatched"),
+    pytest.param(main._ss_errors_query(12, 13), id="export_aconex_ss_errors"),
+])
+def test_endpoint_queries_compare_norm_columns(stmt):
+    sql = _sql(stmt)
+    assert "codigo_cmdic_norm = aconex_docs.document_no_norm" in sql or \
+        "document_no_norm = apsa_protocols.codigo_cmdic_norm" in sql
+    assert "replace(" not in sql
+
+
+def test_duplicate_key_uses_norm_column():
+    key, not_empty = main._aconex_duplicate_key(False)
+    assert key is main.AconexDoc.document_no_norm
+    assert "replace(" not in _sql(not_empty)
+
+
+def test_python_and_sql_normalization_agree():
+    # la misma regla en la columna GENERATED y en la ingesta (antes _norm_sql no quitaba "_")
+    assert normalize_code(" ab-12_3 4 ") == "AB1234"
+    assert norm_sql_text("document_no") == "UPPER(TRIM(REPLACE(REPLACE(REPLACE(document_no, ' ', ''), '-', ''), '_', '')))"
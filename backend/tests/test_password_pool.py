@@ -0,0 +1,48 @@
+"""
+password_pool: timeout → PoolBusy (503, no 500) y el cupo se retiene hasta
+que el hijo termina. Usa time.sleep como operación (picklable, sin Argon2).
+"""
+import time
+
+import pytest
+
+from app import password_pool
+from app.config import get_settings
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    s = get_settings()
+    monkeypatch.setattr(s, "PASSWORD_POOL_WORKERS", 1)
+    monkeypatch.setattr(s, "PASSWORD_POOL_MAX_QUEUE", 0)
+    monkeypatch.setattr(password_pool, "_slots", None)
+    monkeypatch.setattr(password_pool, "_in_flight", 0)
+    monkeypatch.setattr(password_pool, "_counts", dict.fromkeys(password_pool._counts, 0))
+    password_pool._reset_executor()
+    yield password_pool
+    password_pool._reset_executor()
+
+
+def test_timeout_raises_pool_busy_and_keeps_slot_until_done(pool, monkeypatch):
+    assert pool._run("hash", time.sleep, 0.0) is None   # arranca el forkserver con el timeout normal
+    monkeypatch.setattr(get_settings(), "PASSWORD_POOL_TIMEOUT_SECONDS", 0.2)
+
+    with pytest.raises(pool.PoolBusy):
+        pool._run("hash", time.sleep, 1.0)
+    assert pool.stats()["timeouts"] == 1
+    # el hijo sigue ocupado: el cupo no se liberó al expirar la espera
+    assert pool.stats()["in_flight"] == 1
+    with pytest.raises(pool.PoolBusy):
+        pool._run("hash", time.sleep, 0.0)
+    assert pool.stats()["rejected"] == 1
+
+    deadline = time.monotonic() + 5
+    while pool.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert pool.stats()["in_flight"] == 0
+    assert pool._run("hash", time.sleep, 0.0) is None
+
+
+def test_executor_uses_forkserver_or_spawn(pool):
+    method = pool._get_executor()._mp_context.get_start_method()
+    assert method in ("forkserver", "spawn")
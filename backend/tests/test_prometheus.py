@@ -0,0 +1,151 @@
+"""
+prometheus.render(): la salida debe ser texto de exposición 0.0.4 válido.
+
+Se alimenta con LatencyHistogram reales (sin BD) y se parsea cada línea
+contra la gramática del formato.
+"""
+import math
+import random
+import re
+import threading
+
+import pytest
+
+from app import prometheus
+from app.timing import LatencyHistogram
+
+_NAME = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+_LABEL = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*"'
+_VALUE = r"[+-]?(?:Inf|NaN|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)"
+SAMPLE_RE = re.compile(rf"^(?P<name>{_NAME})(?:\{{(?P<labels>{_LABEL}(?:,{_LABEL})*,?)?\}})? (?P<value>{_VALUE})(?: -?\d+)?$")
+HELP_RE = re.compile(rf"^# HELP (?P<name>{_NAME})(?: .*)?$")
+TYPE_RE = re.compile(rf"^# TYPE (?P<name>{_NAME}) (?P<type>counter|gauge|histogram|summary|untyped)$")
+LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\\n]|\\[\\"n])*)"')
+
+
+def _float(v: str) -> float:
+    return float(v.replace("Inf", "inf"))
+
+
+def parse(text: str) -> tuple[dict, list]:
+    """(tipos por familia, [(nombre, labels, valor)]); falla si alguna línea no cumple la gramática."""
+    assert text.endswith("\n")
+    types, samples = {}, []
+    for line in text.splitlines():
+        if line.startswith("#"):
+            if HELP_RE.match(line):
+                continue
+            m = TYPE_RE.match(line)
+            assert m, f"comentario inválido: {line!r}"
+            assert m["name"] not in types, f"TYPE repetido: {m['name']}"
+            types[m["name"]] = m["type"]
+            continue
+        m = SAMPLE_RE.match(line)
+        assert m, f"línea inválida: {line!r}"
+        labels = dict(LABEL_RE.findall(m["labels"] or ""))
+        samples.append((m["name"], labels, _float(m["value"])))
+    return types, samples
+
+
+def _family(name: str, types: dict) -> str:
+    for suffix in ("_bucket", "_sum", "_count"):
+        base = name[: -len(suffix)]
+        if name.endswith(suffix) and types.get(base) == "histogram":
+            return base
+    return name
+
+
+class FakePool:
+    def __init__(self):
+        self.wait_lock = threading.Lock()
+        self.wait_hist = LatencyHistogram()
+        self.wait_timeouts = 2
+
+    def size(self):
+        return 5
+
+    def checkedout(self):
+        return 3
+
+    def overflow(self):
+        return -2
+
+
+@pytest.fixture
+def text(monkeypatch):
+    monkeypatch.setattr(prometheus, "_requests", {})
+    monkeypatch.setattr(prometheus, "_ingest", {})
+    rng = random.Random(7)
+    for _ in range(500):
+        prometheus.record_request("GET", "/apsa/list", 200, rng.lognormvariate(-3, 1))
+    for _ in range(20):
+        prometheus.record_request("POST", '/ruta/"rara"\\x\n', 500, rng.uniform(0, 60))
+    prometheus.record_ingest("apsa", 1000, 2.5)
+
+    sql = LatencyHistogram()
+    for _ in range(300):
+        sql.record(rng.expovariate(200))
+    pool = FakePool()
+    for _ in range(50):
+        pool.wait_hist.record(rng.expovariate(50))
+
+    return prometheus.render(
+        statements=[("abc123", "SELECT * FROM apsa_protocols WHERE id = $1", sql)],
+        caches={"count": {"hits": 9, "misses": 1}, "token": {"hits": 0, "misses": 0}},
+        pool=pool,
+        extra_gauges=[("quality_password_pool_in_flight", "en vuelo", 1, {})],
+        extra_counters=[("quality_password_pool_rejected_total", "rechazadas", 4, {})],
+    )
+
+
+def test_every_line_matches_exposition_grammar(text):
+    types, samples = parse(text)
+    assert samples
+    for name, _, _ in samples:
+        assert _family(name, types) in types, f"{name} sin # TYPE"
+
+
+def test_counters_end_in_total(text):
+    types, samples = parse(text)
+    for name, kind in types.items():
+        if kind == "counter":
+            assert name.endswith("_total"), name
+    assert types["quality_password_pool_rejected_total"] == "counter"
+    assert ("quality_password_pool_rejected_total", {}, 4.0) in samples
+
+
+def test_label_values_are_escaped(text):
+    _, samples = parse(text)
+    routes = {labels.get("route") for _, labels, _ in samples}
+    assert '/ruta/\\"rara\\"\\\\x\\n' in routes
+
+
+def test_histogram_buckets_are_cumulative_and_inf_equals_count(text):
+    types, samples = parse(text)
+    series: dict[tuple, dict] = {}
+    for name, labels, value in samples:
+        family = _family(name, types)
+        if types.get(family) != "histogram":
+            continue
+        key = (family, tuple(sorted((k, v) for k, v in labels.items() if k != "le")))
+        s = series.setdefault(key, {"buckets": []})
+        if name.endswith("_bucket"):
+            s["buckets"].append((_float(labels["le"]), value))
+        else:
+            s[name[len(family) + 1:]] = value
+
+    assert {k[0] for k in series} == {
+        "quality_http_request_duration_seconds",
+        "quality_sql_statement_duration_seconds",
+        "quality_db_pool_wait_seconds",
+    }
+    for key, s in series.items():
+        bounds = [le for le, _ in s["buckets"]]
+        counts = [n for _, n in s["buckets"]]
+        assert bounds == sorted(bounds) and len(set(bounds)) == len(bounds), key
+        assert math.isinf(bounds[-1]), key
+        assert counts == sorted(counts), f"buckets no acumulativos en {key}"
+        assert counts[-1] == s["count"], key
+        assert s["sum"] >= 0
+    http_ok = series[("quality_http_request_duration_seconds", (("method", "GET"), ("route", "/apsa/list"), ("status", "200")))]
+    assert http_ok["count"] == 500
@@ -0,0 +1,67 @@
+"""
+utils.revision_sort_key / latest_revision_flags: qué fila de ACONEX queda
+como última revisión (is_latest) por documento.
+"""
+import pytest
+
+from app.utils import latest_revision_flags, revision_sort_key
+
+
+@pytest.mark.parametrize("older, newer", [
+    ("0", "1"),
+    ("9", "10"),         # numérico, no lexicográfico
+    ("Z", "0"),          # numéricas (aprobadas) después de las alfabéticas
+    ("A", "B"),
+    ("Z", "AA"),         # más letras = posterior
+    ("A1", "A2"),
+    ("A9", "A10"),
+    ("", "A"),
+    (None, "0"),
+    ("nan", "A"),
+    ("P-1", "A"),        # formato desconocido: antes de cualquier letra válida
+])
+def test_revision_order(older, newer):
+    assert revision_sort_key(older) < revision_sort_key(newer)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("1", "1.0"),        # Excel convierte 1 → 1.0
+    ("1", 1),
+    ("b", "B"),
+    (" b ", "B"),
+    ("a2", "A2"),
+    ("02", "2"),
+    (None, "  "),
+    ("NULL", "none"),
+])
+def test_equivalent_revisions(a, b):
+    assert revision_sort_key(a) == revision_sort_key(b)
+
+
+def test_latest_per_document_with_interleaved_keys():
+    keys = ["DOC1", "DOC2", "DOC1", "DOC3", "DOC2", "DOC1"]
+    revs = ["A",    "0",    "1",    "B",    "C",    "B"]
+    assert latest_revision_flags(keys, revs) == [False, True, True, True, False, False]
+
+
+def test_mixed_case_and_whitespace_revisions_group_as_one():
+    # misma revisión escrita distinto: gana la posterior en el archivo
+    assert latest_revision_flags(["D", "D", "D"], ["b", " B ", "a"]) == [False, True, False]
+
+
+def test_date_breaks_ties_within_same_revision():
+    keys, revs = ["D", "D", "D"], ["1", "1.0", "1"]
+    assert latest_revision_flags(keys, revs, [300.0, 100.0, 200.0]) == [True, False, False]
+    # sin fecha pierde contra una con fecha
+    assert latest_revision_flags(keys, revs, [None, 100.0, None]) == [False, True, False]
+    # sin fechas: la fila posterior
+    assert latest_revision_flags(keys, revs, [None, None, None]) == [False, False, True]
+    assert latest_revision_flags(keys, revs, [50.0, 50.0, 50.0]) == [False, False, True]
+
+
+def test_revision_beats_date():
+    assert latest_revision_flags(["D", "D"], ["2", "1"], [100.0, 999.0]) == [True, False]
+
+
+def test_empty_keys_are_not_grouped():
+    assert latest_revision_flags(["", None, "D", "D"], ["0", "1", "A", "B"]) == [True, True, False, True]
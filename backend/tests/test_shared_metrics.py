@@ -0,0 +1,89 @@
+"""
+shared_metrics: las series de sql_trace, slow_requests y prometheus pasan
+por el segmento (encode/decode) y render()/statement_stats()/entries() las
+suman a las del proceso actual.
+"""
+import pytest
+
+from app import prometheus, shared_metrics, slow_requests, sql_trace
+from app.timing import LatencyHistogram
+
+
+def _hist(*seconds) -> LatencyHistogram:
+    h = LatencyHistogram()
+    for s in seconds:
+        h.record(s)
+    return h
+
+
+def _worker_series() -> dict:
+    return {
+        "endpoints": {"metrics_cards": _hist(0.2)},
+        "queries": {"metrics_cards": {"error_ss": _hist(0.1, 0.3)}},
+        "requests": {("GET", "/apsa/list", "200"): _hist(0.01, 0.02, 0.03)},
+        "ingest": {"apsa": {"rows": 1000, "seconds": 2.0, "loads": 1, "last_rps": 500.0, "last_ts": 10.0}},
+        "process": {"caches": {"count": {"hits": 3, "misses": 1}},
+                    "counters": [["quality_password_pool_rejected_total", "rechazadas", 2, {}]]},
+        "statements": {"abc123": {"sql": "SELECT ? FROM apsa_protocols", "hist": _hist(0.004, 0.005), "rows": 7}},
+        "n_plus_one": {("GET /apsa/list", "abc123"): {"sql": "SELECT ?", "occurrences": 2, "max_per_request": 40}},
+        "slow": [{"route": "/metrics/cards", "duration_ms": 2500.0, "pid": 4242}],
+    }
+
+
+@pytest.fixture
+def clean(monkeypatch):
+    monkeypatch.setattr(prometheus, "_requests", {})
+    monkeypatch.setattr(prometheus, "_ingest", {})
+    monkeypatch.setattr(sql_trace, "_statements", {})
+    monkeypatch.setattr(sql_trace, "_n_plus_one", {})
+    monkeypatch.setattr(slow_requests, "_entries", None)
+
+
+def test_segment_roundtrip_keeps_every_series():
+    payload, truncated = shared_metrics._encode(_worker_series(), 1 << 20)
+    assert not truncated
+    got = shared_metrics._decode(payload)
+    assert set(got) == set(shared_metrics.SERIES)
+    assert got["requests"][("GET", "/apsa/list", "200")].count == 3
+    assert got["statements"]["abc123"]["rows"] == 7
+    assert got["statements"]["abc123"]["hist"].count == 2
+    assert got["n_plus_one"][("GET /apsa/list", "abc123")]["max_per_request"] == 40
+    assert got["slow"][0]["pid"] == 4242
+    assert got["ingest"]["apsa"]["rows"] == 1000
+    assert got["queries"]["metrics_cards"]["error_ss"].count == 2
+
+
+def test_full_segment_drops_slow_requests_first():
+    series = _worker_series()
+    full, _ = shared_metrics._encode(series, 1 << 20)
+    payload, truncated = shared_metrics._encode(series, len(full) - 1)
+    assert truncated
+    got = shared_metrics._decode(payload)
+    assert got["slow"] == [] and got["statements"]["abc123"]["rows"] == 7
+
+
+def test_reads_merge_other_workers(clean):
+    other = shared_metrics._decode(shared_metrics._encode(_worker_series(), 1 << 20)[0])
+
+    sql_trace._record_global("abc123", "SELECT ? FROM apsa_protocols", 0.006, 3)
+    stats = sql_trace.statement_stats(others=[(other["statements"], other["n_plus_one"])])
+    assert stats[0]["calls"] == 3 and stats[0]["rows"] == 10
+    assert sql_trace.n_plus_one(others=[(other["statements"], other["n_plus_one"])])[0]["occurrences"] == 2
+
+    slow_requests._buffer().append({"route": "/apsa/list", "duration_ms": 1200.0, "pid": 1})
+    assert [e["pid"] for e in slow_requests.entries(others=[other["slow"]])] == [4242, 1]
+
+    prometheus.record_request("GET", "/apsa/list", 200, 0.04)
+    prometheus.record_ingest("apsa", 500, 1.0)
+    text = prometheus.render(
+        caches={"count": {"hits": 1, "misses": 1}},
+        extra_counters=[("quality_password_pool_rejected_total", "rechazadas", 1, {})],
+        others=[(other["requests"], other["ingest"], other["process"])],
+    )
+    lines = set(text.splitlines())
+    assert 'quality_http_request_duration_seconds_count{method="GET",route="/apsa/list",status="200"} 4' in lines
+    assert 'quality_ingest_rows_total{source="apsa"} 1500' in lines
+    assert 'quality_ingest_loads_total{source="apsa"} 2' in lines
+    assert 'quality_cache_hits_total{cache="count"} 4' in lines
+    assert "quality_password_pool_rejected_total 3" in lines
+    assert text.count("# TYPE quality_password_pool_rejected_total counter") == 1